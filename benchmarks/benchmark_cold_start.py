@@ -0,0 +1,85 @@
+"""
+cold start of short lived processes : where the time of a 'configmagick parse' in a fresh interpreter goes
+
+    python3 benchmarks/benchmark_cold_start.py [runs]
+
+measured in fresh interpreters : the import of the parser modules, the parser construction, the parse of tests/updatedb.conf,
+and the wall time of a whole 'configmagick parse tests/updatedb.conf' - once building the parser ('build'),
+once loading the prebuilt parser artifact ('artifact', see lib_grammar_artifact, opt in with --grammar-artifacts).
+unpickling a parser recompiles its regexes, so the artifact only pays off for grammars which are expensive to walk.
+
+"""
+
+# STDLIB
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+path_repository = pathlib.Path(__file__).resolve().parent.parent
+path_test_file = path_repository / 'tests' / 'updatedb.conf'
+
+# prints the seconds of the phases of a cold parse in a fresh interpreter, argv[1] : the file to parse, argv[2] : the artifact directory or ''
+phases_script = """
+import json, sys, time
+start_time = time.perf_counter()
+from configmagick import grammar_basic, lib_parse
+lib_parse.default_parser_cache.artifact_directory = sys.argv[2] or None
+import_time = time.perf_counter()
+grammar = grammar_basic.GrammarUpdateDbConf()
+lib_parse.get_parser(grammar)
+parser_time = time.perf_counter()
+lib_parse.get_file_semantic(sys.argv[1], grammar)
+parse_time = time.perf_counter()
+print(json.dumps({'import': import_time - start_time, 'parser': parser_time - import_time, 'parse': parse_time - parser_time}))
+"""
+
+
+def get_environment() -> Dict[str, str]:
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(path for path in (str(path_repository), environment.get('PYTHONPATH', '')) if path)
+    return environment
+
+
+def get_phase_seconds(artifact_directory: str) -> Dict[str, float]:
+    output = subprocess.run([sys.executable, '-c', phases_script, str(path_test_file), artifact_directory], env=get_environment(),
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    phase_seconds = json.loads(output)      # type: Dict[str, float]
+    return phase_seconds
+
+
+def get_cli_seconds(cli_options: List[str]) -> float:
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'configmagick', 'parse', str(path_test_file)] + cli_options, env=get_environment(),
+                   check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+
+def main(runs: int = 20) -> None:
+    with tempfile.TemporaryDirectory() as artifact_directory:
+        get_phase_seconds(artifact_directory)       # writes the artifact
+        modes = {'build': ('', []), 'artifact': (artifact_directory, ['--grammar-artifacts', artifact_directory])}
+        phase_runtimes = {mode: dict() for mode in modes}      # type: Dict[str, Dict[str, float]]
+        cli_runtimes = {mode: float('inf') for mode in modes}
+        for _ in range(runs):
+            # alternating runs, so both modes see the same machine load
+            for mode, (directory, cli_options) in modes.items():
+                for phase, seconds in get_phase_seconds(directory).items():
+                    phase_runtimes[mode][phase] = min(seconds, phase_runtimes[mode].get(phase, seconds))
+                cli_runtimes[mode] = min(cli_runtimes[mode], get_cli_seconds(cli_options))
+
+    print('best of {runs} fresh interpreters'.format(runs=runs))
+    for mode in modes:
+        print(mode)
+        for phase, seconds in phase_runtimes[mode].items():
+            print('    {phase:<20}{milliseconds:>10.2f} ms{share:>8.1f} %'.format(
+                phase=phase, milliseconds=seconds * 1000, share=seconds / cli_runtimes[mode] * 100))
+        print('    {phase:<20}{milliseconds:>10.2f} ms'.format(phase='configmagick parse', milliseconds=cli_runtimes[mode] * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(argument) for argument in sys.argv[1:2]])
@@ -0,0 +1,49 @@
+"""
+parse speed with and without the fused terminal rules (lib_grammar_optimizer), on tests/updatedb.conf scaled up
+
+    python3 benchmarks/benchmark_grammar_optimizer.py [copies]
+
+"""
+
+# STDLIB
+import gc
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# EXT
+import arpeggio                                     # noqa: E402
+
+# PROJ
+from configmagick import grammar_basic              # noqa: E402
+from configmagick import lib_grammar_optimizer      # noqa: E402
+
+
+def main(copies: int = 500, repeat: int = 10) -> None:
+    string_data = (pathlib.Path(__file__).resolve().parent.parent / 'tests' / 'updatedb.conf').read_text() * copies
+    grammar_class = grammar_basic.GrammarUpdateDbConf
+    parser = arpeggio.ParserPython(grammar_class.grammar, ws=grammar_class.whitespace)
+    parser_optimized = arpeggio.ParserPython(grammar_class.grammar, ws=grammar_class.whitespace)
+    fused_names = lib_grammar_optimizer.optimize_parser(parser_optimized)
+    assert parser.parse(string_data).tree_str() == parser_optimized.parse(string_data).tree_str()
+
+    print('test data : {copies} x tests/updatedb.conf, {size:.1f} MB'.format(copies=copies, size=len(string_data) / 1E6))
+    print('fused : {fused_names}'.format(fused_names=', '.join(fused_names)))
+    runtimes = {'original': float('inf'), 'fused': float('inf')}
+    for _ in range(repeat):
+        # alternating runs, so both see the same machine load
+        for name, test_parser in (('original', parser), ('fused', parser_optimized)):
+            gc.collect()
+            start_time = time.perf_counter()
+            test_parser.parse(string_data)
+            runtimes[name] = min(runtimes[name], time.perf_counter() - start_time)
+    print('{name:<12}{runtime:>12}'.format(name='parser', runtime='seconds'))
+    for name, runtime in runtimes.items():
+        print('{name:<12}{runtime:>12.3f}'.format(name=name, runtime=runtime))
+    print('speedup : {speedup:.2f}x'.format(speedup=runtimes['original'] / runtimes['fused']))
+
+
+if __name__ == '__main__':
+    main(*[int(argument) for argument in sys.argv[1:2]])
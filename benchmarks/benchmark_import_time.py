@@ -0,0 +1,124 @@
+"""
+import time regression check : 'import configmagick' and 'configmagick --help' must not load the parser stack,
+and must stay within a time budget - so they can be used in tight shell loops
+
+    python3 benchmarks/benchmark_import_time.py
+    python3 benchmarks/benchmark_import_time.py --import-budget 5 --help-budget 150 --runs 20
+
+the exit code is 1 if a heavy module is imported, or the best of the runs exceeds a budget (milliseconds)
+
+"""
+
+# STDLIB
+import argparse
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+path_repository = pathlib.Path(__file__).resolve().parent.parent
+
+# modules which must only be loaded on first use
+heavy_modules = ('arpeggio', 'lib_log_utils', 'lib_path', 'configmagick.grammar_basic', 'configmagick.lib_parse', 'configmagick.lib_profile')
+
+# the statements under test
+import_statement = 'import configmagick'
+help_statement = 'import sys; sys.argv[1:] = ["--help"]; import runpy; runpy.run_module("configmagick", run_name="__main__")'
+
+
+def get_environment() -> Dict[str, str]:
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(path for path in (str(path_repository), environment.get('PYTHONPATH', '')) if path)
+    return environment
+
+
+def parse_importtime(importtime_output: str) -> Dict[str, int]:
+    """ module name -> cumulative import time in microseconds, from the output of 'python -X importtime'
+
+    >>> parse_importtime('import time: self [us] | cumulative | imported package\\n'
+    ...                  'import time:       100 |        100 |   arpeggio.utils\\n'
+    ...                  'import time:      1200 |       1300 | arpeggio\\n')
+    {'arpeggio.utils': 100, 'arpeggio': 1300}
+
+    """
+    import_times = dict()
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, module_name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            import_times[module_name.strip()] = int(cumulative)
+    return import_times
+
+
+def get_import_times(statement: str) -> Dict[str, int]:
+    """ the modules imported by the statement in a fresh interpreter, with their cumulative import time in microseconds """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], env=get_environment(),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    return parse_importtime(process.stderr)
+
+
+def get_imported_modules(statement: str) -> List[str]:
+    """ the modules loaded after the statement in a fresh interpreter - from sys.modules, because -X importtime
+    does not report the modules imported by importlib.import_module or 'from . import module' """
+    # finally : 'configmagick --help' ends with SystemExit
+    script = 'try:\n    {statement}\nfinally:\n    import sys\n    print("\\n".join(sys.modules), file=sys.stderr)'.format(statement=statement)
+    process = subprocess.run([sys.executable, '-c', script], env=get_environment(),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return process.stderr.splitlines()
+
+
+def get_heavy_imports(statement: str) -> List[str]:
+    """ the heavy modules imported by the statement
+
+    >>> get_heavy_imports(import_statement)
+    []
+    >>> get_heavy_imports(help_statement)
+    []
+    >>> get_heavy_imports('import configmagick; configmagick.Config')
+    []
+    >>> get_heavy_imports('import configmagick; configmagick.Config()')
+    ['arpeggio', 'configmagick.grammar_basic', 'configmagick.lib_parse']
+
+    """
+    return sorted(module_name for module_name in get_imported_modules(statement) if module_name in heavy_modules)
+
+
+def get_wall_seconds(statement: str) -> float:
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, '-c', statement], env=get_environment(), stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start_time
+
+
+def main(sys_argv: List[str] = sys.argv[1:]) -> int:
+    parser = argparse.ArgumentParser(description='configmagick import time regression check')
+    parser.add_argument('--import-budget', type=float, default=10.0, help='milliseconds for the cumulative import of configmagick')
+    parser.add_argument('--help-budget', type=float, default=200.0, help='milliseconds wall time of a whole "configmagick --help" process')
+    parser.add_argument('--runs', type=int, default=10, help='the best of runs fresh interpreters is taken')
+    arguments = parser.parse_args(sys_argv)
+
+    failures = list()
+    for statement in (import_statement, help_statement):
+        for module_name in get_heavy_imports(statement):
+            failures.append('{statement!r} imports {module_name}'.format(statement=statement, module_name=module_name))
+
+    import_ms = min(get_import_times(import_statement).get('configmagick', 0) for _ in range(arguments.runs)) / 1000
+    interpreter_ms = min(get_wall_seconds('pass') for _ in range(arguments.runs)) * 1000
+    help_ms = min(get_wall_seconds(help_statement) for _ in range(arguments.runs)) * 1000
+    print('import configmagick    : {milliseconds:8.2f} ms (budget {budget} ms)'.format(milliseconds=import_ms, budget=arguments.import_budget))
+    print('configmagick --help    : {milliseconds:8.2f} ms (budget {budget} ms)'.format(milliseconds=help_ms, budget=arguments.help_budget))
+    print('bare interpreter       : {milliseconds:8.2f} ms'.format(milliseconds=interpreter_ms))
+    if import_ms > arguments.import_budget:
+        failures.append('import configmagick took {milliseconds:.2f} ms'.format(milliseconds=import_ms))
+    if help_ms > arguments.help_budget:
+        failures.append('configmagick --help took {milliseconds:.2f} ms'.format(milliseconds=help_ms))
+
+    for failure in failures:
+        print('REGRESSION ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+memory benchmark : semantic objects versus the offset based span table (lib_span)
+
+    python3 benchmarks/benchmark_memory_spans.py [number_of_lines]
+
+"""
+
+# STDLIB
+import gc
+import pathlib
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# PROJ
+from configmagick import grammar_basic      # noqa: E402
+from configmagick import lib_parse          # noqa: E402
+from configmagick import lib_span           # noqa: E402
+
+
+def get_test_data(number_of_lines: int) -> str:
+    """ updatedb style data, a mix of long value lists, comment blocks and empty lines
+
+    >>> get_test_data(4)
+    '# comment 0\\nKEY_1="/path/1/0 /path/1/1 /path/1/2 /path/1/3 /path/1/4 /path/1/5 /path/1/6 /path/1/7"\\n\\nKEY_3="/path/3/0 ... /path/3/7"\\n'
+
+    """
+    lines = list()
+    for line_number in range(number_of_lines):
+        if line_number % 4 == 0:
+            lines.append('# comment {line_number}\n'.format(line_number=line_number))
+        elif line_number % 4 == 2:
+            lines.append('\n')
+        else:
+            values = ' '.join('/path/{line_number}/{index}'.format(line_number=line_number, index=index) for index in range(8))
+            lines.append('KEY_{line_number}="{values}"\n'.format(line_number=line_number, values=values))
+    return ''.join(lines)
+
+
+def measure(function: Callable[[], Any]) -> Tuple[Any, int, float]:
+    """ returns the result, the memory retained by the result and the runtime.
+    tracemalloc slows down the allocations a lot, so the runtime is measured in a separate run """
+    gc.collect()
+    start_time = time.perf_counter()
+    function()
+    runtime = time.perf_counter() - start_time
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, runtime
+
+
+def main(number_of_lines: int = 200000) -> None:
+    string_data = get_test_data(number_of_lines)
+    grammar = grammar_basic.GrammarUpdateDbConf()
+    print('test data : {lines} lines, {size:.1f} MB'.format(lines=number_of_lines, size=len(string_data) / 1E6))
+
+    semantic_data, retained_objects, runtime_objects = measure(lambda: lib_parse.get_semantic_data_from_string(string_data, grammar, backend='scanner'))
+    del semantic_data
+    span_table, retained_spans, runtime_spans = measure(lambda: lib_span.scan_spans(string_data))
+    print('{name:<30}{memory:>12}{runtime:>12}'.format(name='representation', memory='MB', runtime='seconds'))
+    print('{name:<30}{memory:>12.1f}{runtime:>12.3f}'.format(name='semantic objects (scanner)', memory=retained_objects / 1E6, runtime=runtime_objects))
+    print('{name:<30}{memory:>12.1f}{runtime:>12.3f}'.format(name='span table', memory=retained_spans / 1E6, runtime=runtime_spans))
+    print('reduction : {factor:.1f}x ({spans} spans)'.format(factor=retained_objects / max(retained_spans, 1), spans=len(span_table)))
+
+
+if __name__ == '__main__':
+    main(*[int(argument) for argument in sys.argv[1:2]])
@@ -0,0 +1,73 @@
+"""
+load time of a binary snapshot (lib_snapshot) against parsing the text again, on a synthetic config
+
+    python3 benchmarks/benchmark_snapshot.py [size, like 1M]
+
+'snapshot load' creates all the semantic objects, 'snapshot query' maps the snapshot file and reads the values of one key.
+
+"""
+
+# STDLIB
+import gc
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# PROJ
+import config_generator                     # type: ignore # noqa: E402
+from configmagick import grammar_basic      # noqa: E402
+from configmagick import lib_parse          # noqa: E402
+from configmagick import lib_snapshot       # noqa: E402
+
+
+def get_best_seconds(function: Callable[[], Any], repeat: int) -> float:
+    best_seconds = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        function()
+        best_seconds = min(best_seconds, time.perf_counter() - start_time)
+    return best_seconds
+
+
+def main(size: int = 1024 * 1024, repeat: int = 5) -> None:
+    string_data = config_generator.get_config_data(size)
+    grammar = grammar_basic.GrammarUpdateDbConf()
+    semantic_data = lib_parse.get_semantic_data_from_string(string_data, grammar)
+    snapshot_data = lib_snapshot.dump_snapshot(semantic_data, grammar)
+    assert not lib_parse.get_semantic_data_difference(semantic_data, lib_snapshot.load_snapshot(snapshot_data, grammar))
+    key = str(semantic_data[-1].key) if isinstance(semantic_data[-1], grammar_basic.GrammarUpdateDbConf.AssignMultipleValuesQuoted) else 'KEY_0'
+
+    test_directory = pathlib.Path(tempfile.mkdtemp())
+    try:
+        path_snapshot = test_directory / 'config.snapshot'
+        lib_snapshot.save_snapshot(path_snapshot, semantic_data, grammar)
+
+        def query_snapshot() -> None:
+            with lib_snapshot.SemanticSnapshot.open(path_snapshot, grammar) as snapshot:
+                if key in snapshot.keys():
+                    snapshot.get_values(key)
+
+        print('test data : {size:.1f} MB text, {records} records, snapshot {snapshot_size:.1f} MB'.format(
+            size=len(string_data) / 1E6, records=len(semantic_data), snapshot_size=len(snapshot_data) / 1E6))
+        runtimes = [('parse (arpeggio)', get_best_seconds(lambda: lib_parse.get_semantic_data_from_string(string_data, grammar), repeat)),
+                    ('parse (scanner)', get_best_seconds(lambda: lib_parse.get_semantic_data_from_string(string_data, grammar, backend='scanner'), repeat)),
+                    ('snapshot dump', get_best_seconds(lambda: lib_snapshot.dump_snapshot(semantic_data, grammar), repeat)),
+                    ('snapshot load', get_best_seconds(lambda: lib_snapshot.load_snapshot(snapshot_data, grammar), repeat)),
+                    ('snapshot query', get_best_seconds(query_snapshot, repeat))]
+    finally:
+        shutil.rmtree(str(test_directory))
+
+    parse_seconds = runtimes[0][1]
+    print('{name:<24}{runtime:>12}{speedup:>12}'.format(name='best of {repeat}'.format(repeat=repeat), runtime='ms', speedup='vs arpeggio'))
+    for name, seconds in runtimes:
+        print('{name:<24}{milliseconds:>12.2f}{speedup:>11.1f}x'.format(name=name, milliseconds=seconds * 1000, speedup=parse_seconds / seconds))
+
+
+if __name__ == '__main__':
+    main(*[config_generator.get_size(argument) for argument in sys.argv[1:2]])
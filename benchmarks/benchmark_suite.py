@@ -0,0 +1,262 @@
+"""
+benchmark suite : per phase timings and peak memory for synthetic config files, micro benchmarks of single grammar rules,
+compared against a stored baseline - runs offline
+
+    python3 benchmarks/benchmark_suite.py                                   # compare with benchmarks/baseline.json
+    python3 benchmarks/benchmark_suite.py --sizes 1K,10M,500M --repeat 1
+    python3 benchmarks/benchmark_suite.py --save-baseline                   # store the results as the new baseline
+    python3 benchmarks/benchmark_suite.py --threshold 0.1 --memory-threshold 0.05
+
+the exit code is 1 if a measurement regressed by more than the threshold (a fraction of the baseline value)
+
+the runtimes are compared relative to a reference measured in the same run : a bare regular expression scan over the
+lines of the same input. So a baseline taken on another (faster or slower) machine can still be compared - the ratios
+do depend on the Python version and the CPU to some degree, regenerate the baseline with --save-baseline when those change.
+The peak memory is compared as it is.
+
+"""
+
+# STDLIB
+import argparse
+import gc
+import json
+import pathlib
+import platform
+import re
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# EXT
+import arpeggio                                     # noqa: E402
+
+# PROJ
+import config_generator                             # type: ignore # noqa: E402
+from configmagick import grammar_basic              # noqa: E402
+from configmagick import lib_parse                  # noqa: E402
+from configmagick import lib_parse_helpers          # noqa: E402
+
+path_baseline_default = pathlib.Path(__file__).resolve().parent / 'baseline.json'
+
+# the phases of get_file_semantic, and compose back to text
+phases = ('read', 'get_parse_tree', 'get_semantic_data_from_parse_tree', 'compose')
+
+# rule name -> test input
+rule_inputs = {'double_quoted_string': '"double quoted \\" string with some more text"',
+               'maybe_quoted_word': "'maybe quoted word'",
+               'comment_shell_block': '# comment line 1\n# comment line 2\n# comment line 3\n'}
+
+# timings below that are too noisy to be compared
+min_seconds_compared = 0.001
+
+# the reference of the runtimes, see get_reference_seconds
+reference_regex = re.compile(r'[^\n]*\n')
+
+
+def run_phases(path_file: pathlib.Path, grammar: grammar_basic.GrammarBase) -> Dict[str, float]:
+    """ runs the phases one after another, returns phase -> seconds """
+    timings = dict()
+    start_time = time.perf_counter()
+    with open(str(path_file), 'r') as data_file:
+        string_data = data_file.read()
+    timings['read'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    parse_tree = lib_parse.get_parse_tree(string_data, grammar)
+    timings['get_parse_tree'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    semantic_data = lib_parse.get_semantic_data_from_parse_tree(parse_tree, grammar)
+    timings['get_semantic_data_from_parse_tree'] = time.perf_counter() - start_time
+    del parse_tree
+
+    start_time = time.perf_counter()
+    lib_parse_helpers.compose(semantic_data, grammar)
+    timings['compose'] = time.perf_counter() - start_time
+    return timings
+
+
+def get_reference_seconds(string_data: str, repeat: int = 5) -> float:
+    """ seconds for a bare regular expression scan over the lines of string_data - the runtimes are compared relative to it,
+    this cancels out most of the speed difference between machines
+
+    >>> get_reference_seconds('A="x"\\n' * 10, repeat=1) > 0
+    True
+
+    """
+    scan = get_scan_function(string_data)
+    # at least 10 ms per measurement, the reference of a small input is noisy otherwise
+    number = max(1, int(0.01 / max(timeit.timeit(scan, number=1), 1E-9)))
+    return min(timeit.repeat(scan, number=number, repeat=repeat)) / number
+
+
+def get_scan_function(string_data: str) -> Callable[[], Any]:
+    return lambda: reference_regex.findall(string_data)
+
+
+def get_peak_memory(path_file: pathlib.Path, grammar: grammar_basic.GrammarBase) -> int:
+    """ the peak of the traced python allocations of a full run - tracemalloc slows down the allocations a lot,
+    so this is a separate run, not the timed one """
+    gc.collect()
+    tracemalloc.start()
+    run_phases(path_file, grammar)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark_file(size: int, repeat: int, measure_memory: bool, **generator_options: Any) -> Dict[str, float]:
+    """ the best of repeat runs for every phase, the reference, plus the peak memory """
+    grammar = grammar_basic.GrammarUpdateDbConf()
+    with tempfile.TemporaryDirectory() as test_directory:
+        path_file = pathlib.Path(test_directory) / 'updatedb.conf'
+        config_generator.write_config_file(path_file, size, **generator_options)
+        lib_parse.get_parser(grammar)     # the parser construction is not part of the measurement
+        results = dict()    # type: Dict[str, float]
+        for _ in range(repeat):
+            gc.collect()
+            for phase, seconds in run_phases(path_file, grammar).items():
+                results[phase] = min(seconds, results.get(phase, seconds))
+        results['total'] = sum(results[phase] for phase in phases)
+        results['reference'] = get_reference_seconds(path_file.read_text())
+        if measure_memory:
+            results['peak_memory'] = get_peak_memory(path_file, grammar)
+    return results
+
+
+def benchmark_rules(number: int = 2000, repeat: int = 5) -> Dict[str, float]:
+    """ seconds per parse, for single rules of GrammarBasic in isolation - and the reference : seconds per scan of all rule inputs
+
+    >>> sorted(benchmark_rules(number=1, repeat=1))
+    ['comment_shell_block', 'double_quoted_string', 'maybe_quoted_word', 'reference']
+
+    """
+    results = dict()
+    results['reference'] = get_reference_seconds(''.join(rule_inputs.values()), repeat=repeat)
+    for rule_name, rule_input in rule_inputs.items():
+        parser = arpeggio.ParserPython(getattr(grammar_basic.GrammarBasic, rule_name), ws=grammar_basic.GrammarBase.whitespace)
+        parse = get_parse_function(parser, rule_input)
+        results[rule_name] = min(timeit.repeat(parse, number=number, repeat=repeat)) / number
+    return results
+
+
+def get_parse_function(parser: arpeggio.Parser, rule_input: str) -> Callable[[], Any]:
+    return lambda: parser.parse(rule_input)
+
+
+def get_regressions(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, memory_threshold: float) -> List[str]:
+    """ compares all measurements which are in the results and in the baseline - the runtimes relative to the reference
+    of the same run, the peak memory as it is
+
+    >>> baseline = {'files': {'1K': {'read': 0.1, 'reference': 0.01, 'peak_memory': 1000}},
+    ...             'rules': {'maybe_quoted_word': 0.0001, 'reference': 0.00001}}
+    >>> results = {'files': {'1K': {'read': 0.2, 'reference': 0.01, 'peak_memory': 1010}},
+    ...            'rules': {'maybe_quoted_word': 0.0001, 'reference': 0.00001}}
+    >>> get_regressions(results, baseline, threshold=0.25, memory_threshold=0.05)
+    ['files/1K/read: 20 > 10 + 25% (relative to the reference)']
+
+    >>> # a machine twice as fast - no regression
+    >>> results = {'files': {'1K': {'read': 0.05, 'reference': 0.005}}, 'rules': {'maybe_quoted_word': 0.00005, 'reference': 0.000005}}
+    >>> get_regressions(results, baseline, threshold=0.25, memory_threshold=0.05)
+    []
+
+    """
+    regressions = list()
+    for group in ('files', 'rules'):
+        for name, measurements in results.get(group, {}).items():
+            baseline_measurements = baseline.get(group, {}).get(name)
+            if baseline_measurements is None or name == 'reference':
+                continue
+            if not isinstance(measurements, dict):
+                measurements = {'': measurements, 'reference': results[group]['reference']}
+                baseline_measurements = {'': baseline_measurements, 'reference': baseline[group].get('reference')}
+            reference, baseline_reference = measurements.get('reference'), baseline_measurements.get('reference')
+            for metric, value in measurements.items():
+                baseline_value = baseline_measurements.get(metric)
+                if baseline_value is None or metric == 'reference':
+                    continue
+                if metric == 'peak_memory':
+                    allowed_fraction = memory_threshold
+                    unit = ''
+                elif baseline_value < min_seconds_compared and group == 'files':
+                    continue
+                elif not reference or not baseline_reference:
+                    # a baseline without reference can not be compared across machines
+                    continue
+                else:
+                    allowed_fraction = threshold
+                    value, baseline_value = value / reference, baseline_value / baseline_reference
+                    unit = ' (relative to the reference)'
+                if value > baseline_value * (1 + allowed_fraction):
+                    path = '/'.join(part for part in (group, name, metric) if part)
+                    regressions.append('{path}: {value:.4g} > {baseline_value:.4g} + {percent:.0f}%{unit}'.format(
+                        path=path, value=value, baseline_value=baseline_value, percent=allowed_fraction * 100, unit=unit))
+    return regressions
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    header = '{name:<10}'.format(name='size') + ''.join('{phase:>14}'.format(phase=phase[:13]) for phase in phases + ('total', 'reference'))
+    print(header + '{memory:>14}'.format(memory='peak MB'))
+    for size_name, measurements in results['files'].items():
+        line = '{name:<10}'.format(name=size_name) + ''.join('{seconds:>14.4f}'.format(seconds=measurements[phase])
+                                                             for phase in phases + ('total', 'reference'))
+        if 'peak_memory' in measurements:
+            line += '{memory:>14.1f}'.format(memory=measurements['peak_memory'] / 1E6)
+        print(line)
+    for rule_name, seconds in results['rules'].items():
+        print('rule {rule_name:<30}{microseconds:>10.2f} us'.format(rule_name=rule_name, microseconds=seconds * 1E6))
+
+
+def main(sys_argv: List[str] = sys.argv[1:]) -> int:
+    parser = argparse.ArgumentParser(description='configmagick benchmark suite')
+    parser.add_argument('--sizes', default='1K,100K,1M', help='comma separated file sizes, like 1K,10M,500M')
+    parser.add_argument('--repeat', type=int, default=3, help='the best of repeat runs is taken')
+    parser.add_argument('--comment-density', type=float, default=0.2)
+    parser.add_argument('--values-per-line', type=int, default=8)
+    parser.add_argument('--quoting-mix', default='0.8,0.1,0.1', help='weights of unquoted, single quoted and double quoted keys')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slow) peak memory measurement')
+    parser.add_argument('--no-rules', action='store_true', help='skip the rule micro benchmarks')
+    parser.add_argument('--baseline', type=pathlib.Path, default=path_baseline_default)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed runtime regression, as fraction of the baseline')
+    parser.add_argument('--memory-threshold', type=float, default=0.1, help='allowed peak memory regression, as fraction of the baseline')
+    arguments = parser.parse_args(sys_argv)
+
+    generator_options = {'comment_density': arguments.comment_density, 'values_per_line': arguments.values_per_line,
+                         'quoting_mix': [float(weight) for weight in arguments.quoting_mix.split(',')]}
+    results = {'python': platform.python_version(), 'generator_options': generator_options, 'files': {}, 'rules': {}}    # type: Dict[str, Any]
+    for size_name in arguments.sizes.split(','):
+        results['files'][size_name] = benchmark_file(config_generator.get_size(size_name), repeat=arguments.repeat,
+                                                     measure_memory=not arguments.no_memory, **generator_options)
+    if not arguments.no_rules:
+        results['rules'] = benchmark_rules()
+    print_results(results)
+
+    if arguments.save_baseline:
+        arguments.baseline.write_text(json.dumps(results, indent=4) + '\n')
+        print('baseline saved to {path}'.format(path=arguments.baseline))
+        return 0
+    if not arguments.baseline.exists():
+        print('no baseline {path} - run with --save-baseline'.format(path=arguments.baseline))
+        return 0
+    baseline = json.loads(arguments.baseline.read_text())
+    if baseline.get('python') != results['python']:
+        print('the baseline was taken with python {version} - the ratios might differ'.format(version=baseline.get('python')))
+    if baseline.get('generator_options') != generator_options:
+        print('the generator options differ from the baseline - the file results are not compared')
+        results['files'] = {}
+    regressions = get_regressions(results, baseline, threshold=arguments.threshold, memory_threshold=arguments.memory_threshold)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    if not regressions:
+        print('no regressions against {path}'.format(path=arguments.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+synthetic updatedb style config files for the benchmarks - deterministic for the same parameters
+
+    python3 benchmarks/config_generator.py <path_file> <size, like 1K, 10M, 500M>
+
+"""
+
+# STDLIB
+import pathlib
+import random
+import sys
+from typing import Iterator, Sequence, Union
+
+
+def iter_config_lines(comment_density: float = 0.2, values_per_line: int = 8, quoting_mix: Sequence[float] = (0.8, 0.1, 0.1),
+                      empty_line_density: float = 0.05, seed: int = 0) -> Iterator[str]:
+    """ yields an endless sequence of config lines
+
+    comment_density : the fraction of comment lines, consecutive comment lines build a comment block
+    values_per_line : the maximum number of values of an assignment - the number is random between 0 and values_per_line
+    quoting_mix : the weights of unquoted, single quoted and double quoted keys
+
+    >>> lines = iter_config_lines(comment_density=0.5, values_per_line=3, quoting_mix=(1, 1, 1), seed=1)
+    >>> for _ in range(4):
+    ...     print(next(lines), end='')
+    # comment 0 - PRUNEPATHS="/tmp"
+    "KEY 1"="/path/1/0 /path/1/1" # comment 1
+    'KEY 2'="/path/2/0 /path/2/1 /path/2/2"
+    # comment 3 - PRUNEPATHS="/tmp"
+
+    """
+    randomizer = random.Random(seed)
+    line_number = 0
+    while True:
+        chance = randomizer.random()
+        if chance < comment_density:
+            yield '# comment {line_number} - PRUNEPATHS="/tmp"\n'.format(line_number=line_number)
+        elif chance < comment_density + empty_line_density:
+            yield '\n'
+        else:
+            quoting = randomizer.choices(range(3), weights=quoting_mix)[0]
+            if quoting == 1:
+                key = "'KEY {line_number}'".format(line_number=line_number)
+            elif quoting == 2:
+                key = '"KEY {line_number}"'.format(line_number=line_number)
+            else:
+                key = 'KEY_{line_number}'.format(line_number=line_number)
+            number_of_values = randomizer.randint(0, values_per_line)
+            values = ' '.join('/path/{line_number}/{index}'.format(line_number=line_number, index=index) for index in range(number_of_values))
+            comment = ' # comment {line_number}'.format(line_number=line_number) if randomizer.random() < comment_density else ''
+            yield '{key}="{values}"{comment}\n'.format(key=key, values=values, comment=comment)
+        line_number += 1
+
+
+def get_config_data(size: int, **generator_options) -> str:
+    """ config data of at least size characters, complete lines only
+
+    >>> string_data = get_config_data(1024, seed=2)
+    >>> 1024 <= len(string_data) < 1200, string_data.endswith('\\n')
+    (True, True)
+
+    """
+    lines = list()
+    length = 0
+    for line in iter_config_lines(**generator_options):
+        if length >= size:
+            break
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)
+
+
+def write_config_file(path_file: Union[str, pathlib.Path], size: int, **generator_options) -> int:
+    """ writes a config file of at least size characters, in batches - the file is never held in memory as a whole.
+    returns the number of characters written """
+    length = 0
+    batch = list()
+    with open(str(path_file), 'w') as config_file:
+        for line in iter_config_lines(**generator_options):
+            if length >= size:
+                break
+            batch.append(line)
+            length += len(line)
+            if len(batch) >= 10000:
+                config_file.write(''.join(batch))
+                batch = list()
+        config_file.write(''.join(batch))
+    return length
+
+
+def get_size(size: str) -> int:
+    """
+    >>> get_size('1K'), get_size('500M'), get_size('1000')
+    (1024, 524288000, 1000)
+
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+if __name__ == '__main__':
+    write_config_file(sys.argv[1], get_size(sys.argv[2]))
@@ -1,16 +1,53 @@
 # stdlib
-import pathlib
+import importlib
+import os
 
-# proj
-from .configmagick import *
+# typing alone costs more than the rest of the package import - it is only needed by the type checkers
+TYPE_CHECKING = False
+if TYPE_CHECKING:                       # pragma: no cover
+    from typing import Any, List
+
+# the package import stays cheap : the version and the names of configmagick.configmagick are resolved on first access,
+# arpeggio and the grammars are loaded when they are used first
 
 
 def get_version() -> str:
-    with open(pathlib.Path(__file__).parent / 'version.txt', mode='r') as version_file:
+    with open(os.path.join(os.path.dirname(__file__), 'version.txt'), mode='r') as version_file:
         version = version_file.readline()
     return version
 
 
+def __getattr__(name: str) -> 'Any':
+    """ PEP 562 - called only for names which are not (yet) in the package namespace """
+    value = None    # type: Any
+    if name == '__version__':
+        value = get_version()
+    elif name.startswith('_'):
+        raise AttributeError("module 'configmagick' has no attribute '{name}'".format(name=name))
+    else:
+        # the former 'from .configmagick import *', and the submodules
+        module = importlib.import_module('.configmagick', __name__)
+        if name in globals():
+            return globals()[name]      # the submodule configmagick.configmagick itself
+        try:
+            value = getattr(module, name)
+        except AttributeError:
+            try:
+                value = importlib.import_module('.' + name, __name__)
+            except ModuleNotFoundError as exc:
+                # only a missing submodule is a missing attribute - a missing dependency of the submodule is reported as it is
+                if exc.name != __name__ + '.' + name:
+                    raise
+                raise AttributeError("module 'configmagick' has no attribute '{name}'".format(name=name)) from None
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> 'List[str]':
+    names = set(globals()) | {'__version__'}
+    names.update(name for name in dir(importlib.import_module('.configmagick', __name__)) if not name.startswith('_'))
+    return sorted(names)
+
+
 __title__ = 'configmagick'
-__version__ = get_version()
 __name__ = 'configmagick'
@@ -1,20 +1,297 @@
 # STDLIB
+import argparse
 import errno
+import os
+import pathlib
+import re
 import sys
-from typing import List
+from typing import Any, Dict, List, Optional, Union, TYPE_CHECKING
 
-# OWN
-import lib_log_utils
+# the parser modules (and arpeggio, lib_log_utils) are imported on first use,
+# so 'configmagick --help' and 'import configmagick' stay fast
+if TYPE_CHECKING:                                                   # pragma: no cover
+    from . import grammar_basic       # type: ignore # pragma: no cover
+
+# PROJ
+from . import lib_backends            # type: ignore # pragma: no cover
+
+# grammar name on the command line -> grammar class name in grammar_basic
+grammars = {'updatedb': 'GrammarUpdateDbConf'}
+
+# a commented out assignment like '# KEY = value' - the key might be quoted
+regex_commented_assignment = re.compile(r'''#+[\t ]*(?:'([^']*)'|"([^"]*)"|([^\s='"#]+))[\t ]*=''')
 
 
 class Config(object):
-    pass
+    """ the records of a config, indexed by key
+
+    the index is built by a record hook, in the same pass as the parser (or scanner) creates the records:
+        - assignments : key -> the assignment records of the key, in file order
+        - mentions : key -> the comment blocks with a commented out assignment of the key ('# KEY = value'), in file order
+    get_insert_position(key) returns where a new assignment of the key belongs : after the last assignment of the key,
+    otherwise after the first comment block mentioning it, otherwise at the end of the file.
+
+    >>> config = Config.from_file(pathlib.Path(__file__).parent.parent / 'tests' / 'updatedb.conf')
+    >>> config.get_values('PRUNEFS')[:3]
+    ['NFS', 'afs', 'autofs']
+    >>> 'PRUNENAMES' in config, [record.start for record in config.get_mentions('PRUNENAMES')]
+    (False, [24])
+    >>> [record.start for record in config.get_mentions('test_key')]
+    [621, 756]
+    >>> config.get_insert_position('test_key'), config.get_insert_position('PRUNE_BIND_MOUNTS'), config.get_insert_position('new_key')
+    (754, 24, 854)
+
+    >>> config = Config('A="x"\\n# "B" = y\\nA = "y z"\\n', backend='scanner')
+    >>> list(config.keys()), config.get_values('A'), config.get_assignments('A')[0].start
+    (['A'], ['y', 'z'], 0)
+    >>> config.get_insert_position('B')
+    16
+    >>> config.get_values('B')
+    Traceback (most recent call last):
+        ...
+    KeyError: 'B'
+
+    """
+
+    def __init__(self, string_data: str = '', grammar: Optional['grammar_basic.GrammarBase'] = None, backend: str = 'arpeggio') -> None:
+        from . import lib_parse
+        if grammar is None:
+            grammar = get_grammar('updatedb')
+        self.grammar = grammar
+        self.backend = backend
+        self.length = len(string_data)
+        self.assignments = dict()    # type: Dict[str, List[Any]]
+        self.mentions = dict()       # type: Dict[str, List[Any]]
+        self.records = lib_parse.get_semantic_data_from_string(string_data, grammar=grammar, backend=backend, record_hook=self.add_to_index)
+
+    @classmethod
+    def from_file(cls, path_file: Union[str, pathlib.Path], grammar: Optional['grammar_basic.GrammarBase'] = None,
+                  backend: str = 'arpeggio') -> 'Config':
+        with open(str(path_file), 'r') as data_file:
+            string_data = data_file.read()
+        return cls(string_data, grammar=grammar, backend=backend)
+
+    def add_to_index(self, record: Any) -> None:
+        """ the record hook, called by the visitor or the scanner for every top level record """
+        from . import grammar_basic
+        if isinstance(record, grammar_basic.GrammarUpdateDbConf.AssignMultipleValuesQuoted):
+            self.assignments.setdefault(str(record.key), list()).append(record)
+        elif isinstance(record, grammar_basic.GrammarBasic.CommentShellBlock):
+            for key in get_commented_out_keys(record):
+                mentions = self.mentions.setdefault(key, list())
+                # a key might be mentioned more than once in a comment block
+                if not mentions or mentions[-1] is not record:
+                    mentions.append(record)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.assignments
+
+    def keys(self) -> Any:
+        return self.assignments.keys()
+
+    def get_assignments(self, key: str) -> List[Any]:
+        return self.assignments.get(key, [])
+
+    def get_mentions(self, key: str) -> List[Any]:
+        return self.mentions.get(key, [])
+
+    def get_values(self, key: str) -> List[str]:
+        """ the values of the last assignment of the key - like a shell would see it """
+        if key not in self.assignments:
+            raise KeyError(key)
+        return [str(value) for value in self.assignments[key][-1].values]
+
+    def get_insert_position(self, key: str) -> int:
+        """ the character offset where a new assignment of the key should be inserted """
+        assignments = self.assignments.get(key)
+        if assignments:
+            return int(assignments[-1].end)
+        mentions = self.mentions.get(key)
+        if mentions:
+            return int(mentions[0].end)
+        return self.length
+
+
+def get_commented_out_keys(comment_block: List[Any]) -> List[str]:
+    """ the keys of the commented out assignments in a comment block
+
+    >>> get_commented_out_keys(['# A = x', '\\n', '#B=y', '\\n', "# 'C D' = z", '\\n', '# no assignment', '\\n'])
+    ['A', 'B', 'C D']
+
+    """
+    keys = list()
+    for comment in comment_block:
+        match = regex_commented_assignment.match(comment)
+        if match:
+            keys.append(next(group for group in match.groups() if group is not None))
+    return keys
+
+
+def get_grammar(grammar_name: str) -> 'grammar_basic.GrammarBase':
+    """
+    >>> get_grammar('updatedb')       # doctest: +ELLIPSIS
+    <configmagick.grammar_basic.GrammarUpdateDbConf object at ...>
+
+    """
+    from . import grammar_basic
+    return getattr(grammar_basic, grammars[grammar_name])()
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='configmagick')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_parse = subparsers.add_parser('parse', help='parse config files')
+    parser_parse.add_argument('path_files', nargs='+', metavar='FILE')
+    parser_parse.add_argument('--grammar', choices=sorted(grammars) + ['auto'], default='updatedb',
+                              help='"auto" detects the grammar of every file from its name and its first bytes')
+    parser_parse.add_argument('--backend', choices=lib_backends.backends, default='arpeggio')
+    parser_parse.add_argument('--profile', nargs='?', choices=('table', 'json'), const='table', default=None,
+                              help='print per phase timings and rule counters, as table (default) or json')
+    parser_parse.add_argument('--grammar-artifacts', nargs='?', metavar='DIRECTORY', type=pathlib.Path, default=None, const=True,
+                              help='load the prebuilt parsers from the directory, build and save them there if missing or stale '
+                                   '(default directory : $XDG_CACHE_HOME/configmagick/grammars)')
+
+    parser_audit = subparsers.add_parser('audit', help='parse the config files of directory trees, print one JSON line per file - '
+                                                       'identical contents are parsed once')
+    parser_audit.add_argument('roots', nargs='+', metavar='PATH')
+    parser_audit.add_argument('--rule', action='append', default=[], metavar='GLOB=GRAMMAR',
+                              help='the grammar of the files matching GLOB, the first matching rule wins - a GLOB with "/" matches the whole path, '
+                                   'otherwise the file name (default : updatedb.conf=updatedb)')
+    parser_audit.add_argument('--backend', choices=lib_backends.backends, default='arpeggio')
+    parser_audit.add_argument('--follow-symlinks', action='store_true', help='walk into symlinked directories')
+
+    parser_daemon = subparsers.add_parser('daemon', help='serve get / set / validate requests over a unix domain socket, with warm parsers')
+    parser_daemon.add_argument('--socket', default=None, help='the socket path (default : $XDG_RUNTIME_DIR/configmagick.sock)')
+    parser_daemon.add_argument('--backend', choices=lib_backends.backends, default='arpeggio')
+
+    parser_client = subparsers.add_parser('client', help='send a request to the daemon, print the result as JSON')
+    parser_client.add_argument('--socket', default=None, help='the socket path (default : $XDG_RUNTIME_DIR/configmagick.sock)')
+    parser_client.add_argument('--grammar', choices=sorted(grammars), default='updatedb')
+    client_operations = parser_client.add_subparsers(dest='operation')
+    client_operations.required = True
+    parser_get = client_operations.add_parser('get', help='the values of the key, or of all keys')
+    parser_get.add_argument('path_file', metavar='FILE')
+    parser_get.add_argument('key', nargs='?', default=None)
+    parser_set = client_operations.add_parser('set', help='set the values of the key')
+    parser_set.add_argument('path_file', metavar='FILE')
+    parser_set.add_argument('key')
+    parser_set.add_argument('values', nargs='*', metavar='VALUE')
+    parser_validate = client_operations.add_parser('validate', help='check the syntax of the file')
+    parser_validate.add_argument('path_file', metavar='FILE')
+    for operation in ('ping', 'stats', 'shutdown'):
+        client_operations.add_parser(operation)
+    return parser
+
+
+def parse_files(path_files: List[str], grammar_name: str = 'updatedb', backend: str = 'arpeggio', profile: Optional[str] = None) -> None:
+    """ parses the files, prints the number of records per file - and the profile
+
+    >>> path_file = str(pathlib.Path(__file__).parent.parent / 'tests' / 'updatedb.conf')
+    >>> parse_files([path_file], profile='json')        # doctest: +ELLIPSIS
+    {
+        "phases": {
+            "read": {
+                "calls": 1,
+    ...
+    >>> parse_files([path_file])                       # doctest: +ELLIPSIS
+    /.../tests/updatedb.conf: 10 records
+    >>> parse_files([path_file, __file__], grammar_name='auto')        # doctest: +ELLIPSIS
+    /.../tests/updatedb.conf: 10 records (grammar updatedb, confidence 0.99, detected in ... ms)
+    /.../configmagick.py: no grammar detected (detected in ... ms)
+
+    """
+    from . import lib_parse
+    from . import lib_profile
+    grammar = get_grammar(grammar_name) if grammar_name != 'auto' else None
+    collector = lib_profile.ProfileCollector() if profile else None
+    if collector is not None:
+        collector.start()
+    try:
+        for path_file in path_files:
+            detected = ''
+            file_grammar = grammar
+            if file_grammar is None:
+                from . import lib_detect
+                detection = lib_detect.detect_grammar(path_file)
+                if detection.grammar_class is None:
+                    print('{path_file}: no grammar detected (detected in {milliseconds:.3f} ms)'.format(
+                        path_file=path_file, milliseconds=detection.seconds * 1000))
+                    continue
+                file_grammar = detection.grammar_class()
+                detected = ' (grammar {name}, confidence {confidence:.2f}, detected in {milliseconds:.3f} ms)'.format(
+                    name=detection.name, confidence=detection.confidence, milliseconds=detection.seconds * 1000)
+            semantic_data = lib_parse.get_file_semantic(path_file, file_grammar, backend=backend)
+            if profile != 'json':
+                print('{path_file}: {records} records{detected}'.format(path_file=path_file, records=len(semantic_data), detected=detected))
+    finally:
+        if collector is not None:
+            collector.stop()
+    if collector is not None:
+        print(collector.get_json() if profile == 'json' else '\n' + collector.get_table())
+
+
+def audit_trees(roots: List[str], rules: Optional[List[str]] = None, backend: str = 'arpeggio', follow_symlinks: bool = False) -> None:
+    """ prints one JSON line per config file below the roots, and the counts to stderr - rules : 'GLOB=GRAMMAR'
+
+    >>> audit_trees([str(pathlib.Path(__file__).parent.parent / 'tests')])        # doctest: +ELLIPSIS
+    {"path": ".../tests/updatedb.conf", "grammar": "updatedb", "sha256": "...", "duplicate": false, "values": {"PRUNE_BIND_MOUNTS": ["yes"], ...}}
+
+    """
+    from . import lib_audit
+    audit_rules = [lib_audit.get_rule(rule) for rule in rules] if rules else lib_audit.default_rules
+    counts = lib_audit.write_json_lines(roots, sys.stdout, rules=audit_rules, backend=backend, follow_symlinks=follow_symlinks)
+    print('{files} files, {duplicates} duplicates, {errors} errors'.format(**counts), file=sys.stderr)
+
+
+def run_client(arguments: argparse.Namespace) -> int:
+    """ one request to the daemon, prints the result as JSON - returns the exit code """
+    import json
+    from . import lib_daemon_client
+    request = {'grammar': arguments.grammar}    # type: Dict[str, Any]
+    if arguments.operation in ('get', 'set', 'validate'):
+        # the daemon might run in an other working directory
+        request['path'] = os.path.abspath(arguments.path_file)
+    if arguments.operation in ('get', 'set') and arguments.key is not None:
+        request['key'] = arguments.key
+    if arguments.operation == 'set':
+        request['values'] = arguments.values
+    try:
+        result = lib_daemon_client.call(arguments.operation, socket_path=arguments.socket, **request)
+    except lib_daemon_client.DaemonError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    except OSError as exc:
+        print('can not connect to the daemon : {exc}'.format(exc=exc), file=sys.stderr)
+        return errno.ECONNREFUSED
+    print(json.dumps(result))
+    return 0
 
 
 def main(sys_argv: List[str] = sys.argv[1:]) -> None:
 
     try:
+        arguments = get_argument_parser().parse_args(sys_argv)
+        if arguments.command == 'client':
+            # the client is meant for tight loops, it skips the logging setup
+            exit_code = run_client(arguments)
+            if exit_code:
+                sys.exit(exit_code)
+            return
+        import lib_log_utils
         lib_log_utils.log_handlers.set_stream_handler_color()
+        if arguments.command == 'daemon':
+            from . import lib_daemon
+            lib_daemon.Daemon(arguments.socket, backend=arguments.backend).run()
+        elif arguments.command == 'parse':
+            if arguments.grammar_artifacts is not None:
+                from . import lib_grammar_artifact
+                from . import lib_parse
+                if arguments.grammar_artifacts is True:
+                    arguments.grammar_artifacts = lib_grammar_artifact.get_default_artifact_directory()
+                lib_parse.default_parser_cache.artifact_directory = arguments.grammar_artifacts
+            parse_files(arguments.path_files, grammar_name=arguments.grammar, backend=arguments.backend, profile=arguments.profile)
+        elif arguments.command == 'audit':
+            audit_trees(arguments.roots, rules=arguments.rule, backend=arguments.backend, follow_symlinks=arguments.follow_symlinks)
 
     except FileNotFoundError:
         # see https://www.thegeekstuff.com/2010/10/linux-error-codes for error codes
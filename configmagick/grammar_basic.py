@@ -1,3 +1,7 @@
+# STDLIB
+import re
+from typing import Optional, Pattern, Tuple
+
 # EXT
 import arpeggio
 
@@ -5,6 +9,13 @@ import arpeggio
 from . import lib_parse_helpers
 
 
+def set_position(value, start: int, end: int):
+    """ top level semantic records carry the span of the source text they were created from """
+    value.start = start
+    value.end = end
+    return value
+
+
 class ComposeString(str):
     def arpeggio_compose(self):
         return self
@@ -12,16 +23,149 @@ class ComposeString(str):
 
 class ComposeList(list):
     def arpeggio_compose(self):
-        composed_elements = lib_parse_helpers.compose_list_elements(self)
-        return composed_elements
+        return lib_parse_helpers.compose(self)
+
+
+class ComposeOrderedSet(object):
+    """ insertion ordered set of values, with O(1) membership, add and remove - a value is stored only once.
+    composes to compose_prefix + compose_separator.join(values) + compose_suffix, the composed string is cached
+    until the next mutation. Compares equal to a list with the same values in the same order.
+    There is no indexing - it would be O(n), iterate or use list(values)
+
+    the values as parsed (the constructor and append), duplicates included, are kept in tokens and composed until the set
+    is changed with add, discard, ... or deduplicate - reading and composing a file does not change it
+
+    >>> values = ComposeOrderedSet(['ext4', 'nfs', 'ext4'])
+    >>> values, values.tokens, values.arpeggio_compose()
+    (['ext4', 'nfs'], ['ext4', 'nfs', 'ext4'], 'ext4 nfs ext4')
+    >>> 'nfs' in values, values == ['ext4', 'nfs'], list(values)[-1]
+    (True, True, 'nfs')
+    >>> values.add('nfs')       # no change - the duplicates are kept
+    >>> values.arpeggio_compose()
+    'ext4 nfs ext4'
+    >>> values.add('tmpfs')
+    >>> values.tokens
+    ['ext4', 'nfs', 'tmpfs']
+    >>> values.discard('ext4')
+    >>> values.arpeggio_compose()
+    'nfs tmpfs'
+    >>> values.update(['proc', 'nfs'])
+    >>> values.difference(['nfs'])
+    ['tmpfs', 'proc']
+    >>> values.remove('does_not_exist')
+    Traceback (most recent call last):
+        ...
+    KeyError: 'does_not_exist'
+
+    """
+    compose_prefix = ''
+    compose_separator = ' '
+    compose_suffix = ''
+
+    def __init__(self, values=()):
+        tokens = list(values)
+        self._values = dict.fromkeys(tokens)
+        # the values with duplicates, None if there are no duplicates or the set was changed
+        self._tokens = tokens if len(tokens) != len(self._values) else None
+        self._composed = None
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __contains__(self, value):
+        return value in self._values
+
+    def __eq__(self, other):
+        if isinstance(other, ComposeOrderedSet):
+            return list(self._values) == list(other._values)
+        if isinstance(other, list):
+            return list(self._values) == other
+        return NotImplemented
+
+    __hash__ = None     # type: ignore
+
+    def __repr__(self):
+        return repr(list(self._values))
+
+    @property
+    def tokens(self):
+        """ the composed values - with the parsed duplicates until the set is changed """
+        return list(self._values if self._tokens is None else self._tokens)
+
+    def add(self, value):
+        if value not in self._values:
+            self._values[value] = None
+            self._tokens = None
+            self._composed = None
+
+    def append(self, value):
+        """ list compatible name, used by the scanner - adds a parsed value and keeps a duplicate value in tokens """
+        if value in self._values:
+            if self._tokens is None:
+                self._tokens = list(self._values)
+            self._tokens.append(value)
+        else:
+            self._values[value] = None
+            if self._tokens is not None:
+                self._tokens.append(value)
+        self._composed = None
+
+    def deduplicate(self):
+        """ drops the duplicate values of tokens - composes the set """
+        self._tokens = None
+        self._composed = None
+
+    def discard(self, value):
+        if value in self._values:
+            del self._values[value]
+            self._tokens = None
+            self._composed = None
+
+    def remove(self, value):
+        if value not in self._values:
+            raise KeyError(value)
+        self.discard(value)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def difference(self, values):
+        """ a new set of the same type, without the values """
+        values = set(values)
+        return type(self)(value for value in self._values if value not in values)
+
+    def difference_update(self, values):
+        for value in values:
+            self.discard(value)
+
+    def arpeggio_compose(self):
+        if self._composed is None:
+            values = self._values if self._tokens is None else self._tokens
+            self._composed = self.compose_prefix + self.compose_separator.join(lib_parse_helpers.compose(value) for value in values) + self.compose_suffix
+        return self._composed
 
 
 class GrammarBase(object):
     grammar: arpeggio.ParsingExpression = None
     whitespace = '\t '
 
+    # cheap signals for the grammar detection (lib_detect), checked on a bounded prefix of the file before any parse :
+    # detect_globs : (glob, confidence) - a glob without '/' matches the file name, otherwise the whole path
+    # detect_line_regexes : (regex, confidence) - some line of the prefix matches the regex
+    # detect_line_shape : a regex every complete line of the prefix must fullmatch, otherwise the grammar is ruled out
+    detect_globs: Tuple[Tuple[str, float], ...] = ()
+    detect_line_regexes: Tuple[Tuple[Pattern[str], float], ...] = ()
+    detect_line_shape: Optional[Pattern[str]] = None
+
     class Visitor(arpeggio.PTNodeVisitor):
-        pass
+        def __init__(self, record_hook=None, **kwargs):
+            """ record_hook(record) is called for every top level record, in order - to build indices in the parse pass """
+            super(GrammarBase.Visitor, self).__init__(**kwargs)
+            self.record_hook = record_hook
 
 
 class GrammarBasic(GrammarBase):
@@ -156,16 +300,31 @@ class GrammarBasic(GrammarBase):
     def single_assignment():
         return arpeggio.Sequence(GrammarBasic.key, '=', GrammarBasic.single_value, arpeggio.Optional(GrammarBasic.comment_shell))
 
-
     class Visitor(GrammarBase.Visitor):
+        def visit_newline(self, node, children):
+            value = GrammarBasic.Newline(node.value)
+            return set_position(value, node.position, node.position_end)
+
         def visit_double_quoted_string(self, node, children):
-            value = GrammarBasic.DoubleQuotedString(children[1:-1])
+            value = GrammarBasic.DoubleQuotedString(node.value[1:-1])
             return value
 
         def visit_single_quoted_string(self, node, children):
-            value = GrammarBasic.SingleQuotedString(children[1:-1])
+            value = GrammarBasic.SingleQuotedString(node.value[1:-1])
+            return value
+
+        def visit_unicode_string(self, node, children):
+            value = GrammarBasic.UnicodeString(node.value)
+            return value
+
+        def visit_comment_shell(self, node, children):
+            value = GrammarBasic.CommentShell(node.value)
             return value
 
+        def visit_comment_shell_block(self, node, children):
+            value = GrammarBasic.CommentShellBlock(children)
+            return set_position(value, node.position, node.position_end)
+
 
 class GrammarUpdateDbConf(GrammarBase):
     """
@@ -187,15 +346,37 @@ class GrammarUpdateDbConf(GrammarBase):
     >>> assert str(parser.parse('PRUNE_BIND_MOUNTS="yes" # test comment\\n')) == 'PRUNE_BIND_MOUNTS | = | \\" | yes | \\" | # test comment | \\n | '
     """
 
+    detect_globs = (('updatedb.conf', 0.9), )
+    detect_line_regexes = ((re.compile(r'^[\t ]*PRUNE(?:FS|NAMES|PATHS|_BIND_MOUNTS)[\t ]*='), 0.8),
+                           (re.compile(r'''^[\t ]*[^\s='"#]+[\t ]*=[\t ]*"'''), 0.6))
+    # empty, comment or KEY="values" lines - a bit wider than the grammar, it must never rule out a valid file
+    detect_line_shape = re.compile(r'''[\t ]*(?:(?:'[^'\\]*(?:\\.[^'\\]*)*'|"[^"\\]*(?:\\.[^"\\]*)*"|[^\s='"#]+)[\t ]*=[\t ]*"[^"]*"[\t ]*)?(?:#.*)?''')
+
     @staticmethod
     def multiple_values_blank_separated():
         return arpeggio.ZeroOrMore(GrammarBasic.unicode_string)
 
     @staticmethod
-    class MultipleValuesBlankSeparated(list):
-        def arpeggio_compose(self):
-            composed_elements = lib_parse_helpers.compose_list_elements(self)
-            return '"' + ' '.join(composed_elements) + '"'
+    class MultipleValuesBlankSeparated(ComposeOrderedSet):
+        """ the values of PRUNEFS, PRUNEPATHS, ... - every value is stored once. Duplicate values of the file are written back
+        unchanged until the values are changed : then 'PRUNEFS="NFS afs NFS"' is written back as 'PRUNEFS="NFS afs ..."'
+
+        >>> prune_fs = GrammarUpdateDbConf.MultipleValuesBlankSeparated(['NFS', 'afs'])
+        >>> prune_fs.add('tmpfs')
+        >>> 'afs' in prune_fs, prune_fs.arpeggio_compose()
+        (True, '"NFS afs tmpfs"')
+        >>> from configmagick import lib_parse
+        >>> semantic_data = lib_parse.get_semantic_data_from_string('PRUNEFS="NFS afs NFS"\\n', GrammarUpdateDbConf())
+        >>> semantic_data.arpeggio_compose()
+        'PRUNEFS="NFS afs NFS"\\n'
+        >>> semantic_data[0].values.discard('afs')
+        >>> semantic_data.arpeggio_compose()
+        'PRUNEFS="NFS"\\n'
+
+        """
+        compose_prefix = '"'
+        compose_separator = ' '
+        compose_suffix = '"'
 
     @staticmethod
     def assign_multiple_values_quoted():
@@ -204,9 +385,29 @@ class GrammarUpdateDbConf(GrammarBase):
 
     @staticmethod
     class AssignMultipleValuesQuoted(list):
+        """ [key, MultipleValuesBlankSeparated, <CommentShell>, Newline] - the comment is optional """
+
+        @property
+        def key(self):
+            return self[0]
+
+        @property
+        def values(self):
+            return self[1]
+
+        @property
+        def comment(self):
+            if len(self) == 4:
+                return self[2]
+            return None
+
+        def compose_parts(self):
+            if len(self) == 4:
+                return [self[0], '=', self[1], ' ', self[2], self[3]]
+            return [self[0], '=', self[1], self[2]]
+
         def arpeggio_compose(self):
-            composed_elements = lib_parse_helpers.compose_list_elements(self)
-            return composed_elements
+            return lib_parse_helpers.compose(self, GrammarUpdateDbConf)
 
     @staticmethod
     def grammar():
@@ -214,5 +415,70 @@ class GrammarUpdateDbConf(GrammarBase):
 
     @staticmethod
     class Visitor(GrammarBasic.Visitor):
+        """
+        >>> from configmagick import lib_parse
+        >>> semantic_data = lib_parse.get_semantic_data_from_string('A = "x y" # c\\n# c1\\n# c2\\n\\n"B"=""\\n', GrammarUpdateDbConf())
+        >>> semantic_data
+        [['A', ['x', 'y'], '# c', '\\n'], ['# c1', '\\n', '# c2', '\\n'], '\\n', ['B', [], '\\n']]
+        >>> [(type(record).__name__, record.start, record.end) for record in semantic_data]
+        [('AssignMultipleValuesQuoted', 0, 14), ('CommentShellBlock', 14, 24), ('Newline', 24, 25), ('AssignMultipleValuesQuoted', 25, 32)]
+        >>> assignment = semantic_data[3]
+        >>> type(assignment.key).__name__, assignment.values, assignment.comment
+        ('DoubleQuotedString', [], None)
+        >>> semantic_data.arpeggio_compose()
+        'A="x y" # c\\n# c1\\n# c2\\n\\n"B"=""\\n'
+
+        >>> # the record hook is called in the visit pass, in file order - like the scanner calls it
+        >>> string_data = '\\nA = "x" # c\\n\\n# c1\\n# c2\\n\\n\\nB=""\\n\\n'
+        >>> records = list()
+        >>> _ = lib_parse.get_semantic_data_from_string(string_data, GrammarUpdateDbConf(), record_hook=records.append)
+        >>> records
+        ['\\n', ['A', ['x'], '# c', '\\n'], '\\n', ['# c1', '\\n', '# c2', '\\n'], '\\n', '\\n', ['B', [], '\\n'], '\\n']
+        >>> scanner_records = list()
+        >>> _ = lib_parse.get_semantic_data_from_string(string_data, GrammarUpdateDbConf(), backend='scanner', record_hook=scanner_records.append)
+        >>> assert not lib_parse.get_semantic_data_difference(records, scanner_records)
+
+        """
+        def __init__(self, record_hook=None, **kwargs):
+            super(GrammarUpdateDbConf.Visitor, self).__init__(record_hook=record_hook, **kwargs)
+            # the newlines visited since the last top level record - the newlines between the records are top level records,
+            # the others belong to the assignment or comment block which is visited next (the visit is depth first)
+            self._newlines = list()
+
+        def visit_newline(self, node, children):
+            value = super(GrammarUpdateDbConf.Visitor, self).visit_newline(node, children)
+            if self.record_hook is not None:
+                self._newlines.append(value)
+            return value
+
+        def visit_comment_shell_block(self, node, children):
+            value = super(GrammarUpdateDbConf.Visitor, self).visit_comment_shell_block(node, children)
+            self.call_record_hook(value)
+            return value
+
+        def call_record_hook(self, record=None):
+            """ calls the record hook for the top level newlines before the record, and for the record - None : the end of the input """
+            if self.record_hook is None:
+                return
+            for newline in self._newlines:
+                if record is None or newline.start < record.start:
+                    self.record_hook(newline)
+            self._newlines.clear()
+            if record is not None:
+                self.record_hook(record)
+
         def visit_multiple_values_blank_separated(self, node, children):
             return GrammarUpdateDbConf.MultipleValuesBlankSeparated(children)
+
+        def visit_assign_multiple_values_quoted(self, node, children):
+            key = children[0]
+            values = children.results.get('multiple_values_blank_separated')
+            values = values[0] if values else GrammarUpdateDbConf.MultipleValuesBlankSeparated()
+            comments = children.results.get('comment_shell')
+            value = GrammarUpdateDbConf.AssignMultipleValuesQuoted([key, values] + (comments or []) + [children[-1]])
+            self.call_record_hook(set_position(value, node.position, node.position_end))
+            return value
+
+        def visit_grammar(self, node, children):
+            self.call_record_hook()
+            return ComposeList(children)
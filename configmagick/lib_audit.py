@@ -0,0 +1,222 @@
+# STDLIB
+import collections
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import pathlib
+from typing import Any, Dict, IO, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+# PROJ
+from . import configmagick            # type: ignore # pragma: no cover
+
+# (glob, grammar name) - the first matching rule picks the grammar of a file. A glob without '/' matches the file name,
+# otherwise the whole path
+default_rules = (('updatedb.conf', 'updatedb'), )
+
+
+class ContentResult(NamedTuple):
+    """ the result for one distinct file content - shared by all files with that content
+    values : key -> values, None on error. json_fragment : the values or the error, encoded once for the JSON lines """
+    values: Optional[Dict[str, List[str]]]
+    error: Optional[str]
+    json_fragment: str
+
+
+class AuditResult(NamedTuple):
+    """ the result for one file - duplicate : the same content (and grammar) was already parsed in this audit """
+    path: str
+    grammar: str
+    sha256: Optional[str]
+    duplicate: bool
+    content: ContentResult
+
+
+def audit_tree(roots: Iterable[Union[str, pathlib.Path]], rules: Sequence[Tuple[str, str]] = default_rules, backend: str = 'arpeggio',
+               follow_symlinks: bool = False, max_cached_contents: int = 65536) -> Iterator[AuditResult]:
+    """ walks the directory trees, yields an AuditResult for every file which matches a rule, in walk order
+
+    the file contents are hashed, every distinct content is parsed once - the result is shared by all files with
+    the same content. The memory is bound by max_cached_contents distinct results (least recently seen are dropped,
+    a dropped content is parsed again when it shows up again), not by the number of files.
+
+    >>> import shutil, tempfile
+    >>> root = pathlib.Path(tempfile.mkdtemp())
+    >>> for host in ('host1', 'host2', 'host3'):
+    ...     (root / host / 'etc').mkdir(parents=True)
+    ...     _ = (root / host / 'etc' / 'updatedb.conf').write_text('PRUNEFS="NFS afs"\\n' if host != 'host3' else 'PRUNEFS=NFS\\n')
+    ...     _ = (root / host / 'etc' / 'hosts').write_text('127.0.0.1 localhost\\n')
+    >>> for result in audit_tree([root]):
+    ...     result.path[len(str(root)):], result.duplicate, result.content.values, result.content.error
+    ('/host1/etc/updatedb.conf', False, {'PRUNEFS': ['NFS', 'afs']}, None)
+    ('/host2/etc/updatedb.conf', True, {'PRUNEFS': ['NFS', 'afs']}, None)
+    ('/host3/etc/updatedb.conf', False, None, 'NoMatch: Expected \\'"\\' at position (1, 9) => \\'PRUNEFS=*NFS \\'.')
+    >>> [pathlib.Path(result.path).name for result in audit_tree([root], rules=[('*/host2/*', 'updatedb')])]
+    ['hosts', 'updatedb.conf']
+    >>> shutil.rmtree(str(root))
+
+    """
+    grammars = dict()       # type: Dict[str, Any]
+    # (grammar name, sha256) -> ContentResult, in LRU order
+    content_results = collections.OrderedDict()     # type: collections.OrderedDict
+    for path in iter_tree_files(roots, follow_symlinks=follow_symlinks):
+        grammar_name = get_grammar_name(path, rules)
+        if grammar_name is None:
+            continue
+        try:
+            with open(path, 'rb') as data_file:
+                byte_data = data_file.read()
+        except OSError as exc:
+            yield AuditResult(path, grammar_name, None, False, get_content_result(None, exc))
+            continue
+        content_key = (grammar_name, hashlib.sha256(byte_data).hexdigest())
+        content_result = content_results.get(content_key)
+        if content_result is not None:
+            content_results.move_to_end(content_key)
+            yield AuditResult(path, grammar_name, content_key[1], True, content_result)
+            continue
+
+        if grammar_name not in grammars:
+            grammars[grammar_name] = configmagick.get_grammar(grammar_name)
+        content_result = parse_content(byte_data, grammars[grammar_name], backend=backend)
+        content_results[content_key] = content_result
+        if len(content_results) > max_cached_contents:
+            content_results.popitem(last=False)
+        yield AuditResult(path, grammar_name, content_key[1], False, content_result)
+
+
+def parse_content(byte_data: bytes, grammar: Any, backend: str = 'arpeggio') -> ContentResult:
+    """ decoded like open(path, 'r') does it
+
+    >>> parse_content(b'A="x y"\\r\\n', configmagick.get_grammar('updatedb'))
+    ContentResult(values={'A': ['x', 'y']}, error=None, json_fragment='"values": {"A": ["x", "y"]}')
+
+    """
+    try:
+        with io.TextIOWrapper(io.BytesIO(byte_data)) as text_file:
+            string_data = text_file.read()
+        config = configmagick.Config(string_data, grammar=grammar, backend=backend)
+    except Exception as exc:
+        return get_content_result(None, exc)
+    return get_content_result({key: config.get_values(key) for key in config.keys()})
+
+
+def get_content_result(values: Optional[Dict[str, List[str]]], exc: Optional[BaseException] = None) -> ContentResult:
+    if exc is not None:
+        error = '{exc_type}: {exc}'.format(exc_type=type(exc).__name__, exc=exc)
+        return ContentResult(None, error, '"error": ' + json.dumps(error))
+    return ContentResult(values, None, '"values": ' + json.dumps(values))
+
+
+def get_json_line(result: AuditResult) -> str:
+    """ one JSON object per file - the values (or the error) are encoded once per distinct content
+
+    >>> get_json_line(AuditResult('/etc/updatedb.conf', 'updatedb', 'ab12', True, get_content_result({'A': ['x']})))
+    '{"path": "/etc/updatedb.conf", "grammar": "updatedb", "sha256": "ab12", "duplicate": true, "values": {"A": ["x"]}}\\n'
+
+    """
+    return '{{"path": {path}, "grammar": {grammar}, "sha256": {sha256}, "duplicate": {duplicate}, {json_fragment}}}\n'.format(
+        path=json.dumps(result.path), grammar=json.dumps(result.grammar), sha256=json.dumps(result.sha256),
+        duplicate=json.dumps(result.duplicate), json_fragment=result.content.json_fragment)
+
+
+def write_json_lines(roots: Iterable[Union[str, pathlib.Path]], output: IO[str], rules: Sequence[Tuple[str, str]] = default_rules,
+                     backend: str = 'arpeggio', follow_symlinks: bool = False) -> Dict[str, int]:
+    """ streams the audit as JSON lines to output, returns the counts of files, distinct contents and errors """
+    counts = {'files': 0, 'duplicates': 0, 'errors': 0}
+    for result in audit_tree(roots, rules=rules, backend=backend, follow_symlinks=follow_symlinks):
+        output.write(get_json_line(result))
+        counts['files'] += 1
+        counts['duplicates'] += result.duplicate
+        counts['errors'] += result.content.error is not None
+    return counts
+
+
+def iter_tree_files(roots: Iterable[Union[str, pathlib.Path]], follow_symlinks: bool = False) -> Iterator[str]:
+    """ the regular files below the roots, depth first, sorted by name within a directory - a root may be a file.
+    Unreadable directories are skipped. Symlinked directories are only followed with follow_symlinks=True,
+    every directory is walked once then - a symlink loop or a directory reached over two paths is not walked again
+
+    >>> test_directory = pathlib.Path(__file__).parent.parent / 'tests'
+    >>> [pathlib.Path(path).name for path in iter_tree_files([test_directory]) if path.endswith('.conf')]
+    ['updatedb.conf']
+
+    >>> import shutil, tempfile
+    >>> temp_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> (temp_directory / 'etc').mkdir()
+    >>> _ = (temp_directory / 'etc' / 'updatedb.conf').write_text('')
+    >>> (temp_directory / 'etc' / 'loop').symlink_to(temp_directory)
+    >>> [path[len(str(temp_directory)):] for path in iter_tree_files([temp_directory], follow_symlinks=True)]
+    ['/etc/updatedb.conf']
+    >>> shutil.rmtree(str(temp_directory))
+
+    """
+    # (st_dev, st_ino) of the walked directories - only needed when symlinks are followed
+    visited_directories = set()     # type: Set[Tuple[int, int]]
+    for root in roots:
+        root = str(root)
+        if not os.path.isdir(root):
+            yield root
+            continue
+        # directories still to walk, the next one last
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            if follow_symlinks:
+                try:
+                    directory_stat = os.stat(directory)
+                except OSError:
+                    continue
+                directory_id = (directory_stat.st_dev, directory_stat.st_ino)
+                if directory_id in visited_directories:
+                    continue
+                visited_directories.add(directory_id)
+            try:
+                with os.scandir(directory) as entries:
+                    entries_sorted = sorted(entries, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            sub_directories = list()
+            for entry in entries_sorted:
+                try:
+                    if entry.is_dir(follow_symlinks=follow_symlinks):
+                        sub_directories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=follow_symlinks):
+                        yield entry.path
+                except OSError:
+                    continue
+            stack.extend(reversed(sub_directories))
+
+
+def get_grammar_name(path: str, rules: Sequence[Tuple[str, str]] = default_rules) -> Optional[str]:
+    """ the grammar of the first rule which matches the path, None if no rule matches
+
+    >>> get_grammar_name('/etc/updatedb.conf'), get_grammar_name('/etc/hosts')
+    ('updatedb', None)
+    >>> get_grammar_name('/images/a/etc/locate.conf', rules=[('/images/*/etc/*.conf', 'updatedb')])
+    'updatedb'
+
+    """
+    file_name = os.path.basename(path)
+    for pattern, grammar_name in rules:
+        if fnmatch.fnmatchcase(path if '/' in pattern else file_name, pattern):
+            return grammar_name
+    return None
+
+
+def get_rule(rule: str) -> Tuple[str, str]:
+    """ a rule from the command line, 'GLOB=GRAMMAR'
+
+    >>> get_rule('*.conf=updatedb')
+    ('*.conf', 'updatedb')
+    >>> get_rule('*.conf')
+    Traceback (most recent call last):
+        ...
+    ValueError: the rule '*.conf' is not GLOB=GRAMMAR, with GRAMMAR one of ['updatedb']
+
+    """
+    pattern, _, grammar_name = rule.rpartition('=')
+    if not pattern or grammar_name not in configmagick.grammars:
+        raise ValueError('the rule {rule!r} is not GLOB=GRAMMAR, with GRAMMAR one of {grammars}'.format(rule=rule, grammars=sorted(configmagick.grammars)))
+    return pattern, grammar_name
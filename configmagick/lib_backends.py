@@ -0,0 +1,6 @@
+# the parser backends - without dependencies, so the command line can offer the choices without importing the parser stack
+
+# 'arpeggio' : PEG parser and visitor, works for all grammars
+# 'scanner' : single pass scanner, for the grammars listed in lib_scanner.scanner_classes
+# 'differential' : runs both backends and raises BackendMismatchError if the results are not identical
+backends = ('arpeggio', 'scanner', 'differential')
@@ -0,0 +1,280 @@
+# STDLIB
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+import signal
+import threading
+from typing import Any, Dict, List, Optional
+
+# EXT
+import arpeggio as arp
+
+# PROJ
+from . import configmagick            # type: ignore # pragma: no cover
+from . import lib_daemon_client       # type: ignore # pragma: no cover
+from . import lib_edit                # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+from . import lib_scanner             # type: ignore # pragma: no cover
+from . import lib_semantic_cache      # type: ignore # pragma: no cover
+
+# a request line may carry the data of a whole config file ('validate' with 'data')
+max_request_size = 64 * 1024 * 1024
+
+# the operations which parse or write files, they run in the worker thread
+file_operations = ('get', 'set', 'validate')
+
+
+class Daemon(object):
+    """ serves get / set / validate requests over a unix domain socket, with warm parsers and cached results
+
+    the protocol is JSON lines : every request is one JSON object on one line, every response too -
+    the responses of one connection come in the order of the requests. Many clients are multiplexed by asyncio.
+
+    requests :
+        {"op": "get", "path": "/etc/updatedb.conf"}                         -> {"KEY": ["value", ...], ...}
+        {"op": "get", "path": "/etc/updatedb.conf", "key": "PRUNEFS"}       -> ["value", ...]
+        {"op": "set", "path": "/etc/updatedb.conf", "key": "PRUNEFS", "values": ["NFS", "nfs4"]}   -> {"patches": 1}
+        {"op": "validate", "path": "/etc/updatedb.conf"}                    -> {"valid": true, "records": 12}
+        {"op": "validate", "data": "A=x\\n"}                                -> {"valid": false, "error": "Expected ..."}
+        {"op": "ping"}, {"op": "stats"}, {"op": "shutdown"}
+    optional in every request : "id" (returned in the response), "grammar" (default "updatedb")
+
+    responses :
+        {"id": ..., "ok": true, "result": ...}
+        {"id": ..., "ok": false, "error": {"type": "KeyError", "message": "..."}}
+
+    the results of 'get' are cached as long as the file does not change (lib_semantic_cache).
+    arpeggio parsers are not thread safe, so the file operations run one after another in a single worker thread -
+    the event loop keeps serving the connections meanwhile.
+
+    the daemon can write files with its own permissions, so the socket is only accessible by the owner (mode 0600).
+
+    >>> import pathlib, shutil, tempfile
+    >>> temp_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> path_file = temp_directory / 'updatedb.conf'
+    >>> _ = path_file.write_text('A="x y"\\n# B = z\\n')
+    >>> daemon = Daemon(str(temp_directory / 'configmagick.sock'))
+    >>> # a daemon thread - a failing example can not keep the process alive
+    >>> thread = threading.Thread(target=daemon.run, daemon=True)
+    >>> thread.start()
+    >>> assert daemon.ready.wait(timeout=30)
+    >>> oct(os.stat(daemon.socket_path).st_mode & 0o777)
+    '0o600'
+
+    >>> with lib_daemon_client.DaemonClient(daemon.socket_path) as client:
+    ...     client.request({'id': 1, 'op': 'get', 'path': str(path_file), 'key': 'A'})
+    ...     client.call('set', path=str(path_file), key='B', values=['z', 'w'])
+    ...     client.call('get', path=str(path_file))
+    ...     client.call('validate', data='A=x\\n')['error']
+    ...     client.request({'id': 2, 'op': 'get', 'path': str(path_file), 'key': 'C'})
+    {'id': 1, 'ok': True, 'result': ['x', 'y']}
+    {'patches': 1}
+    {'A': ['x', 'y'], 'B': ['z', 'w']}
+    'Expected \\'"\\' at position (1, 3) => \\'A=*x \\'.'
+    {'id': 2, 'ok': False, 'error': {'type': 'KeyError', 'message': "'C'"}}
+
+    >>> # concurrent clients
+    >>> results = list()
+    >>> threads = [threading.Thread(target=lambda: results.append(lib_daemon_client.call('get', daemon.socket_path, path=str(path_file), key='B')))
+    ...            for _ in range(8)]
+    >>> for client_thread in threads: client_thread.start()
+    >>> for client_thread in threads: client_thread.join()
+    >>> results
+    [['z', 'w'], ['z', 'w'], ['z', 'w'], ['z', 'w'], ['z', 'w'], ['z', 'w'], ['z', 'w'], ['z', 'w']]
+
+    >>> lib_daemon_client.call('shutdown', daemon.socket_path)
+    >>> thread.join(timeout=30)
+    >>> os.path.exists(daemon.socket_path)
+    False
+
+    >>> # the scanner backend reports invalid data the same way
+    >>> daemon = Daemon(str(temp_directory / 'configmagick.sock'), backend='scanner')
+    >>> thread = threading.Thread(target=daemon.run, daemon=True)
+    >>> thread.start()
+    >>> assert daemon.ready.wait(timeout=30)
+    >>> lib_daemon_client.call('validate', daemon.socket_path, data='A=x\\n')
+    {'valid': False, 'error': 'Expected assignment, comment or newline at position (1, 1)'}
+    >>> lib_daemon_client.call('validate', daemon.socket_path, path=str(path_file))
+    {'valid': True, 'records': 3}
+    >>> lib_daemon_client.call('shutdown', daemon.socket_path)
+    >>> thread.join(timeout=30)
+    >>> shutil.rmtree(str(temp_directory))
+
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, backend: str = 'arpeggio', cache_size: int = 256) -> None:
+        self.socket_path = socket_path or lib_daemon_client.get_default_socket_path()
+        self.backend = backend
+        self.semantic_cache = lib_semantic_cache.SemanticCache(max_size=cache_size)
+        # set as soon as the daemon accepts connections
+        self.ready = threading.Event()
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self._executor = None       # type: Optional[concurrent.futures.ThreadPoolExecutor]
+        self._loop = None           # type: Optional[asyncio.AbstractEventLoop]
+        self._stopped = None        # type: Optional[asyncio.Event]
+        # the open connections, closed on shutdown
+        self._connections = dict()  # type: Dict[asyncio.StreamWriter, asyncio.Task]
+
+    def run(self) -> None:
+        """ serves until stop() is called, a 'shutdown' request arrives or SIGTERM / SIGINT is received """
+        asyncio.run(self.serve())
+
+    def stop(self) -> None:
+        """ thread safe """
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def serve(self) -> None:
+        remove_stale_socket(self.socket_path)
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='configmagick_daemon')
+        if threading.current_thread() is threading.main_thread():
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                self._loop.add_signal_handler(signal_number, self._stopped.set)
+        # the socket is created with mode 0600 - umask is process wide, so it is restored at once
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path, limit=max_request_size)
+        finally:
+            os.umask(umask)
+        try:
+            # build the parsers before the first request
+            for grammar_name in configmagick.grammars:
+                await self._loop.run_in_executor(self._executor, lib_parse.get_parser, configmagick.get_grammar(grammar_name))
+            self.ready.set()
+            async with server:
+                await self._stopped.wait()
+                # the handlers see the end of the stream and finish, instead of being cancelled by asyncio.run
+                for writer in list(self._connections):
+                    writer.close()
+                await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        finally:
+            self.ready.clear()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._executor.shutdown(wait=True)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._connections[writer] = asyncio.current_task()      # type: ignore
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # the line exceeds max_request_size - the rest of the stream can not be resynchronized
+                    writer.write(get_response_line(None, error=ValueError('the request exceeds {size} bytes'.format(size=max_request_size))))
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                writer.write(await self.handle_request_line(line))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self._connections[writer]
+            writer.close()
+
+    async def handle_request_line(self, line: bytes) -> bytes:
+        self.requests += 1
+        request_id = None
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('the request must be a JSON object')
+            request_id = request.get('id')
+            operation = request.get('op')
+            if operation == 'ping':
+                result = 'pong'     # type: Any
+            elif operation == 'stats':
+                result = self.get_statistics()
+            elif operation == 'shutdown':
+                result = None
+                assert self._stopped is not None
+                self._stopped.set()
+            elif operation in file_operations:
+                assert self._loop is not None
+                result = await self._loop.run_in_executor(self._executor, self.execute, request)
+            else:
+                raise ValueError('unknown op {operation!r}'.format(operation=operation))
+        except Exception as exc:
+            self.errors += 1
+            return get_response_line(request_id, error=exc)
+        return get_response_line(request_id, result=result)
+
+    def execute(self, request: Dict[str, Any]) -> Any:
+        """ the file operations - runs in the worker thread """
+        operation = request['op']
+        grammar = configmagick.get_grammar(request.get('grammar', 'updatedb'))
+        if operation == 'get':
+            values_by_key = self.semantic_cache.get_file_semantic(request['path'], grammar,
+                                                                  functools.partial(get_values_by_key, grammar=grammar, backend=self.backend))
+            if 'key' in request:
+                return values_by_key[request['key']]
+            return values_by_key
+        if operation == 'set':
+            editor = lib_edit.ConfigEditor.from_file(request['path'], grammar, backend=self.backend)
+            editor.set_value(request['key'], request['values'])
+            patches = len(editor.get_patches())
+            if patches:
+                editor.save()
+            return {'patches': patches}
+        # validate
+        if 'data' in request:
+            string_data = request['data']
+        else:
+            with open(str(request['path']), 'r') as data_file:
+                string_data = data_file.read()
+        try:
+            records = lib_parse.get_semantic_data_from_string(string_data, grammar, backend=self.backend)
+        except (arp.NoMatch, lib_scanner.ScanError) as exc:
+            return {'valid': False, 'error': str(exc)}
+        return {'valid': True, 'records': len(records)}
+
+    def get_statistics(self) -> Dict[str, Any]:
+        return {'connections': self.connections, 'requests': self.requests, 'errors': self.errors,
+                'semantic_cache': self.semantic_cache.statistics(), 'parser_cache': lib_parse.default_parser_cache.statistics()}
+
+
+def get_values_by_key(string_data: str, grammar: Any, backend: str = 'arpeggio') -> Dict[str, List[str]]:
+    """ key -> the values of the last assignment of the key
+
+    >>> get_values_by_key('A="x y"\\nB=""\\nA="z"\\n', configmagick.get_grammar('updatedb'))
+    {'A': ['z'], 'B': []}
+
+    """
+    config = configmagick.Config(string_data, grammar=grammar, backend=backend)
+    return {key: config.get_values(key) for key in config.keys()}
+
+
+def get_response_line(request_id: Any, result: Any = None, error: Optional[BaseException] = None) -> bytes:
+    """
+    >>> get_response_line(1, result=['x'])
+    b'{"id": 1, "ok": true, "result": ["x"]}\\n'
+    >>> get_response_line(None, error=KeyError('A'))
+    b'{"id": null, "ok": false, "error": {"type": "KeyError", "message": "\\'A\\'"}}\\n'
+
+    """
+    if error is None:
+        response = {'id': request_id, 'ok': True, 'result': result}     # type: Dict[str, Any]
+    else:
+        response = {'id': request_id, 'ok': False, 'error': {'type': type(error).__name__, 'message': str(error)}}
+    return json.dumps(response).encode('utf-8') + b'\n'
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """ removes the socket of a daemon which did not shut down cleanly, raises FileExistsError if a daemon is listening """
+    if not os.path.exists(socket_path):
+        return
+    try:
+        lib_daemon_client.request({'op': 'ping'}, socket_path, timeout=5)
+    except OSError:
+        os.unlink(socket_path)
+        return
+    raise FileExistsError('a daemon is already listening on {socket_path}'.format(socket_path=socket_path))
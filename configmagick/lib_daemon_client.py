@@ -0,0 +1,87 @@
+# STDLIB
+import json
+import os
+import socket
+from typing import Any, Dict, Optional, Union
+
+# the client is used by short lived processes - it imports neither asyncio nor the parser modules
+
+
+class DaemonError(Exception):
+    """ the daemon answered a request with an error, error_type is the name of the exception in the daemon """
+
+    def __init__(self, error_type: str, message: str) -> None:
+        super(DaemonError, self).__init__('{error_type}: {message}'.format(error_type=error_type, message=message))
+        self.error_type = error_type
+        self.message = message
+
+
+def get_default_socket_path() -> str:
+    """ $XDG_RUNTIME_DIR/configmagick.sock, or /tmp/configmagick-<uid>.sock
+
+    >>> get_default_socket_path().endswith('.sock')
+    True
+
+    """
+    runtime_directory = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_directory:
+        return os.path.join(runtime_directory, 'configmagick.sock')
+    return os.path.join(os.environ.get('TMPDIR', '/tmp'), 'configmagick-{uid}.sock'.format(uid=os.getuid()))
+
+
+class DaemonClient(object):
+    """ a connection to the daemon - every request is one JSON line, answered by one JSON line.
+    Keep the client open for many requests, then every request costs one round trip only
+
+    see lib_daemon.Daemon for the protocol
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: Optional[float] = 30.0) -> None:
+        self.socket_path = socket_path or get_default_socket_path()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(self.socket_path)
+        except OSError:
+            self._socket.close()
+            raise
+        self._reader = self._socket.makefile('rb')
+
+    def request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """ sends the request, returns the response : {'id': ..., 'ok': True, 'result': ...} or {'id': ..., 'ok': False, 'error': {...}} """
+        self._socket.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError('the daemon closed the connection')
+        response = json.loads(line.decode('utf-8'))    # type: Dict[str, Any]
+        return response
+
+    def call(self, operation: str, **arguments: Any) -> Any:
+        """ the result of the operation, raises DaemonError if the daemon reports an error """
+        response = self.request(dict(arguments, op=operation))
+        if not response.get('ok'):
+            error = response.get('error') or {}
+            raise DaemonError(error.get('type', 'Error'), error.get('message', ''))
+        return response.get('result')
+
+    def close(self) -> None:
+        self._reader.close()
+        self._socket.close()
+
+    def __enter__(self) -> 'DaemonClient':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.close()
+
+
+def request(request: Dict[str, Any], socket_path: Optional[str] = None, timeout: Optional[float] = 30.0) -> Dict[str, Any]:
+    """ a single request on a new connection """
+    with DaemonClient(socket_path, timeout=timeout) as client:
+        return client.request(request)
+
+
+def call(operation: str, socket_path: Union[None, str] = None, timeout: Optional[float] = 30.0, **arguments: Any) -> Any:
+    """ a single operation on a new connection, raises DaemonError if the daemon reports an error """
+    with DaemonClient(socket_path, timeout=timeout) as client:
+        return client.call(operation, **arguments)
@@ -0,0 +1,165 @@
+# STDLIB
+import fnmatch
+import os
+import pathlib
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type, Union
+
+# PROJ
+from . import configmagick            # type: ignore # pragma: no cover
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+
+# the detection reads at most that many bytes of a file
+default_prefix_size = 4096
+
+
+class Detection(NamedTuple):
+    """ the result of a grammar detection - name and grammar_class are None if no grammar reached min_confidence
+    candidates : (name, confidence) of all registered grammars, the most likely first. signals : the signals of the chosen grammar """
+    name: Optional[str]
+    grammar_class: Optional[Type[grammar_basic.GrammarBase]]
+    confidence: float
+    seconds: float
+    candidates: List[Tuple[str, float]]
+    signals: List[str]
+
+
+class GrammarRegistry(object):
+    """ the grammars which take part in the detection, with their names - registered earlier wins a tie
+
+    the detection uses the signals the grammar classes declare (see grammar_basic.GrammarBase.detect_globs, ...) :
+    the file name, and the lines of a bounded prefix of the file. No grammar is parsed. The confidences of the matching
+    signals of a grammar are combined like independent evidence : 1 - (1 - c1) * (1 - c2) ...
+    a grammar whose detect_line_shape does not match every complete line of the prefix is ruled out.
+
+    >>> registry = GrammarRegistry()
+    >>> registry.register('updatedb', grammar_basic.GrammarUpdateDbConf)
+    >>> detection = registry.detect_from_prefix('/etc/updatedb.conf', b'PRUNE_BIND_MOUNTS="yes"\\nPRUNEFS="NFS"\\n')
+    >>> detection.name, round(detection.confidence, 2), len(detection.signals), detection.signals[0]
+    ('updatedb', 0.99, 3, "glob 'updatedb.conf'")
+    >>> # the content alone
+    >>> registry.detect_from_prefix('/etc/locate.conf', b'# locate\\nPRUNEFS="NFS"\\n').name
+    'updatedb'
+    >>> # ruled out by the line shape, even with the right name
+    >>> detection = registry.detect_from_prefix('/etc/updatedb.conf', b'[section]\\nPRUNEFS="NFS"\\n')
+    >>> detection.name, detection.candidates
+    (None, [('updatedb', 0.0)])
+    >>> # only the complete lines of a truncated prefix are checked
+    >>> registry.detect_from_prefix('locate.conf', b'PRUNEFS="NFS afs"\\nPRUNEPATHS="/tm', complete=False).name
+    'updatedb'
+    >>> registry.register('updatedb', grammar_basic.GrammarBasic)
+    Traceback (most recent call last):
+        ...
+    ValueError: a grammar named 'updatedb' is already registered
+
+    """
+
+    def __init__(self) -> None:
+        # name -> grammar class, in registration order
+        self.grammars = dict()      # type: Dict[str, Type[grammar_basic.GrammarBase]]
+
+    def register(self, name: str, grammar_class: Type[grammar_basic.GrammarBase]) -> None:
+        if name in self.grammars:
+            raise ValueError('a grammar named {name!r} is already registered'.format(name=name))
+        self.grammars[name] = grammar_class
+
+    def unregister(self, name: str) -> None:
+        del self.grammars[name]
+
+    def detect(self, path_file: Union[str, pathlib.Path], prefix_size: int = default_prefix_size, min_confidence: float = 0.5) -> Detection:
+        """ detects the grammar of the file from its name and its first prefix_size bytes
+
+        >>> detection = default_registry.detect(pathlib.Path(__file__).parent.parent / 'tests' / 'updatedb.conf')
+        >>> detection.name, detection.grammar_class.__name__, detection.seconds < 1
+        ('updatedb', 'GrammarUpdateDbConf', True)
+        >>> default_registry.detect(__file__).name is None
+        True
+
+        """
+        start_time = time.perf_counter()
+        with open(str(path_file), 'rb') as data_file:
+            prefix = data_file.read(prefix_size + 1)
+        return self.detect_from_prefix(str(path_file), prefix[:prefix_size], complete=len(prefix) <= prefix_size,
+                                       min_confidence=min_confidence, start_time=start_time)
+
+    def detect_from_prefix(self, path_file: str, prefix: bytes, complete: bool = True, min_confidence: float = 0.5,
+                           start_time: Optional[float] = None) -> Detection:
+        """ complete : the prefix is the whole file - otherwise the last, maybe partial line is not checked """
+        if start_time is None:
+            start_time = time.perf_counter()
+        lines = get_prefix_lines(prefix, complete=complete)
+        candidates = list()     # type: List[Tuple[str, float]]
+        signals_by_name = dict()    # type: Dict[str, List[str]]
+        for grammar_name, grammar_class in self.grammars.items():
+            confidence, signals = get_confidence(grammar_class, path_file, lines)
+            candidates.append((grammar_name, confidence))
+            signals_by_name[grammar_name] = signals
+        # sorted is stable - the first registered grammar wins a tie
+        candidates.sort(key=lambda candidate: -candidate[1])
+
+        name = None             # type: Optional[str]
+        confidence = 0.0
+        if candidates and candidates[0][1] >= min_confidence:
+            name, confidence = candidates[0]
+        if lib_parse.instrumentation_hooks:
+            lib_parse.report_phase('detect', start_time, bytes_processed=len(prefix))
+        return Detection(name, self.grammars[name] if name is not None else None, confidence, time.perf_counter() - start_time,
+                         candidates, signals_by_name[name] if name is not None else [])
+
+
+def get_prefix_lines(prefix: bytes, complete: bool = True) -> List[str]:
+    """ the lines of the prefix, without line endings - decoded leniently, the prefix might end within a character
+
+    >>> get_prefix_lines(b'a\\r\\nb\\nc'), get_prefix_lines(b'a\\r\\nb\\nc', complete=False), get_prefix_lines(b'')
+    (['a', 'b', 'c'], ['a', 'b'], [])
+
+    """
+    lines = prefix.decode('utf-8', errors='replace').splitlines()
+    if not complete and lines:
+        lines.pop()
+    return lines
+
+
+def get_confidence(grammar_class: Type[grammar_basic.GrammarBase], path_file: str, lines: List[str]) -> Tuple[float, List[str]]:
+    """ the combined confidence of the matching signals of the grammar, and the matching signals
+
+    >>> get_confidence(grammar_basic.GrammarUpdateDbConf, 'updatedb.conf', ['# only comments'])
+    (0.9, ["glob 'updatedb.conf'"])
+    >>> get_confidence(grammar_basic.GrammarBasic, 'updatedb.conf', ['A="x"'])
+    (0.0, [])
+
+    """
+    line_shape = grammar_class.detect_line_shape
+    if line_shape is not None and not all(line_shape.fullmatch(line) for line in lines):
+        return 0.0, []
+
+    signals = list()            # type: List[str]
+    unlikeliness = 1.0
+    file_name = os.path.basename(path_file)
+    for pattern, confidence in grammar_class.detect_globs:
+        if fnmatch.fnmatchcase(path_file if '/' in pattern else file_name, pattern):
+            signals.append('glob {pattern!r}'.format(pattern=pattern))
+            unlikeliness *= 1 - confidence
+    for regex, confidence in grammar_class.detect_line_regexes:
+        if any(regex.search(line) for line in lines):
+            signals.append('line {pattern!r}'.format(pattern=regex.pattern))
+            unlikeliness *= 1 - confidence
+    return 1 - unlikeliness, signals
+
+
+def get_default_registry() -> GrammarRegistry:
+    """ the grammars of the command line (configmagick.grammars) """
+    registry = GrammarRegistry()
+    for name, grammar_class_name in configmagick.grammars.items():
+        registry.register(name, getattr(grammar_basic, grammar_class_name))
+    return registry
+
+
+# process wide registry, used by detect_grammar - register more grammars with default_registry.register(name, grammar_class)
+default_registry = get_default_registry()
+
+
+def detect_grammar(path_file: Union[str, pathlib.Path], prefix_size: int = default_prefix_size, min_confidence: float = 0.5) -> Detection:
+    """ default_registry.detect - see GrammarRegistry.detect """
+    return default_registry.detect(path_file, prefix_size=prefix_size, min_confidence=min_confidence)
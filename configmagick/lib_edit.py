@@ -0,0 +1,269 @@
+# STDLIB
+import bisect
+import locale
+import os
+import pathlib
+import re
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+from . import lib_parse_helpers       # type: ignore # pragma: no cover
+
+
+class ConfigEditor(object):
+    """ edits a config with span level patches against the original text
+
+    only the edited assignments are composed, all other regions (comments, whitespace, other assignments)
+    are copied through verbatim. save() writes the spliced text atomically (temp file and rename).
+
+    >>> editor = ConfigEditor('# comment\\nA = "x y"   # keep\\nB="z"\\n\\nC="c"\\n', grammar_basic.GrammarUpdateDbConf())
+    >>> editor.set_value('A', ['x', 'y', 'w'])
+    >>> editor.delete_key('B')
+    >>> editor.set_value('D', 'new')
+    >>> editor.get_patches()
+    [(10, 29, 'A="x y w" # keep\\n'), (29, 35, ''), (42, 42, 'D="new"\\n')]
+    >>> print(editor.get_text(), end='')
+    # comment
+    A="x y w" # keep
+    <BLANKLINE>
+    C="c"
+    D="new"
+
+    >>> # the last edit of a key wins
+    >>> editor.set_value('A', '')
+    >>> editor.get_patches()[0]
+    (10, 29, 'A="" # keep\\n')
+    >>> editor.delete_key('does_not_exist')
+    Traceback (most recent call last):
+        ...
+    KeyError: 'does_not_exist'
+
+    >>> # quoted keys are kept as they are written
+    >>> editor = ConfigEditor("'a\\\\'b'=\\"x\\"\\n\\"C D\\" = \\"x\\"\\n", grammar_basic.GrammarUpdateDbConf())
+    >>> editor.set_value("a\\\\'b", 'y')
+    >>> editor.set_value('C D', 'y')
+    >>> print(editor.get_text(), end='')
+    'a\\'b'="y"
+    "C D"="y"
+
+    >>> # values and new keys are written unquoted, they must match the grammar
+    >>> editor.set_value('A', ['a"b'])
+    Traceback (most recent call last):
+        ...
+    ValueError: invalid value 'a"b'
+    >>> editor.set_value('A', '#')
+    Traceback (most recent call last):
+        ...
+    ValueError: invalid value '#'
+    >>> editor.set_value('NEW KEY', 'v')
+    Traceback (most recent call last):
+        ...
+    ValueError: invalid key 'NEW KEY'
+
+    >>> # CRLF line endings are kept - the edited and new lines get the line ending of the file
+    >>> editor = ConfigEditor('A="x"\\r\\n# keep   me\\r\\nB  =  "y"   # c\\r\\n', grammar_basic.GrammarUpdateDbConf())
+    >>> editor.set_value('B', 'z')
+    >>> editor.set_value('C', 'c')
+    >>> editor.get_text()
+    'A="x"\\r\\n# keep   me\\r\\nB="z" # c\\r\\nC="c"\\r\\n'
+
+    """
+
+    def __init__(self, string_data: str, grammar: grammar_basic.GrammarBase, path_file: Union[None, str, pathlib.Path] = None,
+                 backend: str = 'arpeggio') -> None:
+        self.string_data = string_data
+        self.grammar = grammar
+        self.path_file = path_file
+        self.backend = backend
+        # the grammar knows only '\n' line endings - CRLF files are parsed with '\n', the positions are mapped back to string_data
+        self.newline = '\r\n' if '\r\n' in string_data else '\n'
+        # the positions of the newlines in the parsed text, which are CRLF in string_data
+        self._crlf_positions = list()       # type: List[int]
+        parse_data = string_data
+        if self.newline == '\r\n':
+            parse_data = string_data.replace('\r\n', '\n')
+            self._crlf_positions = [index - offset for offset, index in enumerate(match.start() for match in re.finditer('\r\n', string_data))]
+        self.records = lib_parse.get_semantic_data_from_string(parse_data, grammar=grammar, backend=backend)
+        self.assignments_by_key = dict()     # type: Dict[str, List[Any]]
+        for record in self.records:
+            if isinstance(record, grammar_basic.GrammarUpdateDbConf.AssignMultipleValuesQuoted):
+                self.assignments_by_key.setdefault(str(record.key), list()).append(record)
+        # start -> (end, replacement)
+        self._patches = dict()               # type: Dict[int, Tuple[int, str]]
+        # new assignments, appended at the end of the file
+        self._appended = dict()              # type: Dict[str, str]
+
+    @classmethod
+    def from_file(cls, path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase, backend: str = 'arpeggio') -> 'ConfigEditor':
+        """ the line endings are read as they are, without newline translation """
+        with open(str(path_file), 'r', newline='') as data_file:
+            string_data = data_file.read()
+        return cls(string_data, grammar=grammar, path_file=path_file, backend=backend)
+
+    def set_value(self, key: str, value: Union[str, Iterable[str]]) -> None:
+        """ sets the values of all assignments of the key, appends a new assignment if the key does not exist.
+        value is a blank separated string or a list of values """
+        if isinstance(value, str):
+            value = value.split()
+        value = list(value)
+        for item in value:
+            if not is_unquoted_word(item):
+                raise ValueError('invalid value {item!r}'.format(item=item))
+        values = grammar_basic.GrammarUpdateDbConf.MultipleValuesBlankSeparated(grammar_basic.GrammarBasic.UnicodeString(item) for item in value)
+
+        if key not in self.assignments_by_key:
+            if not is_unquoted_word(key):
+                raise ValueError('invalid key {key!r}'.format(key=key))
+            record = grammar_basic.GrammarUpdateDbConf.AssignMultipleValuesQuoted(
+                [grammar_basic.GrammarBasic.UnicodeString(key), values, grammar_basic.GrammarBasic.Newline('\n')])
+            self._appended[key] = lib_parse_helpers.compose(record, self.grammar)[:-1] + self.newline
+            return
+
+        for record in self.assignments_by_key[key]:
+            new_record = grammar_basic.GrammarUpdateDbConf.AssignMultipleValuesQuoted(record)
+            # the key is copied from the original text - quoted keys are stored as written, composing would escape them again
+            new_record[0] = grammar_basic.ComposeString(self._get_key_text(record))
+            new_record[1] = values
+            start, end = self._get_span(record)
+            # the composed record ends with '\n' - it gets the line ending it had
+            newline = '\r\n' if self.string_data.endswith('\r\n', start, end) else '\n'
+            self._patches[start] = (end, lib_parse_helpers.compose(new_record, self.grammar)[:-1] + newline)
+
+    def _get_span(self, record: Any) -> Tuple[int, int]:
+        """ the (start, end) of the record in string_data """
+        return (record.start + bisect.bisect_left(self._crlf_positions, record.start),
+                record.end + bisect.bisect_left(self._crlf_positions, record.end))
+
+    def _get_key_text(self, record: Any) -> str:
+        """ the key as written in the original text, with the quotes - the record starts with the key """
+        key_length = len(record.key)
+        if isinstance(record.key, (grammar_basic.GrammarBasic.SingleQuotedString, grammar_basic.GrammarBasic.DoubleQuotedString)):
+            key_length += 2
+        start = self._get_span(record)[0]
+        key_text = self.string_data[start:start + key_length]     # type: str
+        return key_text
+
+    def delete_key(self, key: str) -> None:
+        """ removes all assignment lines of the key """
+        if key in self._appended:
+            del self._appended[key]
+            return
+        if key not in self.assignments_by_key:
+            raise KeyError(key)
+        for record in self.assignments_by_key[key]:
+            start, end = self._get_span(record)
+            self._patches[start] = (end, '')
+
+    def get_patches(self) -> List[Tuple[int, int, str]]:
+        """ the sorted list of (start, end, replacement) patches against the original text """
+        patches = [(start, end, replacement) for start, (end, replacement) in sorted(self._patches.items())]
+        if self._appended:
+            end_of_text = len(self.string_data)
+            separator = '' if not self.string_data or self.string_data.endswith('\n') else self.newline
+            patches.append((end_of_text, end_of_text, separator + ''.join(self._appended.values())))
+        return patches
+
+    def get_text(self) -> str:
+        """ the original text with the patches spliced in """
+        pieces = list()     # type: List[str]
+        position = 0
+        for start, end, replacement in self.get_patches():
+            pieces.append(self.string_data[position:start])
+            pieces.append(replacement)
+            position = end
+        pieces.append(self.string_data[position:])
+        return ''.join(pieces)
+
+    def save(self, path_file: Union[None, str, pathlib.Path] = None) -> None:
+        """ writes the patched text atomically to path_file (default : the file it was read from)
+
+        >>> test_directory = pathlib.Path(tempfile.mkdtemp())
+        >>> path_file = test_directory / 'updatedb.conf'
+        >>> _ = path_file.write_text('A="x"\\n# comment\\n')
+        >>> editor = ConfigEditor.from_file(path_file, grammar_basic.GrammarUpdateDbConf())
+        >>> editor.set_value('A', 'y')
+        >>> editor.save()
+        >>> path_file.read_text()
+        'A="y"\\n# comment\\n'
+        >>> editor.get_patches()
+        []
+        >>> # the untouched CRLF lines are written back verbatim
+        >>> _ = path_file.write_bytes(b'A="x"\\r\\n# keep   me\\r\\nB  =  "y"   # c\\r\\n')
+        >>> editor = ConfigEditor.from_file(path_file, grammar_basic.GrammarUpdateDbConf())
+        >>> editor.set_value('B', 'z')
+        >>> editor.save()
+        >>> path_file.read_bytes()
+        b'A="x"\\r\\n# keep   me\\r\\nB="z" # c\\r\\n'
+        >>> path_file.unlink()
+        >>> test_directory.rmdir()
+
+        """
+        if path_file is None:
+            path_file = self.path_file
+        if path_file is None:
+            raise ValueError('no path_file given, and the editor was not created from a file')
+        string_data = self.get_text()
+        write_file_atomic(path_file, string_data)
+        # the saved text is the new original, the patches are applied
+        self.__init__(string_data, grammar=self.grammar, path_file=path_file, backend=self.backend)     # type: ignore
+
+
+def is_unquoted_word(word: str) -> bool:
+    """ the values and new keys are composed unquoted, they must match the grammar rule of unquoted words
+
+    >>> is_unquoted_word('/tmp'), is_unquoted_word(''), is_unquoted_word('a b'), is_unquoted_word('#')
+    (True, False, False, False)
+
+    """
+    return _allowed_chars_regex.fullmatch(word) is not None
+
+
+def _get_allowed_chars_regex() -> 're.Pattern[str]':
+    allowed_chars = grammar_basic.GrammarBasic.allowed_chars()
+    return re.compile(allowed_chars.to_match_regex, allowed_chars.explicit_flags)      # type: ignore
+
+
+_allowed_chars_regex = _get_allowed_chars_regex()
+
+
+def write_file_atomic(path_file: Union[str, pathlib.Path], string_data: str) -> None:
+    """ write_bytes_atomic of the text, in the default encoding - the line endings are written as they are """
+    write_bytes_atomic(path_file, string_data.encode(locale.getpreferredencoding(False)))
+
+
+def write_bytes_atomic(path_file: Union[str, pathlib.Path], data: bytes) -> None:
+    """ writes to a temporary file in the same directory and renames it - readers see the old or the new file, never a partial one.
+    the data is synced to the disk before the rename, the permissions of an existing file are kept
+
+    >>> test_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> path_file = test_directory / 'data.bin'
+    >>> _ = path_file.write_bytes(b'old')
+    >>> os.chmod(str(path_file), 0o640)
+    >>> write_bytes_atomic(path_file, b'new\\r\\n')
+    >>> path_file.read_bytes(), oct(os.stat(str(path_file)).st_mode & 0o777), os.listdir(str(test_directory))
+    (b'new\\r\\n', '0o640', ['data.bin'])
+    >>> path_file.unlink()
+    >>> test_directory.rmdir()
+
+    """
+    path_file = os.path.abspath(str(path_file))
+    file_mode = None    # type: Optional[int]
+    try:
+        file_mode = os.stat(path_file).st_mode & 0o7777
+    except FileNotFoundError:
+        pass
+    file_descriptor, temp_file_name = tempfile.mkstemp(dir=os.path.dirname(path_file), prefix='.' + os.path.basename(path_file) + '.')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if file_mode is not None:
+            os.chmod(temp_file_name, file_mode)
+        os.replace(temp_file_name, path_file)
+    except Exception:
+        os.unlink(temp_file_name)
+        raise
@@ -0,0 +1,122 @@
+# STDLIB
+import hashlib
+import os
+import pathlib
+import pickle
+import platform
+import sys
+import tempfile
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+# EXT
+import arpeggio as arp
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_edit                # type: ignore # pragma: no cover
+
+# bump if the layout of the artifacts changes
+ARTIFACT_FORMAT_VERSION = 1
+
+# transient parser state, reset before the parser is saved
+transient_parser_state = {'parse_tree': None, 'comment_positions': {}, 'last_pexpression': None,
+                          'in_rule': '', 'in_parse_comments': False, 'in_lex_rule': False, 'in_not': False}
+
+
+def get_default_artifact_directory() -> pathlib.Path:
+    """ $XDG_CACHE_HOME/configmagick/grammars, or ~/.cache/configmagick/grammars
+
+    >>> get_default_artifact_directory().parts[-2:]
+    ('configmagick', 'grammars')
+
+    """
+    cache_directory = os.environ.get('XDG_CACHE_HOME') or str(pathlib.Path.home() / '.cache')
+    return pathlib.Path(cache_directory) / 'configmagick' / 'grammars'
+
+
+def get_artifact_key(grammar_class: Type[grammar_basic.GrammarBase], grammar_fingerprint: str, ws: str, optimize: bool,
+                     parser_options: Dict[str, Any]) -> Tuple[Any, ...]:
+    """ everything the built parser depends on - an artifact with a different key is stale
+
+    >>> from configmagick import lib_parser_cache
+    >>> fingerprint = lib_parser_cache.get_grammar_fingerprint(grammar_basic.GrammarUpdateDbConf)
+    >>> artifact_key = get_artifact_key(grammar_basic.GrammarUpdateDbConf, fingerprint, ' ', True, {'debug': False})
+    >>> artifact_key[:2], artifact_key[-3:]
+    ((1, 'configmagick.grammar_basic.GrammarUpdateDbConf'), (' ', True, (('debug', False),)))
+
+    """
+    grammar_name = '{module}.{name}'.format(module=grammar_class.__module__, name=grammar_class.__qualname__)
+    # the python version matters too : the pickled regexes and the fused expressions depend on it
+    return (ARTIFACT_FORMAT_VERSION, grammar_name, grammar_fingerprint, arp.__version__, platform.python_implementation(),
+            tuple(sys.version_info[:2]), ws, optimize, tuple(sorted(parser_options.items())))
+
+
+def get_artifact_path(artifact_directory: Union[str, pathlib.Path], artifact_key: Tuple[Any, ...]) -> pathlib.Path:
+    """ one file per grammar and parser options - the versions are not part of the name,
+    so a stale artifact is overwritten by the rebuilt one, instead of piling up
+
+    >>> get_artifact_path('/cache', (1, 'a.Grammar', 'fingerprint', '2.0.3', 'CPython', (3, 11), ' ', True, ()))
+    PosixPath('/cache/a.Grammar-....parser')
+
+    """
+    options_digest = hashlib.sha256(repr(artifact_key[6:]).encode('utf-8')).hexdigest()[:16]
+    file_name = '{grammar_name}-{options_digest}.parser'.format(grammar_name=artifact_key[1], options_digest=options_digest)
+    return pathlib.Path(artifact_directory) / file_name
+
+
+def save_parser(parser: arp.ParserPython, path_artifact: Union[str, pathlib.Path], artifact_key: Tuple[Any, ...]) -> None:
+    """ writes the parser model atomically - concurrent processes never see a partially written artifact.
+    the artifact is the key as first pickle, followed by the pickled parser state
+
+    the artifacts are pickles, so only use a directory that is not writable by untrusted users.
+    """
+    path_artifact = pathlib.Path(path_artifact)
+    parser_state = dict(vars(parser))
+    parser_state.pop('file', None)      # the debug output stream, it is restored on load
+    parser_state.update(transient_parser_state)
+    path_artifact.parent.mkdir(parents=True, exist_ok=True)
+    artifact_data = pickle.dumps(artifact_key, protocol=pickle.HIGHEST_PROTOCOL) + pickle.dumps(parser_state, protocol=pickle.HIGHEST_PROTOCOL)
+    lib_edit.write_bytes_atomic(path_artifact, artifact_data)
+
+
+def load_parser(path_artifact: Union[str, pathlib.Path], artifact_key: Tuple[Any, ...]) -> Optional[arp.ParserPython]:
+    """ the parser of the artifact, or None if there is no artifact, it is stale or it can not be read
+
+    the key is checked before the parser state is unpickled, so the classes of an other arpeggio version are never loaded
+
+    >>> import shutil
+    >>> from configmagick import lib_parser_cache
+    >>> grammar_class = grammar_basic.GrammarUpdateDbConf
+    >>> artifact_key = get_artifact_key(grammar_class, lib_parser_cache.get_grammar_fingerprint(grammar_class), grammar_class.whitespace, False, {})
+    >>> temp_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> path_artifact = get_artifact_path(temp_directory, artifact_key)
+    >>> load_parser(path_artifact, artifact_key) is None
+    True
+    >>> parser = arp.ParserPython(grammar_class.grammar, ws=grammar_class.whitespace)
+    >>> save_parser(parser, path_artifact, artifact_key)
+    >>> loaded_parser = load_parser(path_artifact, artifact_key)
+    >>> test_data = 'A="x y" # c\\n# c1\\n\\n'
+    >>> assert loaded_parser.parse(test_data).tree_str() == parser.parse(test_data).tree_str()
+
+    >>> # stale - like an other grammar source or arpeggio version
+    >>> load_parser(path_artifact, artifact_key[:2] + ('other fingerprint', ) + artifact_key[3:]) is None
+    True
+    >>> # corrupt
+    >>> _ = path_artifact.write_bytes(b'garbage')
+    >>> load_parser(path_artifact, artifact_key) is None
+    True
+    >>> shutil.rmtree(str(temp_directory))
+
+    """
+    try:
+        with open(str(path_artifact), 'rb') as artifact_file:
+            if pickle.load(artifact_file) != artifact_key:
+                return None
+            parser_state = pickle.load(artifact_file)
+    except Exception:
+        # missing, truncated, corrupt or otherwise unreadable - it is rebuilt
+        return None
+    parser = arp.ParserPython.__new__(arp.ParserPython)
+    parser.__dict__.update(parser_state)
+    parser.file = sys.stdout
+    return parser
@@ -0,0 +1,242 @@
+# STDLIB
+import re
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+# EXT
+import arpeggio
+
+# regex features which do not survive being embedded into a bigger regex
+regex_not_fusable = re.compile(r'\\[1-9]|\(\?P=|\(\?[=!<]')
+# leading global inline flags like (?s) - they are turned into scoped flags
+regex_global_flags = re.compile(r'^\(\?([aiLmsux]+)\)')
+# atomic groups (python 3.11+) give every element of a fused sequence the PEG semantic : no backtracking into an element
+atomic_groups_supported = sys.version_info >= (3, 11)
+
+scoped_flags = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x'))
+
+
+class FusedExpression(arpeggio.ParsingExpression):
+    """ base of the fused expressions - it replaces the original expression in the parser model,
+    keeps its rule_name and root flag, and creates the very same terminals as the original terminals would """
+
+    def __init__(self, original: arpeggio.ParsingExpression, terminals: List[arpeggio.Match]) -> None:
+        super(FusedExpression, self).__init__(rule_name=original.rule_name, root=original.root, nodes=[])
+        self.original = original
+        self.terminals = terminals
+        self.terminal_patterns = [get_terminal_pattern(terminal) for terminal in terminals]
+        self._regexes = dict()      # type: Dict[Tuple[Any, ...], Any]
+        self.terminal_regexes = None    # type: Optional[List[Any]]
+        self.group_indices = list()     # type: List[int]
+        self.terminals_by_group = dict()    # type: Dict[str, arpeggio.Match]
+
+    @property
+    def name(self) -> str:
+        return self.original.name
+
+    def _clear_cache(self, processed: Optional[set] = None) -> None:
+        super(FusedExpression, self)._clear_cache(processed)
+        self.original._clear_cache(processed)
+
+
+class FusedChoice(FusedExpression):
+    """ an OrderedChoice of terminals as one regex with one named group per alternative """
+
+    def get_regex(self) -> Any:
+        regex = self._regexes.get(())
+        if regex is None:
+            regex = re.compile('|'.join('(?P<_fused_{index}>{pattern})'.format(index=index, pattern=pattern)
+                                        for index, pattern in enumerate(self.terminal_patterns)))
+            self.terminals_by_group = {'_fused_{index}'.format(index=index): terminal for index, terminal in enumerate(self.terminals)}
+            self._regexes[()] = regex
+        return regex
+
+    def _parse(self, parser: arpeggio.Parser) -> Any:
+        position = parser.position
+        if parser.skipws and not parser.in_lex_rule:
+            # the whitespace skipping of the alternatives
+            string_data = parser.input
+            length = len(string_data)
+            whitespace = parser.ws
+            while position < length and string_data[position] in whitespace:
+                position += 1
+        match = self.get_regex().match(parser.input, position)
+        if match is None:
+            parser.position = position
+            raise_no_match(parser, self.terminals, position)
+        parser.position = match.end()
+        return [arpeggio.Terminal(self.terminals_by_group[match.lastgroup], position, match.group(), extra_info=match)]
+
+
+class FusedSequence(FusedExpression):
+    """ a Sequence of terminals as one regex with one named atomic group per element,
+    the whitespace between the elements is matched by the regex """
+
+    def get_regex(self, whitespace: Optional[str]) -> Any:
+        regex = self._regexes.get((whitespace, ))
+        if regex is None:
+            whitespace_pattern = '[{whitespace}]*'.format(whitespace=re.escape(whitespace)) if whitespace else ''
+            regex = re.compile(''.join('{whitespace}(?P<_fused_{index}>(?>{pattern}))'.format(
+                whitespace=whitespace_pattern, index=index, pattern=pattern) for index, pattern in enumerate(self.terminal_patterns)))
+            self.group_indices = [regex.groupindex['_fused_{index}'.format(index=index)] for index in range(len(self.terminal_patterns))]
+            self._regexes[(whitespace, )] = regex
+        return regex
+
+    def _parse(self, parser: arpeggio.Parser) -> Any:
+        position = parser.position
+        skip_whitespace = parser.skipws and not parser.in_lex_rule
+        match = self.get_regex(parser.ws if skip_whitespace else None).match(parser.input, position)
+        if match is None:
+            self.raise_no_match(parser, position, skip_whitespace)
+        results = list()
+        for group_index, terminal in zip(self.group_indices, self.terminals):
+            start, end = match.span(group_index)
+            if start == end:
+                continue        # an empty match does not create a terminal
+            # string matches within a sequence are suppressed, like arpeggio.StrMatch does it
+            results.append(arpeggio.Terminal(terminal, start, match.string[start:end], suppress=type(terminal) is arpeggio.StrMatch))
+        parser.position = match.end()
+        return results or None
+
+    def raise_no_match(self, parser: arpeggio.Parser, position: int, skip_whitespace: bool) -> None:
+        """ matches the elements one by one, to report the failing element at its position - like arpeggio.Sequence does """
+        if self.terminal_regexes is None:
+            self.terminal_regexes = [re.compile(pattern) for pattern in self.terminal_patterns]
+        string_data = parser.input
+        length = len(string_data)
+        whitespace = parser.ws
+        for terminal, regex in zip(self.terminals, self.terminal_regexes):
+            while skip_whitespace and position < length and string_data[position] in whitespace:
+                position += 1
+            match = regex.match(string_data, position)
+            if match is None:
+                parser._nm_raise(terminal, position, parser)
+            position = match.end()
+        # not reached, the fused regex and the single regexes match the same
+        self.original._parse(parser)     # pragma: no cover
+
+
+def raise_no_match(parser: arpeggio.Parser, terminals: List[arpeggio.Match], position: int) -> None:
+    """ registers every alternative as expected at the position - like the alternatives of an OrderedChoice do """
+    for terminal in terminals:
+        try:
+            parser._nm_raise(terminal, position, parser)
+        except arpeggio.NoMatch:
+            pass
+    raise parser.nm
+
+
+def get_terminal_pattern(terminal: arpeggio.Match) -> str:
+    """ the pattern of a terminal, with its flags as scoped inline flags
+
+    >>> get_terminal_pattern(arpeggio.StrMatch('a.b'))
+    '(?-imsx:a\\\\.b)'
+    >>> regex_match = arpeggio.RegExMatch(r"(?s)('[^']*')")
+    >>> regex_match.compile()
+    >>> get_terminal_pattern(regex_match)
+    "(?ms-ix:('[^']*'))"
+
+    """
+    if isinstance(terminal, arpeggio.StrMatch):
+        flags = re.IGNORECASE if terminal.ignore_case else 0
+        pattern = re.escape(terminal.to_match)
+    else:
+        flags = terminal.regex.flags
+        pattern = regex_global_flags.sub('', terminal.to_match_regex)
+    flags_on = ''.join(letter for flag, letter in scoped_flags if flags & flag)
+    flags_off = ''.join(letter for flag, letter in scoped_flags if not flags & flag)
+    separator = '-' if flags_off else ''
+    return '(?{flags_on}{separator}{flags_off}:{pattern})'.format(flags_on=flags_on, separator=separator, flags_off=flags_off, pattern=pattern)
+
+
+def is_fusable_terminal(expression: arpeggio.ParsingExpression) -> bool:
+    """ plain terminals, which can not match an empty string (an empty match is no match for an alternative) """
+    if type(expression) is arpeggio.StrMatch:
+        return bool(expression.to_match) and not expression.suppress
+    if type(expression) is not arpeggio.RegExMatch or expression.suppress or regex_not_fusable.search(expression.to_match_regex):
+        return False
+    return expression.regex.match('') is None
+
+
+def is_fusable(expression: arpeggio.ParsingExpression) -> bool:
+    """ a choice or sequence of two or more terminals, without own whitespace settings """
+    if type(expression) not in (arpeggio.OrderedChoice, arpeggio.Sequence) or len(expression.nodes) < 2:
+        return False
+    if expression.ws is not None or expression.skipws is not None or expression.suppress:
+        return False
+    if type(expression) is arpeggio.Sequence and not atomic_groups_supported:
+        return False
+    return all(is_fusable_terminal(node) for node in expression.nodes)
+
+
+def get_fused_expression(expression: arpeggio.ParsingExpression) -> Optional[FusedExpression]:
+    """ the fused expression, or None if the regex can not be built (like duplicate group names) """
+    fused_class = FusedChoice if type(expression) is arpeggio.OrderedChoice else FusedSequence
+    fused_expression = fused_class(expression, list(expression.nodes))
+    try:
+        if isinstance(fused_expression, FusedChoice):
+            fused_expression.get_regex()
+        else:
+            fused_expression.get_regex(None)
+    except re.error:
+        return None
+    return fused_expression
+
+
+def optimize_parser(parser: arpeggio.Parser) -> List[str]:
+    """ replaces the terminal only choices and sequences of the parser model by fused expressions (in place).
+    returns the names of the fused expressions
+
+    the fused expressions keep the rule names, and create the same parse tree nodes (the original terminal
+    expressions are the rules of the terminals), so the visitors work unchanged.
+
+    >>> from configmagick import grammar_basic
+    >>> parser = arpeggio.ParserPython(grammar_basic.GrammarUpdateDbConf.grammar, ws=grammar_basic.GrammarUpdateDbConf.whitespace)
+    >>> sorted(optimize_parser(parser))
+    ['OrderedChoice', 'Sequence']
+    >>> test_data = '\\'A \\\\\\' B\\' = "x y" # c\\n # c1\\n# c2\\n\\n"B"=""\\n'
+    >>> reference_parser = arpeggio.ParserPython(grammar_basic.GrammarUpdateDbConf.grammar, ws=grammar_basic.GrammarUpdateDbConf.whitespace)
+    >>> assert parser.parse(test_data).tree_str() == reference_parser.parse(test_data).tree_str()
+    >>> parser.parse('"A=x\\n')
+    Traceback (most recent call last):
+        ...
+    arpeggio.NoMatch: Expected single_quoted_string or double_quoted_string or unicode_string or comment_shell or newline or EOF at position (1, 1) => '*"A=x '.
+
+    >>> # a rule which is terminal only as a whole
+    >>> parser = arpeggio.ParserPython(grammar_basic.GrammarBasic.maybe_quoted_word)
+    >>> optimize_parser(parser)
+    ['OrderedChoice']
+    >>> print(parser.parse("'single quoted'").tree_str())     # doctest: +ELLIPSIS
+    maybe_quoted_word=OrderedChoice [0-15]
+      single_quoted_string=RegExMatch(...) [0-15]: 'single quoted'
+
+    """
+    fused_names = list()
+    fused_expressions = dict()      # type: Dict[int, Optional[FusedExpression]]
+
+    def get_replacement(expression: arpeggio.ParsingExpression) -> Optional[FusedExpression]:
+        if id(expression) not in fused_expressions:
+            fused_expressions[id(expression)] = get_fused_expression(expression) if is_fusable(expression) else None
+            if fused_expressions[id(expression)] is not None:
+                fused_names.append(expression.rule_name or type(expression).__name__)
+        return fused_expressions[id(expression)]
+
+    replacement = get_replacement(parser.parser_model)
+    if replacement is not None:
+        parser.parser_model = replacement
+        return fused_names
+
+    visited = set()
+    stack = [parser.parser_model]
+    while stack:
+        expression = stack.pop()
+        if id(expression) in visited:
+            continue
+        visited.add(id(expression))
+        for index, node in enumerate(expression.nodes):
+            replacement = get_replacement(node)
+            if replacement is not None:
+                expression.nodes[index] = replacement
+            else:
+                stack.append(node)
+    return fused_names
@@ -0,0 +1,329 @@
+# STDLIB
+import bisect
+import copy
+import itertools
+from typing import Any, List, Optional, Tuple
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+from . import lib_parser_cache        # type: ignore # pragma: no cover
+
+# the number of records per block - an edit rebuilds the blocks it touches
+block_size = 64
+
+
+class IncrementalDocument(object):
+    """ text plus semantic records plus line index, which are updated incrementally on edits
+
+    an edit re-parses only the top level records (assignment lines, comment blocks, empty lines) touched by the
+    edited range, plus the neighbour records (an edit might merge or split comment blocks), and splices them in.
+    The cost of an edit depends on the edited records, not on the size of the document :
+
+        - the text is kept as one segment per record (from the end of the previous record to the end of the record),
+          the positions stored in a record are relative to its segment - the following records are never shifted
+        - the segments are grouped in blocks of block_size records. A block knows its length and its newlines,
+          the offsets of the blocks are running sums over the blocks - an edit only rebuilds the blocks it touches
+
+    positions are character offsets into the text, lines are counted from 0.
+    get_record_span(index) returns the absolute span of a record, get_semantic_data() the records with absolute positions.
+
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> document = IncrementalDocument('A="x"\\n# c1\\n\\nB="y"\\nC="z"\\n', grammar)
+    >>> [document.get_line_offset(line) for line in range(document.get_line_count())]
+    [0, 6, 11, 12, 18]
+    >>> document.apply_edit(15, 16, 'yy')           # B="y" -> B="yy"
+    (2, 5)
+    >>> document.get_record(3), document.get_record_span(3)
+    (['B', ['yy'], '\\n'], (12, 19))
+    >>> document.replace_lines(2, 3, '# c2\\n')      # the empty line becomes a comment - the comment blocks merge
+    (1, 4)
+    >>> document.text
+    'A="x"\\n# c1\\n# c2\\nB="yy"\\nC="z"\\n'
+    >>> document.get_record(1)
+    ['# c1', '\\n', '# c2', '\\n']
+    >>> document.get_record_index_at_line(3)
+    2
+    >>> document.verify()
+
+    >>> # an invalid edit raises and leaves the document unchanged
+    >>> document.apply_edit(0, 0, '=')
+    Traceback (most recent call last):
+        ...
+    arpeggio.NoMatch: ...
+    >>> document.verify()
+
+    >>> # many blocks - random edits stay identical to a full parse
+    >>> import random
+    >>> randomizer = random.Random(1)
+    >>> document = IncrementalDocument(''.join('K{index}="v{index}"\\n# c\\n\\n'.format(index=index) for index in range(500)), grammar)
+    >>> for _ in range(200):
+    ...     start = randomizer.randrange(document.get_length() + 1)
+    ...     end = min(start + randomizer.randrange(40), document.get_length())
+    ...     replacement = randomizer.choice(['', '\\n', '# x\\n', 'Z="z"\\n', 'q', '  ', '"'])
+    ...     try:
+    ...         _ = document.apply_edit(start, end, replacement)
+    ...     except Exception:
+    ...         pass
+    >>> document.verify()
+    >>> len(document.blocks) > 1
+    True
+
+    """
+
+    def __init__(self, string_data: str, grammar: grammar_basic.GrammarBase, backend: str = 'arpeggio',
+                 parser_cache: Optional[lib_parser_cache.ParserCache] = None) -> None:
+        self.grammar = grammar
+        self.backend = backend
+        self.parser_cache = parser_cache
+        records, texts, self.tail = self._get_segments(string_data)
+        self.blocks = get_blocks(records, texts)     # type: List[Block]
+        # running sums over the blocks, rebuilt after an edit when they are needed
+        self._block_offsets = None          # type: Optional[List[int]]
+        self._block_first_records = list()  # type: List[int]
+        self._block_first_newlines = list()     # type: List[int]
+
+    @property
+    def text(self) -> str:
+        """ the whole text - joined on every access """
+        return ''.join(text for block in self.blocks for text in block.texts) + self.tail
+
+    def __len__(self) -> int:
+        """ the number of top level records """
+        self._update_index()
+        return self._block_first_records[-1]
+
+    def get_length(self) -> int:
+        """ the length of the text """
+        return self._update_index()[-1] + len(self.tail)
+
+    def apply_edit(self, start: int, end: int, replacement: str) -> Tuple[int, int]:
+        """ replaces text[start:end] with replacement, re-parses the enclosing records.
+        returns the (first, last + 1) index of the re-parsed records """
+        length = self.get_length()
+        if not 0 <= start <= end <= length:
+            raise ValueError('invalid edit range {start}:{end}'.format(start=start, end=end))
+        record_count = len(self)
+
+        # the enclosing records, plus one neighbour on each side - the whitespace before a record start belongs to the record
+        first_index = max(self._get_record_count_starting_before(start) - 2, 0)
+        last_index = min(self._get_record_count_starting_before(end) + 1, record_count - 1)
+        region_start = self._get_segment_start(first_index) if record_count else 0
+        region_texts = [self.get_segment_text(index) for index in range(first_index, last_index + 1)]
+        with_tail = last_index == record_count - 1
+        if with_tail:
+            region_texts.append(self.tail)
+        region_text = ''.join(region_texts)
+        new_region_text = region_text[:start - region_start] + replacement + region_text[end - region_start:]
+        new_records, new_texts, rest = self._get_segments(new_region_text)
+
+        # nothing is changed before the parse succeeded
+        if with_tail:
+            self.tail = rest
+        elif rest:
+            # whitespace after the last new record belongs to the segment of the next record
+            next_record, next_text = self.get_record(last_index + 1), self.get_segment_text(last_index + 1)
+            lib_parse.shift_positions(next_record, len(rest))
+            new_records.append(next_record)
+            new_texts.append(rest + next_text)
+            last_index += 1
+        self._splice(first_index, last_index, new_records, new_texts)
+        return first_index, first_index + len(new_records) - (1 if rest and not with_tail else 0)
+
+    def replace_lines(self, first_line: int, last_line: int, replacement: str) -> Tuple[int, int]:
+        """ replaces the lines first_line to last_line (exclusive) with replacement, which should end with a newline """
+        start = self.get_line_offset(first_line)
+        end = self.get_line_offset(last_line)
+        return self.apply_edit(start, end, replacement)
+
+    def get_record(self, index: int) -> Any:
+        """ the record - its positions are relative to its segment, see get_record_span """
+        block_index, local_index = self._locate(index)
+        return self.blocks[block_index].records[local_index]
+
+    def get_segment_text(self, index: int) -> str:
+        """ the text from the end of the previous record to the end of the record """
+        block_index, local_index = self._locate(index)
+        return self.blocks[block_index].texts[local_index]
+
+    def get_record_span(self, index: int) -> Tuple[int, int]:
+        """ the absolute (start, end) of the record """
+        segment_start = self._get_segment_start(index)
+        record = self.get_record(index)
+        return segment_start + record.start, segment_start + record.end
+
+    def get_semantic_data(self) -> Any:
+        """ copies of all records with absolute positions, like a full parse returns them """
+        records = grammar_basic.ComposeList()
+        segment_start = 0
+        for block in self.blocks:
+            for record, text in zip(block.records, block.texts):
+                record = copy.deepcopy(record)
+                lib_parse.shift_positions(record, segment_start)
+                records.append(record)
+                segment_start += len(text)
+        return records
+
+    def get_line_count(self) -> int:
+        """ a trailing newline does not start a new line """
+        self._update_index()
+        newline_count = self._block_first_newlines[-1]
+        ends_with_newline = not self.tail and self.blocks and self.blocks[-1].texts[-1].endswith('\n')
+        return newline_count + 1 - (1 if ends_with_newline else 0)
+
+    def get_line_offset(self, line: int) -> int:
+        """ the offset of the start of the line, the length of the text for lines after the last line """
+        if line <= 0:
+            return 0
+        block_offsets = self._update_index()
+        newline_index = line - 1
+        if newline_index >= self._block_first_newlines[-1]:
+            return self.get_length()
+        block_index = bisect.bisect_right(self._block_first_newlines, newline_index) - 1
+        block = self.blocks[block_index]
+        return min(block_offsets[block_index] + block.get_newline_positions()[newline_index - self._block_first_newlines[block_index]] + 1,
+                   self.get_length())
+
+    def get_line_of_position(self, position: int) -> int:
+        if not self.blocks:
+            return 0
+        block_offsets = self._update_index()
+        block_index = min(max(bisect.bisect_right(block_offsets, position) - 1, 0), len(self.blocks) - 1)
+        newline_positions = self.blocks[block_index].get_newline_positions()
+        newline_count = self._block_first_newlines[block_index] + bisect.bisect_left(newline_positions, position - block_offsets[block_index])
+        return min(newline_count, self.get_line_count() - 1)
+
+    def get_record_index_at(self, position: int) -> int:
+        """ the index of the record containing the position (or the record before the position) """
+        return max(self._get_record_count_starting_before(position) - 1, 0)
+
+    def get_record_index_at_line(self, line: int) -> int:
+        return self.get_record_index_at(self.get_line_offset(line))
+
+    def verify(self) -> None:
+        """ asserts that the incremental state is identical to a full parse - for tests """
+        text = self.text
+        records = self._parse(text)
+        difference = lib_parse.get_semantic_data_difference(self.get_semantic_data(), records)
+        assert not difference, difference
+        assert [self.get_record_span(index) for index in range(len(self))] == [(record.start, record.end) for record in records]
+        assert [self.get_line_offset(line) for line in range(self.get_line_count())] == get_line_offsets(text)
+        assert self.get_length() == len(text)
+
+    def _parse(self, string_data: str) -> Any:
+        return lib_parse.get_semantic_data_from_string(string_data, grammar=self.grammar, parser_cache=self.parser_cache, backend=self.backend)
+
+    def _get_segments(self, string_data: str) -> Tuple[List[Any], List[str], str]:
+        """ parses the text, returns the records with positions relative to their segments, the segment texts
+        and the text after the last record """
+        records = list(self._parse(string_data))
+        texts = list()      # type: List[str]
+        segment_start = 0
+        for record in records:
+            segment_end = record.end
+            texts.append(string_data[segment_start:segment_end])
+            lib_parse.shift_positions(record, -segment_start)
+            segment_start = segment_end
+        return records, texts, string_data[segment_start:]
+
+    def _splice(self, first_index: int, last_index: int, records: List[Any], texts: List[str]) -> None:
+        """ replaces the records first_index to last_index (inclusive) - the touched blocks are rebuilt """
+        if not self.blocks:
+            self.blocks = get_blocks(records, texts)
+        else:
+            record_count = len(self)
+            first_block, first_local = self._locate(first_index) if first_index < record_count else (len(self.blocks) - 1, len(self.blocks[-1].records))
+            last_block, last_local = self._locate(last_index) if last_index >= first_index else (first_block, first_local - 1)
+            block_records = self.blocks[first_block].records[:first_local] + records + self.blocks[last_block].records[last_local + 1:]
+            block_texts = self.blocks[first_block].texts[:first_local] + texts + self.blocks[last_block].texts[last_local + 1:]
+            self.blocks[first_block:last_block + 1] = get_blocks(block_records, block_texts)
+        self._block_offsets = None
+
+    def _update_index(self) -> List[int]:
+        """ the running sums over the blocks - returns the block offsets """
+        if self._block_offsets is None:
+            self._block_offsets = list(itertools.accumulate((block.length for block in self.blocks), initial=0))
+            self._block_first_records = list(itertools.accumulate((len(block.records) for block in self.blocks), initial=0))
+            self._block_first_newlines = list(itertools.accumulate((block.newline_count for block in self.blocks), initial=0))
+        return self._block_offsets
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        """ the (block index, index in the block) of a record """
+        self._update_index()
+        if not 0 <= index < self._block_first_records[-1]:
+            raise IndexError('record index out of range')
+        block_index = bisect.bisect_right(self._block_first_records, index) - 1
+        return block_index, index - self._block_first_records[block_index]
+
+    def _get_segment_start(self, index: int) -> int:
+        block_index, local_index = self._locate(index)
+        return self._update_index()[block_index] + self.blocks[block_index].get_segment_starts()[local_index]
+
+    def _get_record_count_starting_before(self, position: int) -> int:
+        """ the number of records which start at or before the position """
+        if not self.blocks:
+            return 0
+        block_offsets = self._update_index()
+        block_index = min(max(bisect.bisect_right(block_offsets, position) - 1, 0), len(self.blocks) - 1)
+        return self._block_first_records[block_index] + bisect.bisect_right(self.blocks[block_index].get_record_starts(),
+                                                                            position - block_offsets[block_index])
+
+
+class Block(object):
+    """ consecutive records and their segment texts, with their length and newline count.
+    the positions within the block are computed when they are needed first """
+    __slots__ = ('records', 'texts', 'length', 'newline_count', '_segment_starts', '_record_starts', '_newline_positions')
+
+    def __init__(self, records: List[Any], texts: List[str]) -> None:
+        self.records = records
+        self.texts = texts
+        self.length = sum(map(len, texts))
+        self.newline_count = sum(text.count('\n') for text in texts)
+        self._segment_starts = None         # type: Optional[List[int]]
+        self._record_starts = None          # type: Optional[List[int]]
+        self._newline_positions = None      # type: Optional[List[int]]
+
+    def get_segment_starts(self) -> List[int]:
+        if self._segment_starts is None:
+            self._segment_starts = list(itertools.accumulate(map(len, self.texts[:-1]), initial=0)) if self.texts else []
+        return self._segment_starts
+
+    def get_record_starts(self) -> List[int]:
+        if self._record_starts is None:
+            self._record_starts = [segment_start + record.start for segment_start, record in zip(self.get_segment_starts(), self.records)]
+        return self._record_starts
+
+    def get_newline_positions(self) -> List[int]:
+        if self._newline_positions is None:
+            text = ''.join(self.texts)
+            newline_positions = list()      # type: List[int]
+            position = text.find('\n')
+            while position >= 0:
+                newline_positions.append(position)
+                position = text.find('\n', position + 1)
+            self._newline_positions = newline_positions
+        return self._newline_positions
+
+
+def get_blocks(records: List[Any], texts: List[str]) -> List[Block]:
+    return [Block(records[index:index + block_size], texts[index:index + block_size]) for index in range(0, len(records), block_size)]
+
+
+def get_line_offsets(string_data: str) -> List[int]:
+    """ the offsets of the line starts - a trailing newline does not start a new line
+
+    >>> get_line_offsets('a\\nbb\\n\\nc')
+    [0, 2, 5, 6]
+    >>> get_line_offsets('a\\n')
+    [0]
+    >>> get_line_offsets('')
+    [0]
+
+    """
+    line_offsets = [0]
+    position = string_data.find('\n')
+    length = len(string_data)
+    while position >= 0 and position + 1 < length:
+        line_offsets.append(position + 1)
+        position = string_data.find('\n', position + 1)
+    return line_offsets
@@ -1,41 +1,366 @@
 # STDLIB
+import functools
+import os
 import pathlib
-from typing import List, Union
+import time
+from typing import Any, Callable, IO, Iterator, List, NamedTuple, Optional, Union
 
 # EXT
 import arpeggio as arp
 
-# OWN
-import lib_path
-
 # PROJ
+from . import lib_backends            # type: ignore # pragma: no cover
 from . import lib_parse_helpers       # type: ignore # pragma: no cover
+from . import lib_parser_cache        # type: ignore # pragma: no cover
+from . import lib_scanner             # type: ignore # pragma: no cover
+from . import lib_semantic_cache      # type: ignore # pragma: no cover
 from . import grammar_basic           # type: ignore # pragma: no cover
 
+# see lib_backends
+backends = lib_backends.backends
+
+
+class BackendMismatchError(AssertionError):
+    pass
+
+
+class NoMatchInFile(arp.NoMatch):
+    """ arp.NoMatch of a part of a file (see iter_file_semantic) - position, line and col refer to the whole file """
+
+    def __init__(self, exc: arp.NoMatch, offset: int, line_offset: int) -> None:
+        super(NoMatchInFile, self).__init__(exc.rules, exc.position, exc.parser)
+        # evaluated at once, while the parser still holds the input of the part
+        super(NoMatchInFile, self).eval_attrs()
+        self.position += offset
+        self.line += line_offset
+
+    def eval_attrs(self) -> None:
+        """ evaluated in __init__ """
+
+
+# process wide registry of the compiled parsers, see lib_parser_cache.ParserCache - thread safe, every thread gets its own parsers
+default_parser_cache = lib_parser_cache.ParserCache()
+
+# opt in : the parsers fuse the terminal only rules to single regexes, see lib_grammar_optimizer
+optimize_grammars = False
+
+# process wide cache of semantic results - used by get_file_semantic(..., semantic_cache=default_semantic_cache)
+default_semantic_cache = lib_semantic_cache.SemanticCache()
+
+
+class PhaseEvent(NamedTuple):
+    """ reported to the instrumentation hooks after every phase of every call
+    phase : 'read', 'get_parser', 'parse', 'visit', 'scan' or 'detect' (lib_detect)
+    details : the parser for the phase 'get_parser', otherwise None """
+    phase: str
+    seconds: float
+    bytes_processed: int
+    nodes: int
+    details: Any = None
+
+
+# hook(phase_event) is called after every phase - as long as there are no hooks, nothing is measured
+instrumentation_hooks = list()      # type: List[Callable[[PhaseEvent], None]]
+
+
+def add_instrumentation_hook(hook: Callable[[PhaseEvent], None]) -> None:
+    """
+    >>> events = list()
+    >>> add_instrumentation_hook(events.append)
+    >>> _ = get_semantic_data_from_string('A="x"\\n# c\\n', grammar_basic.GrammarUpdateDbConf())
+    >>> _ = get_semantic_data_from_string('A="x"\\n# c\\n', grammar_basic.GrammarUpdateDbConf(), backend='scanner')
+    >>> remove_instrumentation_hook(events.append)
+    >>> [(event.phase, event.bytes_processed, event.nodes) for event in events]
+    [('get_parser', 0, 0), ('parse', 10, 14), ('visit', 0, 2), ('scan', 10, 2)]
+
+    """
+    instrumentation_hooks.append(hook)
+
+
+def remove_instrumentation_hook(hook: Callable[[PhaseEvent], None]) -> None:
+    instrumentation_hooks.remove(hook)
+
+
+def report_phase(phase: str, start_time: float, bytes_processed: int = 0, nodes: int = 0, details: Any = None) -> None:
+    phase_event = PhaseEvent(phase, time.perf_counter() - start_time, bytes_processed, nodes, details)
+    for hook in list(instrumentation_hooks):
+        hook(phase_event)
+
+
+def get_node_count(parse_tree: Any) -> int:
+    """ the number of nodes of a parse tree, terminals and non terminals """
+    node_count = 0
+    stack = [parse_tree]
+    while stack:
+        node = stack.pop()
+        node_count += 1
+        if isinstance(node, arp.NonTerminal):
+            stack.extend(node)
+    return node_count
 
-def get_file_semantic(path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase):
+
+def get_file_semantic(path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase,
+                      parser_cache: Optional[lib_parser_cache.ParserCache] = None,
+                      semantic_cache: Optional[lib_semantic_cache.SemanticCache] = None, backend: str = 'arpeggio'):
     """ reads the file, parse it and return semantic analyzed data
+    if a semantic_cache is given, the result is taken from the cache as long as the file did not change
+    backend is one of lib_parse.backends
+    >>> import lib_path
     >>> test_directory = lib_path.get_test_directory_path(module_name='configmagick', test_directory_name='tests')
     >>> lib_path.make_test_directory_and_subdirs_fully_accessible_by_current_user(test_directory)
-    >>> get_file_semantic(path_file=test_directory / 'updatedb.conf', grammar=grammar_basic.GrammarUpdateDbConf())
+    >>> semantic_data = get_file_semantic(path_file=test_directory / 'updatedb.conf', grammar=grammar_basic.GrammarUpdateDbConf())
+    >>> semantic_data[0]
+    ['PRUNE_BIND_MOUNTS', ['yes'], '\\n']
+    >>> assert get_file_semantic(test_directory / 'updatedb.conf', grammar_basic.GrammarUpdateDbConf(), backend='differential') == semantic_data
+    >>> assert lib_parse_helpers.compose(semantic_data, grammar_basic.GrammarUpdateDbConf) == (test_directory / 'updatedb.conf').read_text()
 
     """
 
+    if semantic_cache is not None:
+        return semantic_cache.get_file_semantic(path_file, grammar, functools.partial(get_semantic_data_from_string, grammar=grammar,
+                                                                                      parser_cache=parser_cache, backend=backend))
+
+    start_time = time.perf_counter() if instrumentation_hooks else 0.0
     with open(str(path_file), 'r') as data_file:
         string_data = data_file.read()
-    parse_tree = get_parse_tree(string_data=string_data, grammar=grammar)
-    semantic_data = get_semantic_data_from_parse_tree(parse_tree=parse_tree, grammar=grammar)
+    if instrumentation_hooks:
+        report_phase('read', start_time, bytes_processed=len(string_data))
+    semantic_data = get_semantic_data_from_string(string_data=string_data, grammar=grammar, parser_cache=parser_cache, backend=backend)
     return semantic_data
 
 
-def get_parse_tree(string_data: str, grammar: grammar_basic.GrammarBase):
-    """ created the parse tree out of the string
+def iter_file_semantic(path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase,
+                       parser_cache: Optional[lib_parser_cache.ParserCache] = None, backend: str = 'arpeggio',
+                       chunk_size: int = 1024 * 1024) -> Iterator[Any]:
+    """ yields the semantic records of the file one by one - one per assignment, comment block or empty line
+
+    the file is read in chunks of chunk_size characters, only complete lines are parsed. The memory needed is
+    bound by the longest logical line (or comment block) instead of the file size. The start and end positions
+    of the records are character offsets into the whole file, like with get_file_semantic.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as temp_file:
+    ...     _ = temp_file.write('A="x y"\\n# c1\\n# c2\\n\\nB="z" # c\\n# c3\\n')
+    >>> records = list(iter_file_semantic(temp_file.name, grammar_basic.GrammarUpdateDbConf(), chunk_size=4))
+    >>> records
+    [['A', ['x', 'y'], '\\n'], ['# c1', '\\n', '# c2', '\\n'], '\\n', ['B', ['z'], '# c', '\\n'], ['# c3', '\\n']]
+    >>> assert not get_semantic_data_difference(grammar_basic.ComposeList(records), get_file_semantic(temp_file.name, grammar_basic.GrammarUpdateDbConf()))
+
+    >>> # errors report the position in the file, not in the part which was parsed
+    >>> with open(temp_file.name, 'w') as data_file:
+    ...     _ = data_file.write('A="x"\\n' * 1000 + 'B=y\\n')
+    >>> list(iter_file_semantic(temp_file.name, grammar_basic.GrammarUpdateDbConf()))
+    Traceback (most recent call last):
+        ...
+    configmagick.lib_parse.NoMatchInFile: Expected '"' at position (1001, 3) => 'B=*y '.
+    >>> list(iter_file_semantic(temp_file.name, grammar_basic.GrammarUpdateDbConf(), backend='scanner'))
+    Traceback (most recent call last):
+        ...
+    configmagick.lib_scanner.ScanError: Expected assignment, comment or newline at position (1001, 1)
+    >>> os.unlink(temp_file.name)
+
     """
-    parser = arp.ParserPython(grammar.grammar, ws=grammar.whitespace)
+    comment_block = None    # type: Any
+    offset = 0
+    line_offset = 0
+    with open(str(path_file), 'r') as data_file:
+        for logical_line in iter_lines(data_file, chunk_size=chunk_size):
+            try:
+                semantic_data = get_semantic_data_from_string(logical_line, grammar=grammar, parser_cache=parser_cache, backend=backend)
+            except arp.NoMatch as exc:
+                raise NoMatchInFile(exc, offset=offset, line_offset=line_offset) from exc
+            except lib_scanner.ScanError as exc:
+                raise lib_scanner.ScanError(logical_line, exc.position, exc.expected, offset=offset, line_offset=line_offset) from exc
+            for record in semantic_data:
+                shift_positions(record, offset)
+                record_end = record.end
+                if isinstance(record, grammar_basic.GrammarBasic.CommentShellBlock):
+                    # consecutive comment lines are merged to one comment block
+                    if comment_block is None:
+                        comment_block = record
+                    else:
+                        comment_block.extend(record)
+                        grammar_basic.set_position(comment_block, comment_block.start, record_end)
+                    continue
+                if comment_block is not None:
+                    yield comment_block
+                    comment_block = None
+                yield record
+            offset += len(logical_line)
+            line_offset += logical_line.count('\n')
+    if comment_block is not None:
+        yield comment_block
+
+
+def iter_lines(data_file: IO[str], chunk_size: int = 1024 * 1024) -> Iterator[str]:
+    """ yields the lines (including the newline) of a file, read in chunks of chunk_size.
+    The last line is yielded as it is, even without newline
+
+    >>> import io
+    >>> list(iter_lines(io.StringIO('a\\nbb\\n\\nccc'), chunk_size=2))
+    ['a\\n', 'bb\\n', '\\n', 'ccc']
+
+    """
+    remainder = ''
+    while True:
+        chunk = data_file.read(chunk_size)
+        if not chunk:
+            break
+        # resynchronize on the newline boundaries
+        lines = (remainder + chunk).split('\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if remainder:
+        yield remainder
+
+
+def shift_positions(record: Any, offset: int) -> None:
+    """ moves the start and end positions of a record, and of the records it contains, by offset """
+    if offset == 0:
+        return
+    if hasattr(record, 'start'):
+        record.start += offset
+        record.end += offset
+    if isinstance(record, list):
+        for element in record:
+            shift_positions(element, offset)
+
+
+def get_semantic_data_from_string(string_data: str, grammar: grammar_basic.GrammarBase,
+                                  parser_cache: Optional[lib_parser_cache.ParserCache] = None, backend: str = 'arpeggio',
+                                  record_hook: Optional[Callable[[Any], None]] = None):
+    """ record_hook(record) is called for every top level record by the visitor or the scanner
+    >>> get_semantic_data_from_string('A="x"\\n', grammar_basic.GrammarUpdateDbConf(), backend='scanner')
+    [['A', ['x'], '\\n']]
+    >>> get_semantic_data_from_string('A="x"\\n', grammar_basic.GrammarUpdateDbConf(), backend='unknown')
+    Traceback (most recent call last):
+        ...
+    ValueError: unknown backend "unknown", valid backends are ('arpeggio', 'scanner', 'differential')
+
+    """
+    if backend == 'arpeggio':
+        parse_tree = get_parse_tree(string_data=string_data, grammar=grammar, parser_cache=parser_cache)
+        semantic_data = get_semantic_data_from_parse_tree(parse_tree=parse_tree, grammar=grammar, record_hook=record_hook)
+    elif backend == 'scanner':
+        start_time = time.perf_counter() if instrumentation_hooks else 0.0
+        scanner = lib_scanner.get_scanner(lib_parser_cache.get_grammar_class(grammar))
+        semantic_data = scanner.scan(string_data, record_hook=record_hook)
+        if instrumentation_hooks:
+            report_phase('scan', start_time, bytes_processed=len(string_data), nodes=len(semantic_data))
+    elif backend == 'differential':
+        semantic_data = get_semantic_data_differential(string_data=string_data, grammar=grammar, parser_cache=parser_cache)
+        if record_hook is not None:
+            for record in semantic_data:
+                record_hook(record)
+    else:
+        raise ValueError('unknown backend "{backend}", valid backends are {backends}'.format(backend=backend, backends=backends))
+    return semantic_data
+
+
+def get_semantic_data_differential(string_data: str, grammar: grammar_basic.GrammarBase,
+                                   parser_cache: Optional[lib_parser_cache.ParserCache] = None):
+    """ runs the arpeggio and the scanner backend on the same input and asserts identical results,
+    including the types and the source positions of the semantic records
+
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> test_data = ['', '\\n', ' \\t \\n', '# c\\n', '  # c  \\n\\t# c2\\n', 'A=""\\n', ' A = " x\\ty " # c # c\\n',
+    ...              '"A B"="x"\\n', "'A\\\\' B'=" + '"x"\\n', 'A="x"\\n\\n# c\\n\\n\\nB="y" #\\n  ']
+    >>> for string_data in test_data:
+    ...     _ = get_semantic_data_differential(string_data, grammar)
+
+    >>> # both backends must fail on the same input
+    >>> for string_data in ['A="x"', '# c', 'A="x" B\\n', 'A=x\\n', '"A="x"\\n']:
+    ...     try:
+    ...         get_semantic_data_differential(string_data, grammar)
+    ...     except arp.NoMatch:
+    ...         pass
+
+    """
+    try:
+        semantic_data = get_semantic_data_from_string(string_data=string_data, grammar=grammar, parser_cache=parser_cache, backend='arpeggio')
+    except arp.NoMatch as exc:
+        try:
+            get_semantic_data_from_string(string_data=string_data, grammar=grammar, backend='scanner')
+        except lib_scanner.ScanError:
+            raise exc
+        raise BackendMismatchError('the scanner accepted the input, arpeggio raised {exc}'.format(exc=exc))
+
+    try:
+        semantic_data_scanner = get_semantic_data_from_string(string_data=string_data, grammar=grammar, backend='scanner')
+    except lib_scanner.ScanError as exc:
+        raise BackendMismatchError('arpeggio accepted the input, the scanner raised {exc}'.format(exc=exc))
+
+    difference = get_semantic_data_difference(semantic_data, semantic_data_scanner)
+    if difference:
+        raise BackendMismatchError('the backends returned different results: {difference}'.format(difference=difference))
+    return semantic_data
+
+
+def get_semantic_data_difference(semantic_data_1, semantic_data_2, path: str = 'semantic_data') -> str:
+    """ returns a description of the first difference, or an empty string if the data is identical
+
+    >>> a = grammar_basic.ComposeList([grammar_basic.GrammarBasic.UnicodeString('a')])
+    >>> get_semantic_data_difference(a, grammar_basic.ComposeList(['a']))
+    'semantic_data[0]: type UnicodeString != str'
+    >>> get_semantic_data_difference(a, grammar_basic.ComposeList([grammar_basic.GrammarBasic.UnicodeString('b')]))
+    "semantic_data[0]: 'a' != 'b'"
+    >>> get_semantic_data_difference(a, grammar_basic.ComposeList())
+    'semantic_data: length 1 != 0'
+    >>> get_semantic_data_difference(grammar_basic.ComposeOrderedSet(['a', 'a']), grammar_basic.ComposeOrderedSet(['a']))
+    'semantic_data: length 2 != 1'
+
+    """
+    if type(semantic_data_1) is not type(semantic_data_2):
+        return '{path}: type {type_1} != {type_2}'.format(path=path, type_1=type(semantic_data_1).__name__, type_2=type(semantic_data_2).__name__)
+    span_1 = getattr(semantic_data_1, 'start', None), getattr(semantic_data_1, 'end', None)
+    span_2 = getattr(semantic_data_2, 'start', None), getattr(semantic_data_2, 'end', None)
+    if span_1 != span_2:
+        return '{path}: span {span_1} != {span_2}'.format(path=path, span_1=span_1, span_2=span_2)
+    if isinstance(semantic_data_1, grammar_basic.ComposeOrderedSet):
+        # the duplicate values are composed too
+        semantic_data_1, semantic_data_2 = semantic_data_1.tokens, semantic_data_2.tokens
+    if isinstance(semantic_data_1, list):
+        if len(semantic_data_1) != len(semantic_data_2):
+            return '{path}: length {length_1} != {length_2}'.format(path=path, length_1=len(semantic_data_1), length_2=len(semantic_data_2))
+        for index, (element_1, element_2) in enumerate(zip(semantic_data_1, semantic_data_2)):
+            difference = get_semantic_data_difference(element_1, element_2, '{path}[{index}]'.format(path=path, index=index))
+            if difference:
+                return difference
+    elif semantic_data_1 != semantic_data_2:
+        return '{path}: {data_1!r} != {data_2!r}'.format(path=path, data_1=semantic_data_1, data_2=semantic_data_2)
+    return ''
+
+
+def get_parse_tree(string_data: str, grammar: grammar_basic.GrammarBase, parser_cache: Optional[lib_parser_cache.ParserCache] = None):
+    """ created the parse tree out of the string, the parser is taken from the parser cache
+
+    >>> parse_tree = get_parse_tree('PRUNE_BIND_MOUNTS="yes"\\n', grammar=grammar_basic.GrammarUpdateDbConf())
+    >>> assert str(parse_tree) == 'PRUNE_BIND_MOUNTS | = | " | yes | " | \\n | '
+
+    """
+    if not instrumentation_hooks:
+        return get_parser(grammar, parser_cache).parse(string_data)
+
+    start_time = time.perf_counter()
+    parser = get_parser(grammar, parser_cache)
+    report_phase('get_parser', start_time, details=parser)
+    start_time = time.perf_counter()
     parse_tree = parser.parse(string_data)
+    report_phase('parse', start_time, bytes_processed=len(string_data), nodes=get_node_count(parse_tree))
     return parse_tree
 
 
-def get_semantic_data_from_parse_tree(parse_tree, grammar: grammar_basic.GrammarBase):
-    data = arp.visit_parse_tree(parse_tree, grammar.Visitor())
+def get_parser(grammar: grammar_basic.GrammarBase, parser_cache: Optional[lib_parser_cache.ParserCache] = None) -> arp.ParserPython:
+    """ the parser for the grammar from the parser cache (default : default_parser_cache) """
+    if parser_cache is None:
+        parser_cache = default_parser_cache
+    return parser_cache.get_parser(grammar, optimize=optimize_grammars)
+
+
+def get_semantic_data_from_parse_tree(parse_tree, grammar: grammar_basic.GrammarBase, record_hook: Optional[Callable[[Any], None]] = None):
+    start_time = time.perf_counter() if instrumentation_hooks else 0.0
+    data = arp.visit_parse_tree(parse_tree, grammar.Visitor(record_hook=record_hook))
+    if instrumentation_hooks:
+        report_phase('visit', start_time, nodes=len(data) if isinstance(data, list) else 1)
     return data
@@ -0,0 +1,160 @@
+# STDLIB
+import asyncio
+import collections
+import concurrent.futures
+import os
+import pathlib
+from typing import Any, AsyncIterator, Deque, Iterable, Optional, Set, Union
+
+# EXT
+import arpeggio as arp
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+from . import lib_parse_batch         # type: ignore # pragma: no cover
+from . import lib_scanner             # type: ignore # pragma: no cover
+
+
+class ParseError(ValueError):
+    """ arpeggio.NoMatch or lib_scanner.ScanError, raised by the async API - those hold the parser or the input,
+    they can not be sent back from a process pool """
+
+
+async def aget_file_semantic(path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase, backend: str = 'arpeggio',
+                             io_executor: Optional[concurrent.futures.Executor] = None,
+                             parse_executor: Optional[concurrent.futures.Executor] = None) -> Any:
+    """ lib_parse.get_file_semantic without blocking the event loop : the file is read in io_executor and parsed in parse_executor
+
+    the executors default to the default executor of the loop (a thread pool). Parsing is CPU bound, so a process pool
+    (see get_parse_process_pool) scales better over the cores - the data is then pickled to the worker and back.
+    Cancelling the task abandons the result - a parse which is already running in a thread is not interrupted.
+
+    >>> test_directory = pathlib.Path(__file__).parent.parent / 'tests'
+    >>> semantic_data = asyncio.run(aget_file_semantic(test_directory / 'updatedb.conf', grammar_basic.GrammarUpdateDbConf()))
+    >>> semantic_data[0]
+    ['PRUNE_BIND_MOUNTS', ['yes'], '\\n']
+
+    >>> async def parse_invalid():
+    ...     with get_parse_process_pool(grammar_basic.GrammarUpdateDbConf(), workers=1) as parse_executor:
+    ...         return await aget_file_semantic(__file__, grammar_basic.GrammarUpdateDbConf(), parse_executor=parse_executor)
+    >>> asyncio.run(parse_invalid())
+    Traceback (most recent call last):
+        ...
+    configmagick.lib_parse_async.ParseError: Expected ...
+
+    """
+    loop = asyncio.get_running_loop()
+    string_data = await loop.run_in_executor(io_executor, read_file, str(path_file))
+    return await loop.run_in_executor(parse_executor, parse_string, string_data, grammar, backend)
+
+
+async def aget_files_semantic(paths: Iterable[Union[str, pathlib.Path]], grammar: grammar_basic.GrammarBase, backend: str = 'arpeggio',
+                              concurrency: int = 8, ordered: bool = False,
+                              io_executor: Optional[concurrent.futures.Executor] = None,
+                              parse_executor: Optional[concurrent.futures.Executor] = None) -> AsyncIterator[lib_parse_batch.FileResult]:
+    """ parses many files, yields one lib_parse_batch.FileResult per file - in completion order, or in input order with ordered=True
+
+    at most concurrency files are read or parsed at the same time, the paths are consumed as the results are taken.
+    Errors are reported per file, they do not abort the batch. Closing the iterator early (aclose(), or leaving a
+    'async for' loop and the generator is finalized) or cancelling the consuming task cancels the files in flight.
+
+    >>> test_directory = pathlib.Path(__file__).parent.parent / 'tests'
+    >>> paths = [test_directory / 'updatedb.conf', test_directory / 'does_not_exist.conf'] * 3
+    >>> async def parse_all(**options):
+    ...     return [result async for result in aget_files_semantic(paths, grammar_basic.GrammarUpdateDbConf(), concurrency=2, **options)]
+    >>> results = asyncio.run(parse_all(ordered=True))
+    >>> [(pathlib.Path(result.path).name, result.error is None) for result in results]
+    [('updatedb.conf', True), ('does_not_exist.conf', False), ('updatedb.conf', True), ('does_not_exist.conf', False), ('updatedb.conf', True), \
+('does_not_exist.conf', False)]
+    >>> results[1].error
+    "FileNotFoundError: [Errno 2] No such file or directory: '...does_not_exist.conf'"
+    >>> assert sorted(asyncio.run(parse_all(backend='scanner')), key=lambda result: result.path) == sorted(results, key=lambda result: result.path)
+
+    >>> # closing early cancels the files in flight
+    >>> async def parse_first():
+    ...     results = aget_files_semantic(paths, grammar_basic.GrammarUpdateDbConf(), concurrency=2)
+    ...     first_result = await results.__anext__()
+    ...     await results.aclose()
+    ...     return first_result.path in map(str, paths), len(asyncio.all_tasks())
+    >>> asyncio.run(parse_first())
+    (True, 1)
+
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    pending = collections.deque()       # type: Deque[asyncio.Task]
+    running = set()                     # type: Set[asyncio.Task]
+    try:
+        for path in paths:
+            task = asyncio.ensure_future(_get_file_result(str(path), grammar, backend, io_executor, parse_executor))
+            pending.append(task)
+            running.add(task)
+            if len(running) >= concurrency:
+                async for result in _get_finished_results(pending, running, ordered):
+                    yield result
+        while pending:
+            async for result in _get_finished_results(pending, running, ordered):
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _get_finished_results(pending: 'Deque[asyncio.Task]', running: 'Set[asyncio.Task]',
+                                ordered: bool) -> AsyncIterator[lib_parse_batch.FileResult]:
+    """ waits for the oldest file if ordered, otherwise for any file - and yields the results which are finished """
+    if ordered:
+        await asyncio.wait({pending[0]})
+        while pending and pending[0].done():
+            task = pending.popleft()
+            running.discard(task)
+            yield task.result()
+    else:
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            pending.remove(task)
+            running.discard(task)
+            yield task.result()
+
+
+async def _get_file_result(path: str, grammar: grammar_basic.GrammarBase, backend: str,
+                           io_executor: Optional[concurrent.futures.Executor],
+                           parse_executor: Optional[concurrent.futures.Executor]) -> lib_parse_batch.FileResult:
+    try:
+        semantic_data = await aget_file_semantic(path, grammar, backend=backend, io_executor=io_executor, parse_executor=parse_executor)
+    except concurrent.futures.process.BrokenProcessPool:
+        # not an error of the file - the batch can not go on
+        raise
+    except Exception as exc:
+        return lib_parse_batch.FileResult(path, None, '{exc_type}: {exc}'.format(exc_type=type(exc).__name__, exc=exc))
+    return lib_parse_batch.FileResult(path, semantic_data, None)
+
+
+def read_file(path_file: str) -> str:
+    with open(path_file, 'r') as data_file:
+        return data_file.read()
+
+
+def parse_string(string_data: str, grammar: grammar_basic.GrammarBase, backend: str = 'arpeggio') -> Any:
+    """ runs in the parse executor - the parse errors are raised as ParseError
+
+    >>> parse_string('A=x\\n', grammar_basic.GrammarUpdateDbConf(), backend='scanner')
+    Traceback (most recent call last):
+        ...
+    configmagick.lib_parse_async.ParseError: Expected assignment, comment or newline at position (1, 1)
+
+    """
+    try:
+        return lib_parse.get_semantic_data_from_string(string_data, grammar=grammar, backend=backend)
+    except (arp.NoMatch, lib_scanner.ScanError) as exc:
+        raise ParseError(str(exc)) from None
+
+
+def get_parse_process_pool(grammar: grammar_basic.GrammarBase, workers: Optional[int] = None) -> concurrent.futures.ProcessPoolExecutor:
+    """ a process pool for parse_executor - every worker builds the parser for the grammar once, when it starts.
+    workers=None uses os.cpu_count() processes """
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                                  initializer=lib_parse_batch.init_worker, initargs=(grammar, ))
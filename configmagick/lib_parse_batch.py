@@ -0,0 +1,125 @@
+# STDLIB
+import collections
+import concurrent.futures
+import os
+import pathlib
+from typing import Any, Deque, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+
+
+class FileResult(NamedTuple):
+    """ the result for one file of a batch - error is None or the description of the exception """
+    path: str
+    semantic_data: Any
+    error: Optional[str]
+
+
+def get_files_semantic(paths: Iterable[Union[str, pathlib.Path]], grammar: grammar_basic.GrammarBase, workers: Optional[int] = None,
+                       ordered: bool = True, backend: str = 'arpeggio', chunk_bytes: int = 256 * 1024,
+                       max_chunk_files: int = 64) -> Iterator[FileResult]:
+    """ parses many files in a process pool, yields one FileResult per file
+
+    every worker builds the parser for the grammar once, when it starts. Small files are sent to the workers
+    in chunks of up to chunk_bytes (or max_chunk_files files), so the IPC overhead does not eat the gain.
+    With ordered=True the results are yielded in input order, otherwise in completion order.
+    Errors are reported per file, they do not abort the batch.
+    workers=None uses os.cpu_count() processes, workers=0 parses in the current process.
+
+    >>> test_directory = pathlib.Path(__file__).parent.parent / 'tests'
+    >>> paths = [test_directory / 'updatedb.conf', test_directory / 'does_not_exist.conf'] * 3
+    >>> results = list(get_files_semantic(paths, grammar_basic.GrammarUpdateDbConf(), workers=2, max_chunk_files=2))
+    >>> [(pathlib.Path(result.path).name, result.error is None) for result in results]
+    [('updatedb.conf', True), ('does_not_exist.conf', False), ('updatedb.conf', True), ('does_not_exist.conf', False), ('updatedb.conf', True), \
+('does_not_exist.conf', False)]
+    >>> results[0].semantic_data[0]
+    ['PRUNE_BIND_MOUNTS', ['yes'], '\\n']
+    >>> results[1].error
+    "FileNotFoundError: [Errno 2] No such file or directory: '...does_not_exist.conf'"
+
+    >>> results_unordered = get_files_semantic(paths, grammar_basic.GrammarUpdateDbConf(), workers=2, ordered=False, backend='scanner')
+    >>> assert sorted(results_unordered, key=lambda result: result.path) == sorted(results, key=lambda result: result.path)
+    >>> assert list(get_files_semantic(paths, grammar_basic.GrammarUpdateDbConf(), workers=0)) == results
+
+    """
+    chunks = iter_chunks(paths, chunk_bytes=chunk_bytes, max_chunk_files=max_chunk_files)
+
+    if workers == 0:
+        for chunk in chunks:
+            yield from parse_chunk(chunk, grammar, backend)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(grammar,)) as executor:
+        # bound the number of chunks in flight, so we never hold the whole batch in memory
+        max_pending = workers * 4
+        pending = collections.deque()               # type: Deque[concurrent.futures.Future]
+        for chunk in chunks:
+            pending.append(executor.submit(parse_chunk, chunk, grammar, backend))
+            if len(pending) >= max_pending:
+                yield from _get_finished_results(pending, ordered)
+        while pending:
+            yield from _get_finished_results(pending, ordered)
+
+
+def _get_finished_results(pending: 'Deque[concurrent.futures.Future]', ordered: bool) -> Iterator[FileResult]:
+    """ waits for the oldest chunk if ordered, otherwise for any chunk - and yields its results """
+    if ordered:
+        yield from pending.popleft().result()
+    else:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield from future.result()
+
+
+def iter_chunks(paths: Iterable[Union[str, pathlib.Path]], chunk_bytes: int = 256 * 1024, max_chunk_files: int = 64) -> Iterator[List[str]]:
+    """ groups the paths to chunks of up to chunk_bytes file size or max_chunk_files files
+
+    >>> test_directory = pathlib.Path(__file__).parent.parent / 'tests'
+    >>> [len(chunk) for chunk in iter_chunks([test_directory / 'updatedb.conf'] * 3, chunk_bytes=1)]
+    [1, 1, 1]
+    >>> [len(chunk) for chunk in iter_chunks([test_directory / 'updatedb.conf'] * 5, max_chunk_files=3)]
+    [3, 2]
+
+    """
+    chunk = list()          # type: List[str]
+    chunk_size = 0
+    for path in paths:
+        path = str(path)
+        try:
+            chunk_size += os.stat(path).st_size
+        except OSError:
+            pass            # the error is reported by the worker
+        chunk.append(path)
+        if chunk_size >= chunk_bytes or len(chunk) >= max_chunk_files:
+            yield chunk
+            chunk = list()
+            chunk_size = 0
+    if chunk:
+        yield chunk
+
+
+def init_worker(grammar: grammar_basic.GrammarBase) -> None:
+    """ builds the parser once per worker process """
+    lib_parse.get_parser(grammar)
+
+
+def parse_chunk(paths: List[str], grammar: grammar_basic.GrammarBase, backend: str = 'arpeggio') -> List[FileResult]:
+    """
+    >>> parse_chunk(['does_not_exist.conf'], grammar_basic.GrammarUpdateDbConf())
+    [FileResult(path='does_not_exist.conf', semantic_data=None, error="FileNotFoundError: [Errno 2] No such file or directory: 'does_not_exist.conf'")]
+
+    """
+    results = list()
+    for path in paths:
+        try:
+            semantic_data = lib_parse.get_file_semantic(path, grammar, backend=backend)
+        except Exception as exc:
+            # the exceptions are not always picklable (arpeggio.NoMatch holds the parser) - we report the description
+            results.append(FileResult(path, None, '{exc_type}: {exc}'.format(exc_type=type(exc).__name__, exc=exc)))
+        else:
+            results.append(FileResult(path, semantic_data, None))
+    return results
@@ -1,5 +1,115 @@
 # stdlib
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# how the elements are composed
+COMPOSE_TEXT = 0        # plain strings are written as they are
+COMPOSE_LEAF = 1        # element.arpeggio_compose() returns the text
+COMPOSE_SEQUENCE = 2    # lists : prefix + separator.join(children) + suffix
+COMPOSE_PARTS = 3       # element.compose_parts() returns the list of parts (strings or elements)
+
+
+class ComposeEngine(object):
+    """ composes semantic data back to text - iterative, with an explicit stack, into one output buffer
+
+    the compose handler of every type is looked up in a dispatch table, which is filled with the classes
+    of the grammar when the engine is created, and with any other type the first time it is seen.
+    Lists are composed as compose_prefix + compose_separator.join(children) + compose_suffix,
+    (the class attributes, default ''), classes with a compose_parts() method return their parts.
+
+    >>> engine = ComposeEngine()
+    >>> engine.compose(['a', ['b', ComposeTest('xyz')], 'c'])
+    'abcomposed: xyzc'
+
+    >>> # no recursion limit
+    >>> deep_list = ['end']
+    >>> for _ in range(100000):
+    ...     deep_list = [deep_list]
+    >>> engine.compose(deep_list)
+    'end'
+
+    """
+
+    def __init__(self, grammar: Any = None) -> None:
+        self.dispatch_table = dict()     # type: Dict[type, Tuple[Any, ...]]
+        if grammar is not None:
+            grammar_class = grammar if isinstance(grammar, type) else type(grammar)
+            for cls in grammar_class.__mro__:
+                for attribute in vars(cls).values():
+                    if isinstance(attribute, staticmethod):
+                        attribute = attribute.__func__
+                    if isinstance(attribute, type):
+                        self.get_handler(attribute)
+
+    def get_handler(self, element_type: type) -> Tuple[Any, ...]:
+        handler = self.dispatch_table.get(element_type)
+        if handler is None:
+            if hasattr(element_type, 'compose_parts'):
+                handler = (COMPOSE_PARTS, )
+            elif issubclass(element_type, list):
+                handler = (COMPOSE_SEQUENCE, getattr(element_type, 'compose_prefix', ''), getattr(element_type, 'compose_separator', ''),
+                           getattr(element_type, 'compose_suffix', ''))
+            elif hasattr(element_type, 'arpeggio_compose'):
+                handler = (COMPOSE_LEAF, )
+            else:
+                handler = (COMPOSE_TEXT, )
+            self.dispatch_table[element_type] = handler
+        return handler
+
+    def compose_into(self, element: Any, write: Callable[[str], Any]) -> None:
+        """ composes the element and calls write(text) for every piece of text, in order """
+        dispatch_table = self.dispatch_table
+        get_handler = self.get_handler
+        stack = [element]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            element = pop()
+            handler = dispatch_table.get(type(element)) or get_handler(type(element))
+            kind = handler[0]
+            if kind == COMPOSE_TEXT:
+                write(element if isinstance(element, str) else str(element))
+            elif kind == COMPOSE_LEAF:
+                write(element.arpeggio_compose())
+            elif kind == COMPOSE_SEQUENCE:
+                _, prefix, separator, suffix = handler
+                if suffix:
+                    push(suffix)
+                for index in range(len(element) - 1, -1, -1):
+                    push(element[index])
+                    if separator and index:
+                        push(separator)
+                if prefix:
+                    push(prefix)
+            else:
+                stack.extend(reversed(element.compose_parts()))
+
+    def compose(self, element: Any) -> str:
+        parts = list()     # type: List[str]
+        self.compose_into(element, parts.append)
+        return ''.join(parts)
+
+
+_compose_engines = dict()     # type: Dict[Optional[type], ComposeEngine]
+
+
+def get_compose_engine(grammar: Any = None) -> ComposeEngine:
+    """ the compose engine is created once per grammar """
+    grammar_class = None if grammar is None else grammar if isinstance(grammar, type) else type(grammar)
+    engine = _compose_engines.get(grammar_class)
+    if engine is None:
+        engine = ComposeEngine(grammar_class)
+        _compose_engines[grammar_class] = engine
+    return engine
+
+
+def compose(element: Any, grammar: Any = None) -> str:
+    """ composes the semantic data back to text
+
+    >>> compose(['a', ComposeTest('xyz')])
+    'acomposed: xyz'
+
+    """
+    return get_compose_engine(grammar).compose(element)
 
 
 def compose_list_elements(elements: List) -> List:
@@ -10,13 +120,8 @@ def compose_list_elements(elements: List) -> List:
     >>> assert compose_list_elements(test_list) == ['a', 'b', 'c', 'composed: xyz']
 
     """
-    composed_elements = list()
-    for element in elements:
-        if hasattr(element, 'arpeggio_compose'):
-            composed_elements.append(element.arpeggio_compose())
-        else:
-            composed_elements.append(element)
-    return composed_elements
+    engine = get_compose_engine()
+    return [engine.compose(element) for element in elements]
 
 
 class ComposeTest(str):
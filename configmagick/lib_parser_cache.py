@@ -0,0 +1,243 @@
+# STDLIB
+import collections
+import hashlib
+import inspect
+import pathlib
+import sys
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+# EXT
+import arpeggio as arp
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_grammar_optimizer   # type: ignore # pragma: no cover
+
+
+class ParserCache(object):
+    """ process wide registry of compiled arpeggio parsers
+
+    building a arpeggio.ParserPython walks the whole rule graph of a grammar and compiles all regexes,
+    which is more expensive than parsing a small config file. The parsers are therefore kept in bounded
+    LRU registries, keyed by grammar class, whitespace and the parser options.
+
+    an arpeggio parser keeps the state of the running parse on itself, so one instance must never be used
+    by two threads at the same time - every thread has its own LRU of at most max_size parsers, so threads never
+    evict each other's parsers. The parsers of a thread are dropped when the thread ends.
+    With many threads that are many parsers - hosts with large thread pools should share a bounded
+    lib_parser_pool.ParserPool instead.
+    opt in with an artifact_directory : the built parsers are also saved there, and later processes load them instead
+    of building them again (see lib_grammar_artifact) - stale artifacts are rebuilt automatically.
+
+    >>> parser_cache = ParserCache(max_size=2)
+    >>> parser = parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf())
+    >>> assert parser is parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf)
+    >>> assert parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf, debug=False) is not parser
+    >>> parser_cache.statistics()
+    {'hits': 1, 'misses': 2, 'evictions': 0, 'artifact_loads': 0, 'artifact_saves': 0, 'size': 2, 'max_size': 2, 'threads': 1}
+
+    >>> # bounded size - the least recently used parser is evicted
+    >>> parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf, optimize=True) is not parser
+    True
+    >>> parser_cache.statistics()['evictions']
+    1
+    >>> assert parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf) is not parser
+
+    >>> # an other thread gets its own parser, in its own LRU - and its parsers are dropped when it ends
+    >>> other_parsers = list()
+    >>> thread = threading.Thread(target=lambda: other_parsers.append(parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf)))
+    >>> thread.start()
+    >>> thread.join()
+    >>> assert other_parsers[0] is not parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf)
+    >>> parser_cache.statistics()['evictions'], parser_cache.statistics()['threads']
+    (2, 1)
+
+    >>> # explicit invalidation
+    >>> parser_cache.invalidate(grammar_basic.GrammarUpdateDbConf)
+    2
+    >>> parser_cache.invalidate()
+    0
+    >>> parser_cache.reset_statistics()
+    >>> parser_cache.statistics()
+    {'hits': 0, 'misses': 0, 'evictions': 0, 'artifact_loads': 0, 'artifact_saves': 0, 'size': 0, 'max_size': 2, 'threads': 1}
+
+    >>> # persisted artifacts survive a new cache instance (process restart)
+    >>> import shutil, tempfile
+    >>> artifact_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> _ = ParserCache(artifact_directory=artifact_directory).get_parser(grammar_basic.GrammarUpdateDbConf, optimize=True)
+    >>> parser_cache = ParserCache(artifact_directory=artifact_directory)
+    >>> parser = parser_cache.get_parser(grammar_basic.GrammarUpdateDbConf, optimize=True)
+    >>> parser.parse('A="x y"\\n').tree_str()         # doctest: +ELLIPSIS
+    'grammar=Sequence [0-8]...'
+    >>> parser_cache.statistics()['artifact_loads']
+    1
+    >>> shutil.rmtree(str(artifact_directory))
+
+    """
+
+    def __init__(self, max_size: int = 32, artifact_directory: Union[None, str, pathlib.Path] = None) -> None:
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.max_size = max_size
+        self.artifact_directory = None if artifact_directory is None else pathlib.Path(artifact_directory)    # type: Optional[pathlib.Path]
+        # the LRU of the current thread is in _thread_local.parsers - it lives as long as the thread
+        self._thread_local = threading.local()
+        # all living LRUs, for invalidate() and statistics() - weak references, they do not keep the parsers of ended threads
+        self._thread_parsers = weakref.WeakValueDictionary()    # type: weakref.WeakValueDictionary
+        self._thread_parsers_count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.artifact_loads = 0
+        self.artifact_saves = 0
+
+    def get_parser(self, grammar: Union[grammar_basic.GrammarBase, Type[grammar_basic.GrammarBase]], ws: Optional[str] = None,
+                   optimize: bool = False, **parser_options: Any) -> arp.ParserPython:
+        """ returns the cached parser for the grammar, builds and registers it on a miss
+
+        ws defaults to grammar.whitespace, parser_options are passed to arpeggio.ParserPython
+        optimize : fuse the terminal only rules, see lib_grammar_optimizer.optimize_parser
+        """
+        grammar_class = get_grammar_class(grammar)
+        if ws is None:
+            ws = grammar_class.whitespace
+        key = get_parser_key(grammar_class, ws, dict(parser_options, optimize=True) if optimize else parser_options)
+        parsers = self._get_thread_parsers()
+
+        with self._lock:
+            parser = parsers.get(key)
+            if parser is not None:
+                parsers.move_to_end(key)
+                self.hits += 1
+                return parser
+            self.misses += 1
+
+        # build outside the lock, it is the expensive part
+        parser = self._load_or_build_parser(grammar_class, ws, optimize, parser_options)
+
+        with self._lock:
+            parsers[key] = parser
+            while len(parsers) > self.max_size:
+                parsers.popitem(last=False)
+                self.evictions += 1
+        return parser
+
+    def _load_or_build_parser(self, grammar_class: Type[grammar_basic.GrammarBase], ws: str, optimize: bool,
+                              parser_options: Dict[str, Any]) -> arp.ParserPython:
+        artifact_directory = self.artifact_directory
+        if artifact_directory is not None:
+            # imported on first use - the artifacts are opt in, pickle and friends are not loaded otherwise
+            import pickle
+            from . import lib_grammar_artifact
+            artifact_key = lib_grammar_artifact.get_artifact_key(grammar_class, get_grammar_fingerprint(grammar_class), ws, optimize, parser_options)
+            path_artifact = lib_grammar_artifact.get_artifact_path(artifact_directory, artifact_key)
+            parser = lib_grammar_artifact.load_parser(path_artifact, artifact_key)
+            if parser is not None:
+                with self._lock:
+                    self.artifact_loads += 1
+                return parser
+
+        parser = build_parser(grammar_class, ws, optimize=optimize, **parser_options)
+
+        if artifact_directory is not None:
+            try:
+                lib_grammar_artifact.save_parser(parser, path_artifact, artifact_key)
+            except (OSError, pickle.PicklingError, AttributeError, TypeError):
+                # the artifact is only a shortcut - a read only cache directory or an unpicklable grammar just skip it
+                return parser
+            with self._lock:
+                self.artifact_saves += 1
+        return parser
+
+    def _get_thread_parsers(self) -> 'ThreadParsers':
+        parsers = getattr(self._thread_local, 'parsers', None)
+        if parsers is None:
+            parsers = self._thread_local.parsers = ThreadParsers()
+            with self._lock:
+                self._thread_parsers_count += 1
+                self._thread_parsers[self._thread_parsers_count] = parsers
+        return parsers
+
+    def invalidate(self, grammar: Union[None, grammar_basic.GrammarBase, Type[grammar_basic.GrammarBase]] = None) -> int:
+        """ drops the cached parsers of the grammar, or all cached parsers if no grammar is given.
+        returns the number of dropped parsers
+        """
+        grammar_class = None if grammar is None else get_grammar_class(grammar)
+        dropped = 0
+        with self._lock:
+            for parsers in list(self._thread_parsers.values()):
+                keys = [key for key in parsers if grammar_class is None or key[0] is grammar_class]
+                for key in keys:
+                    del parsers[key]
+                dropped += len(keys)
+        return dropped
+
+    def statistics(self) -> Dict[str, int]:
+        with self._lock:
+            thread_parsers = list(self._thread_parsers.values())
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'artifact_loads': self.artifact_loads, 'artifact_saves': self.artifact_saves,
+                    'size': sum(len(parsers) for parsers in thread_parsers), 'max_size': self.max_size, 'threads': len(thread_parsers)}
+
+    def reset_statistics(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.artifact_loads = 0
+            self.artifact_saves = 0
+
+
+class ThreadParsers(collections.OrderedDict):
+    """ the parsers of one thread, in LRU order - a subclass, because an OrderedDict can not be weakly referenced """
+
+
+def build_parser(grammar_class: Type[grammar_basic.GrammarBase], ws: str, optimize: bool = False, **parser_options: Any) -> arp.ParserPython:
+    """ a new parser - optimize : fuse the terminal only rules, see lib_grammar_optimizer.optimize_parser """
+    parser = arp.ParserPython(grammar_class.grammar, ws=ws, **parser_options)
+    if optimize:
+        lib_grammar_optimizer.optimize_parser(parser)
+    return parser
+
+
+def get_grammar_class(grammar: Union[grammar_basic.GrammarBase, Type[grammar_basic.GrammarBase]]) -> Type[grammar_basic.GrammarBase]:
+    """ grammars are passed around as classes or instances - we need the class
+
+    >>> assert get_grammar_class(grammar_basic.GrammarUpdateDbConf()) is grammar_basic.GrammarUpdateDbConf
+    >>> assert get_grammar_class(grammar_basic.GrammarUpdateDbConf) is grammar_basic.GrammarUpdateDbConf
+
+    """
+    if isinstance(grammar, type):
+        return grammar
+    return type(grammar)
+
+
+def get_parser_key(grammar_class: Type[grammar_basic.GrammarBase], ws: str, parser_options: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    >>> get_parser_key(grammar_basic.GrammarUpdateDbConf, '\\t ', {'debug': False, 'autokwd': True})
+    (<class 'configmagick.grammar_basic.GrammarUpdateDbConf'>, '\\t ', (('autokwd', True), ('debug', False)))
+
+    """
+    return grammar_class, ws, tuple(sorted(parser_options.items()))
+
+
+_grammar_fingerprints = dict()     # type: Dict[Type[grammar_basic.GrammarBase], str]
+
+
+def get_grammar_fingerprint(grammar_class: Type[grammar_basic.GrammarBase]) -> str:
+    """ sha256 of the source of the module the grammar is defined in - changes whenever the grammar might change
+
+    >>> fingerprint = get_grammar_fingerprint(grammar_basic.GrammarUpdateDbConf)
+    >>> assert len(fingerprint) == 64
+    >>> assert fingerprint == get_grammar_fingerprint(grammar_basic.GrammarBasic)
+
+    """
+    fingerprint = _grammar_fingerprints.get(grammar_class)
+    if fingerprint is None:
+        source = inspect.getsource(sys.modules[grammar_class.__module__])
+        fingerprint = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        _grammar_fingerprints[grammar_class] = fingerprint
+    return fingerprint
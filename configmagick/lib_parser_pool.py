@@ -0,0 +1,170 @@
+# STDLIB
+import contextlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type, Union
+
+# EXT
+import arpeggio as arp
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+from . import lib_parser_cache        # type: ignore # pragma: no cover
+
+
+class ParserPool(object):
+    """ a bounded pool of parsers for one grammar, with checkout / checkin
+
+    an arpeggio parser keeps the state of the running parse on itself, so a parser is checked out by one thread
+    for the whole parse and visit. lib_parse.default_parser_cache gives every thread its own parser - with many
+    threads (web workers) that is many parsers. The pool builds at most max_size parsers (default : the number of CPUs),
+    on first demand. If all of them are checked out, checkout() waits for a checkin.
+
+    affinity=True : a thread gets the parser it used last, if that one is free - instead of the most recently returned one.
+    statistics() : checkouts, contended checkouts (the ones which had to wait), the total and maximum wait time
+
+    >>> pool = ParserPool(grammar_basic.GrammarUpdateDbConf, max_size=2)
+    >>> pool.get_semantic_data_from_string('A="x y"\\n')
+    [['A', ['x', 'y'], '\\n']]
+    >>> with pool.parser() as parser:
+    ...     assert pool.checkout(timeout=0) is not parser
+    ...     pool.checkout(timeout=0.01)
+    Traceback (most recent call last):
+        ...
+    TimeoutError: no parser was returned to the pool within 0.01 seconds
+    >>> pool.checkin(arp.ParserPython(grammar_basic.GrammarUpdateDbConf.grammar))
+    Traceback (most recent call last):
+        ...
+    ValueError: the parser is not checked out from this pool
+
+    >>> # stress test : many threads, few parsers - the results must not depend on the interleaving
+    >>> import random, sys
+    >>> test_data = ['K{index}="{values}"\\n# c {index}\\n\\n'.format(index=index, values=' '.join('v{}'.format(value) for value in range(index % 7)))
+    ...              * (index % 5 + 1) for index in range(64)]
+    >>> expected = [lib_parse.get_semantic_data_from_string(string_data, grammar_basic.GrammarUpdateDbConf()) for string_data in test_data]
+    >>> for affinity in (False, True):
+    ...     pool = ParserPool(grammar_basic.GrammarUpdateDbConf, max_size=4, affinity=affinity)
+    ...     results = dict()
+    ...     def parse_all(thread_index):
+    ...         for index in random.Random(thread_index).sample(range(len(test_data)), len(test_data)):
+    ...             results[(thread_index, index)] = pool.get_semantic_data_from_string(test_data[index])
+    ...     switch_interval = sys.getswitchinterval()
+    ...     sys.setswitchinterval(1E-5)
+    ...     try:
+    ...         threads = [threading.Thread(target=parse_all, args=(thread_index, )) for thread_index in range(16)]
+    ...         for thread in threads: thread.start()
+    ...         for thread in threads: thread.join()
+    ...     finally:
+    ...         sys.setswitchinterval(switch_interval)
+    ...     statistics = pool.statistics()
+    ...     all(not lib_parse.get_semantic_data_difference(result, expected[index]) for (_, index), result in results.items()), len(results)
+    ...     statistics['checkouts'], statistics['created'] <= 4, statistics['checked_out']
+    (True, 1024)
+    (1024, True, 0)
+    (True, 1024)
+    (1024, True, 0)
+
+    """
+
+    def __init__(self, grammar: Union[grammar_basic.GrammarBase, Type[grammar_basic.GrammarBase]], max_size: Optional[int] = None,
+                 affinity: bool = False, ws: Optional[str] = None, optimize: Optional[bool] = None, **parser_options: Any) -> None:
+        self.grammar_class = lib_parser_cache.get_grammar_class(grammar)
+        self.grammar = self.grammar_class()
+        self.max_size = max_size or os.cpu_count() or 1
+        self.affinity = affinity
+        self.ws = self.grammar_class.whitespace if ws is None else ws
+        self.optimize = lib_parse.optimize_grammars if optimize is None else optimize
+        self.parser_options = parser_options
+        self._idle = list()                 # type: List[arp.ParserPython]
+        # id(parser) -> parser, for the checked out parsers
+        self._checked_out = dict()          # type: Dict[int, arp.ParserPython]
+        self._created = 0
+        self._condition = threading.Condition(threading.Lock())
+        # the parser the thread used last, for affinity=True
+        self._thread_local = threading.local()
+        self.checkouts = 0
+        self.contended_checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def checkout(self, timeout: Optional[float] = None) -> arp.ParserPython:
+        """ a parser for the exclusive use of the calling thread, until checkin(parser) - raises TimeoutError after timeout seconds """
+        with self._condition:
+            parser = self._take_idle_parser()
+            if parser is None and self._created >= self.max_size:
+                start_time = time.perf_counter()
+                self._condition.wait_for(lambda: self._idle or self._created < self.max_size, timeout=timeout)
+                wait_seconds = time.perf_counter() - start_time
+                self.contended_checkouts += 1
+                self.wait_seconds += wait_seconds
+                self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+                parser = self._take_idle_parser()
+                if parser is None and self._created >= self.max_size:
+                    raise TimeoutError('no parser was returned to the pool within {timeout} seconds'.format(timeout=timeout))
+            if parser is None:
+                # the slot is reserved, the parser is built outside the lock
+                self._created += 1
+            else:
+                self._check_out(parser)
+                return parser
+
+        try:
+            parser = lib_parser_cache.build_parser(self.grammar_class, self.ws, optimize=self.optimize, **self.parser_options)
+        except BaseException:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._check_out(parser)
+        return parser
+
+    def checkin(self, parser: arp.ParserPython) -> None:
+        with self._condition:
+            if self._checked_out.pop(id(parser), None) is None:
+                raise ValueError('the parser is not checked out from this pool')
+            self._idle.append(parser)
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def parser(self, timeout: Optional[float] = None) -> Iterator[arp.ParserPython]:
+        """ checks a parser out for the with block """
+        parser = self.checkout(timeout=timeout)
+        try:
+            yield parser
+        finally:
+            self.checkin(parser)
+
+    def get_semantic_data_from_string(self, string_data: str, record_hook: Optional[Callable[[Any], None]] = None,
+                                      timeout: Optional[float] = None) -> Any:
+        """ like lib_parse.get_semantic_data_from_string with the arpeggio backend - the parser is checked out for the parse and the visit """
+        with self.parser(timeout=timeout) as parser:
+            parse_tree = parser.parse(string_data)
+            return lib_parse.get_semantic_data_from_parse_tree(parse_tree, self.grammar, record_hook=record_hook)
+
+    def statistics(self) -> Dict[str, Any]:
+        with self._condition:
+            return {'created': self._created, 'idle': len(self._idle), 'checked_out': len(self._checked_out), 'max_size': self.max_size,
+                    'checkouts': self.checkouts, 'contended_checkouts': self.contended_checkouts,
+                    'wait_seconds': self.wait_seconds, 'max_wait_seconds': self.max_wait_seconds}
+
+    def _take_idle_parser(self) -> Optional[arp.ParserPython]:
+        """ must be called with the lock held """
+        if not self._idle:
+            return None
+        if self.affinity:
+            parser = getattr(self._thread_local, 'parser', None)
+            if parser is not None and any(idle_parser is parser for idle_parser in self._idle):
+                self._idle.remove(parser)
+                return parser
+        # the most recently returned parser - its memory is most likely still in the CPU caches
+        return self._idle.pop()
+
+    def _check_out(self, parser: arp.ParserPython) -> None:
+        """ must be called with the lock held """
+        self._checked_out[id(parser)] = parser
+        self.checkouts += 1
+        if self.affinity:
+            self._thread_local.parser = parser
@@ -0,0 +1,158 @@
+# STDLIB
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# EXT
+import arpeggio
+
+# PROJ
+from . import lib_parse               # type: ignore # pragma: no cover
+
+
+class PhaseStatistics(object):
+    """ the accumulated measurements of one phase """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0
+        self.min_seconds = float('inf')
+        self.max_seconds = 0.0
+        self.bytes_processed = 0
+        self.nodes = 0
+
+    def add(self, phase_event: lib_parse.PhaseEvent) -> None:
+        self.calls += 1
+        self.seconds += phase_event.seconds
+        self.min_seconds = min(self.min_seconds, phase_event.seconds)
+        self.max_seconds = max(self.max_seconds, phase_event.seconds)
+        self.bytes_processed += phase_event.bytes_processed
+        self.nodes += phase_event.nodes
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'calls': self.calls, 'seconds': self.seconds, 'min_seconds': self.min_seconds if self.calls else 0.0,
+                'max_seconds': self.max_seconds, 'bytes_processed': self.bytes_processed, 'nodes': self.nodes}
+
+
+class ProfileCollector(object):
+    """ collects the phase events of lib_parse, and the match / backtrack counters of every grammar rule
+
+    the rule counters wrap the _parse method of every parsing expression of the parsers seen while collecting,
+    stop() restores the _parse methods as they were before. Memoized results are not counted, they do not call _parse.
+
+    limitations : the parsers are shared through the parser cache, so use one collector at a time - collectors which
+    are stopped in another order than they were started restore each others wrappers. The counters are not locked,
+    profile in a single thread.
+
+    >>> from configmagick import grammar_basic
+    >>> with ProfileCollector() as collector:
+    ...     _ = lib_parse.get_semantic_data_from_string('A="x y"\\n# c\\n\\n', grammar_basic.GrammarUpdateDbConf())
+    >>> summary = collector.get_summary()
+    >>> sorted(summary['phases']), summary['phases']['parse']['bytes_processed']
+    (['get_parser', 'parse', 'visit'], 13)
+    >>> summary['rules']['unicode_string']
+    {'matches': 3, 'backtracks': 4}
+    >>> print(collector.get_table())        # doctest: +ELLIPSIS
+    phase ...
+    parse ...
+    >>> # the parser is restored
+    >>> assert '_parse' not in vars(lib_parse.get_parser(grammar_basic.GrammarUpdateDbConf()).parser_model)
+
+    >>> # nested collectors - the inner one restores the wrappers of the outer one
+    >>> with ProfileCollector() as outer_collector:
+    ...     _ = lib_parse.get_semantic_data_from_string('A="x"\\n', grammar_basic.GrammarUpdateDbConf())
+    ...     with ProfileCollector() as inner_collector:
+    ...         _ = lib_parse.get_semantic_data_from_string('A="x"\\n', grammar_basic.GrammarUpdateDbConf())
+    ...     _ = lib_parse.get_semantic_data_from_string('A="x"\\n', grammar_basic.GrammarUpdateDbConf())
+    >>> outer_collector.get_summary()['rules']['unicode_string'], inner_collector.get_summary()['rules']['unicode_string']
+    ({'matches': 6, 'backtracks': 6}, {'matches': 2, 'backtracks': 2})
+    >>> assert '_parse' not in vars(lib_parse.get_parser(grammar_basic.GrammarUpdateDbConf()).parser_model)
+
+    """
+
+    def __init__(self, rule_counters: bool = True) -> None:
+        self.rule_counters = rule_counters
+        self.phases = dict()                # type: Dict[str, PhaseStatistics]
+        # rule name -> [matches, backtracks]
+        self.rules = dict()                 # type: Dict[str, List[int]]
+        # id(parser) -> [(expression, the _parse instance attribute before the instrumentation, or None), ...]
+        self._instrumented_parsers = dict()     # type: Dict[int, List[Tuple[arpeggio.ParsingExpression, Optional[Callable[..., Any]]]]]
+
+    def __call__(self, phase_event: lib_parse.PhaseEvent) -> None:
+        self.phases.setdefault(phase_event.phase, PhaseStatistics()).add(phase_event)
+        if phase_event.phase == 'get_parser' and self.rule_counters and id(phase_event.details) not in self._instrumented_parsers:
+            self.instrument_parser(phase_event.details)
+
+    def start(self) -> 'ProfileCollector':
+        lib_parse.add_instrumentation_hook(self)
+        return self
+
+    def stop(self) -> None:
+        if self in lib_parse.instrumentation_hooks:
+            lib_parse.remove_instrumentation_hook(self)
+        for expressions in self._instrumented_parsers.values():
+            for expression, previous_parse in expressions:
+                if previous_parse is not None:
+                    expression._parse = previous_parse
+                elif '_parse' in vars(expression):
+                    del expression._parse
+        self._instrumented_parsers.clear()
+
+    def __enter__(self) -> 'ProfileCollector':
+        return self.start()
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.stop()
+
+    def instrument_parser(self, parser: arpeggio.Parser) -> None:
+        """ wraps the _parse method of all parsing expressions of the parser with a counter """
+        expressions = list()
+        visited = set()
+        stack = [parser.parser_model]
+        while stack:
+            expression = stack.pop()
+            if id(expression) in visited:
+                continue
+            visited.add(id(expression))
+            stack.extend(expression.nodes)
+            counters = self.rules.setdefault(expression.rule_name or expression.name, [0, 0])
+            expressions.append((expression, vars(expression).get('_parse')))
+            expression._parse = get_counting_parse(expression._parse, counters)
+        self._instrumented_parsers[id(parser)] = expressions
+
+    def get_summary(self) -> Dict[str, Any]:
+        """ the measurements as JSON serializable dict """
+        return {'phases': {phase: statistics.as_dict() for phase, statistics in self.phases.items()},
+                'rules': {rule_name: {'matches': counters[0], 'backtracks': counters[1]}
+                          for rule_name, counters in sorted(self.rules.items()) if counters != [0, 0]}}
+
+    def get_json(self) -> str:
+        return json.dumps(self.get_summary(), indent=4)
+
+    def get_table(self) -> str:
+        lines = ['{phase:<12}{calls:>8}{seconds:>12}{min_seconds:>12}{max_seconds:>12}{size:>14}{nodes:>12}'.format(
+            phase='phase', calls='calls', seconds='seconds', min_seconds='min', max_seconds='max', size='bytes', nodes='nodes')]
+        for phase, statistics in self.phases.items():
+            lines.append('{phase:<12}{calls:>8}{seconds:>12.6f}{min_seconds:>12.6f}{max_seconds:>12.6f}{size:>14}{nodes:>12}'.format(
+                phase=phase, calls=statistics.calls, seconds=statistics.seconds, min_seconds=statistics.min_seconds,
+                max_seconds=statistics.max_seconds, size=statistics.bytes_processed, nodes=statistics.nodes))
+        rules = self.get_summary()['rules']
+        if rules:
+            lines.append('')
+            lines.append('{rule:<50}{matches:>12}{backtracks:>12}'.format(rule='rule', matches='matches', backtracks='backtracks'))
+            for rule_name, counters in rules.items():
+                lines.append('{rule:<50}{matches:>12}{backtracks:>12}'.format(
+                    rule=rule_name[:49], matches=counters['matches'], backtracks=counters['backtracks']))
+        return '\n'.join(lines)
+
+
+def get_counting_parse(parse: Callable[[arpeggio.Parser], Any], counters: List[int]) -> Callable[[arpeggio.Parser], Any]:
+    """ counters[0] : successful matches, counters[1] : NoMatch (backtracks) """
+    def counting_parse(parser: arpeggio.Parser) -> Any:
+        try:
+            result = parse(parser)
+        except arpeggio.NoMatch:
+            counters[1] += 1
+            raise
+        counters[0] += 1
+        return result
+    return counting_parse
@@ -0,0 +1,246 @@
+# STDLIB
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+
+# the kinds of the matched spans
+KIND_ASSIGNMENT = 1
+KIND_COMMENT_BLOCK = 2
+KIND_NEWLINE = 3
+KIND_KEY = 4
+KIND_KEY_SINGLE_QUOTED = 5
+KIND_KEY_DOUBLE_QUOTED = 6
+KIND_VALUE = 7
+KIND_COMMENT = 8
+
+key_classes = {KIND_KEY: grammar_basic.GrammarBasic.UnicodeString,
+               KIND_KEY_SINGLE_QUOTED: grammar_basic.GrammarBasic.SingleQuotedString,
+               KIND_KEY_DOUBLE_QUOTED: grammar_basic.GrammarBasic.DoubleQuotedString}
+
+
+class ScanError(ValueError):
+    """ the scanner could not match the input - the equivalent of arpeggio.NoMatch
+
+    offset and line_offset : string_data is a part of a file, which starts at the beginning of a line
+    """
+
+    def __init__(self, string_data: str, position: int, expected: str, offset: int = 0, line_offset: int = 0) -> None:
+        self.position = offset + position
+        self.line = line_offset + string_data.count('\n', 0, position) + 1
+        self.column = position - (string_data.rfind('\n', 0, position) + 1) + 1
+        self.expected = expected
+        super(ScanError, self).__init__('Expected {expected} at position ({line}, {column})'.format(
+            expected=expected, line=self.line, column=self.column))
+
+
+def _get_regex(rule: Callable[[], object]) -> 're.Pattern[str]':
+    """ the scanner uses the very same regular expressions and flags as the arpeggio rules """
+    regex_match = rule()
+    return re.compile(regex_match.to_match_regex, regex_match.explicit_flags)     # type: ignore
+
+
+class ScannerUpdateDbConf(object):
+    """ single pass scanner for GrammarUpdateDbConf, without parse tree
+
+    returns the same semantic data as arpeggio with GrammarUpdateDbConf.Visitor, but matches the
+    lines directly with the regular expressions of the grammar rules.
+
+    >>> scanner = ScannerUpdateDbConf()
+    >>> semantic_data = scanner.scan('A = "x y" # c\\n# c1\\n# c2\\n\\n"B"=""\\n')
+    >>> semantic_data
+    [['A', ['x', 'y'], '# c', '\\n'], ['# c1', '\\n', '# c2', '\\n'], '\\n', ['B', [], '\\n']]
+    >>> [(type(record).__name__, record.start, record.end) for record in semantic_data]
+    [('AssignMultipleValuesQuoted', 0, 14), ('CommentShellBlock', 14, 24), ('Newline', 24, 25), ('AssignMultipleValuesQuoted', 25, 32)]
+
+    >>> scanner.scan('A = "x y"')
+    Traceback (most recent call last):
+        ...
+    configmagick.lib_scanner.ScanError: Expected assignment, comment or newline at position (1, 1)
+
+    """
+
+    def __init__(self, grammar: Type[grammar_basic.GrammarUpdateDbConf] = grammar_basic.GrammarUpdateDbConf) -> None:
+        self.grammar = grammar
+        self.whitespace = grammar.whitespace
+        self.regex_single_quoted_string = _get_regex(grammar_basic.GrammarBasic.single_quoted_string)
+        self.regex_double_quoted_string = _get_regex(grammar_basic.GrammarBasic.double_quoted_string)
+        self.regex_allowed_chars = _get_regex(grammar_basic.GrammarBasic.allowed_chars)
+        self.regex_comment_shell = _get_regex(grammar_basic.GrammarBasic.comment_shell)
+
+    def scan(self, string_data: str, record_hook: Optional[Callable[[Any], None]] = None) -> grammar_basic.ComposeList:
+        """ record_hook(record) is called for every record as soon as it is created """
+        records = grammar_basic.ComposeList()
+        for match in self.iter_matches(string_data):
+            if match[0] == KIND_ASSIGNMENT:
+                record = self.make_assignment(string_data, match)     # type: Any
+            elif match[0] == KIND_COMMENT_BLOCK:
+                record = self.make_comment_block(string_data, match)
+            else:
+                record = make_newline(match[1])
+            records.append(record)
+            if record_hook is not None:
+                record_hook(record)
+        return records
+
+    def iter_matches(self, string_data: str) -> Iterator[Tuple[Any, ...]]:
+        """ yields the positions of the top level records, without creating any strings:
+            (KIND_ASSIGNMENT, start, end, key_kind, key_start, key_end, [value_start, value_end, ...], comment_start, comment_end, newline)
+            (KIND_COMMENT_BLOCK, start, end, [comment_start, comment_end, newline, ...])
+            (KIND_NEWLINE, position, position + 1)
+        comment_start and comment_end are -1 if the assignment has no comment
+        """
+        length = len(string_data)
+        position = 0
+        while True:
+            match = self.match_assignment(string_data, position)
+            if match is None:
+                match = self.match_comment_block(string_data, position)
+            if match is None:
+                match = self.match_newline(string_data, position)
+            if match is None:
+                break
+            yield match
+            position = match[2]
+        position = self.skip_whitespace(string_data, position)
+        if position != length:
+            raise ScanError(string_data, position, 'assignment, comment or newline')
+
+    def skip_whitespace(self, string_data: str, position: int) -> int:
+        length = len(string_data)
+        whitespace = self.whitespace
+        while position < length and string_data[position] in whitespace:
+            position += 1
+        return position
+
+    def match_key(self, string_data: str, position: int) -> Optional[Tuple[int, int, int]]:
+        """ returns (key_kind, key_start, key_end) - the span of quoted keys is without the quotes """
+        match = self.regex_single_quoted_string.match(string_data, position)
+        if match:
+            return KIND_KEY_SINGLE_QUOTED, position + 1, match.end() - 1
+        match = self.regex_double_quoted_string.match(string_data, position)
+        if match:
+            return KIND_KEY_DOUBLE_QUOTED, position + 1, match.end() - 1
+        match = self.regex_allowed_chars.match(string_data, position)
+        if match:
+            return KIND_KEY, position, match.end()
+        return None
+
+    def match_assignment(self, string_data: str, position: int) -> Optional[Tuple[Any, ...]]:
+        """ KEY = "value1 value2" <# comment> newline """
+        skip_whitespace = self.skip_whitespace
+        start = position = skip_whitespace(string_data, position)
+        key_match = self.match_key(string_data, position)
+        if key_match is None:
+            return None
+        key_kind, key_start, key_end = key_match
+        position = skip_whitespace(string_data, key_end + (key_kind != KIND_KEY))
+        if not string_data.startswith('=', position):
+            return None
+        position = skip_whitespace(string_data, position + 1)
+        if not string_data.startswith('"', position):
+            return None
+        position += 1
+
+        value_spans = list()    # type: List[int]
+        regex_allowed_chars = self.regex_allowed_chars
+        while True:
+            match = regex_allowed_chars.match(string_data, skip_whitespace(string_data, position))
+            if not match:
+                break
+            position = match.end()
+            value_spans.append(match.start())
+            value_spans.append(position)
+
+        position = skip_whitespace(string_data, position)
+        if not string_data.startswith('"', position):
+            return None
+        position = skip_whitespace(string_data, position + 1)
+
+        comment_start = comment_end = -1
+        match = self.regex_comment_shell.match(string_data, position)
+        if match:
+            comment_start, comment_end = position, match.end()
+            position = skip_whitespace(string_data, comment_end)
+        if not string_data.startswith('\n', position):
+            return None
+        return KIND_ASSIGNMENT, start, position + 1, key_kind, key_start, key_end, value_spans, comment_start, comment_end, position
+
+    def match_comment_block(self, string_data: str, position: int) -> Optional[Tuple[Any, ...]]:
+        """ one or more lines of # comment newline """
+        skip_whitespace = self.skip_whitespace
+        regex_comment_shell = self.regex_comment_shell
+        comment_spans = list()  # type: List[int]
+        while True:
+            comment_position = skip_whitespace(string_data, position)
+            match = regex_comment_shell.match(string_data, comment_position)
+            if not match:
+                break
+            newline_position = skip_whitespace(string_data, match.end())
+            if not string_data.startswith('\n', newline_position):
+                break
+            comment_spans.append(comment_position)
+            comment_spans.append(match.end())
+            comment_spans.append(newline_position)
+            position = newline_position + 1
+        if not comment_spans:
+            return None
+        return KIND_COMMENT_BLOCK, comment_spans[0], position, comment_spans
+
+    def match_newline(self, string_data: str, position: int) -> Optional[Tuple[Any, ...]]:
+        position = self.skip_whitespace(string_data, position)
+        if not string_data.startswith('\n', position):
+            return None
+        return KIND_NEWLINE, position, position + 1
+
+    @staticmethod
+    def make_assignment(string_data: str, match: Tuple[Any, ...]) -> list:
+        _, start, end, key_kind, key_start, key_end, value_spans, comment_start, comment_end, newline_position = match
+        values = grammar_basic.GrammarUpdateDbConf.MultipleValuesBlankSeparated()
+        unicode_string = grammar_basic.GrammarBasic.UnicodeString
+        for index in range(0, len(value_spans), 2):
+            values.append(unicode_string(string_data[value_spans[index]:value_spans[index + 1]]))
+        record = grammar_basic.GrammarUpdateDbConf.AssignMultipleValuesQuoted([key_classes[key_kind](string_data[key_start:key_end]), values])
+        if comment_start >= 0:
+            record.append(grammar_basic.GrammarBasic.CommentShell(string_data[comment_start:comment_end]))
+        record.append(make_newline(newline_position))
+        return grammar_basic.set_position(record, start, end)
+
+    @staticmethod
+    def make_comment_block(string_data: str, match: Tuple[Any, ...]) -> list:
+        _, start, end, comment_spans = match
+        record = grammar_basic.GrammarBasic.CommentShellBlock()
+        comment_shell = grammar_basic.GrammarBasic.CommentShell
+        for index in range(0, len(comment_spans), 3):
+            record.append(comment_shell(string_data[comment_spans[index]:comment_spans[index + 1]]))
+            record.append(make_newline(comment_spans[index + 2]))
+        return grammar_basic.set_position(record, start, end)
+
+
+def make_newline(position: int) -> grammar_basic.ComposeString:
+    return grammar_basic.set_position(grammar_basic.GrammarBasic.Newline('\n'), position, position + 1)
+
+
+# the grammars which have a scanner backend
+scanner_classes = {grammar_basic.GrammarUpdateDbConf: ScannerUpdateDbConf}    # type: Dict[type, Callable[..., ScannerUpdateDbConf]]
+_scanners = dict()                                                            # type: Dict[type, ScannerUpdateDbConf]
+
+
+def get_scanner(grammar_class: type) -> ScannerUpdateDbConf:
+    """ returns the (stateless, therefore shared) scanner for the grammar class
+
+    >>> assert get_scanner(grammar_basic.GrammarUpdateDbConf) is get_scanner(grammar_basic.GrammarUpdateDbConf)
+    >>> get_scanner(grammar_basic.GrammarBasic)
+    Traceback (most recent call last):
+        ...
+    ValueError: there is no scanner backend for grammar "GrammarBasic"
+
+    """
+    scanner = _scanners.get(grammar_class)
+    if scanner is None:
+        if grammar_class not in scanner_classes:
+            raise ValueError('there is no scanner backend for grammar "{grammar}"'.format(grammar=grammar_class.__name__))
+        scanner = scanner_classes[grammar_class](grammar_class)
+        _scanners[grammar_class] = scanner
+    return scanner
@@ -0,0 +1,240 @@
+# STDLIB
+import collections
+import hashlib
+import io
+import os
+import pathlib
+import pickle
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parser_cache        # type: ignore # pragma: no cover
+
+# bump if the layout of the persisted entries changes
+CACHE_FORMAT_VERSION = 1
+
+
+class SemanticCache(object):
+    """ LRU cache for the semantic data of files
+
+    the first level is keyed by (path, inode, size, mtime_ns) and needs only a stat() call.
+    On a metadata mismatch the content is hashed, so a touched but identical file is still a hit.
+    The optional persistent level keeps the results in a directory, so they survive process restarts -
+    the entries are pickled, so only use a directory that is not writable by untrusted users.
+
+    the results are stored pickled, every hit returns a fresh copy - callers can not corrupt the cache.
+
+    >>> import shutil
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> parse_function = lambda string_data: list(string_data.splitlines())
+    >>> temp_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> path_file = temp_directory / 'updatedb.conf'
+    >>> _ = path_file.write_text('PRUNE_BIND_MOUNTS="yes"\\n')
+
+    >>> semantic_cache = SemanticCache(max_size=8, persistent_directory=temp_directory / 'cache')
+    >>> semantic_cache.get_file_semantic(path_file, grammar, parse_function)
+    ['PRUNE_BIND_MOUNTS="yes"']
+
+    >>> # metadata hit - the result is a copy
+    >>> result = semantic_cache.get_file_semantic(path_file, grammar, parse_function)
+    >>> result.append('corrupted')
+    >>> semantic_cache.get_file_semantic(path_file, grammar, parse_function)
+    ['PRUNE_BIND_MOUNTS="yes"']
+
+    >>> # touched but identical file - content hit
+    >>> os.utime(str(path_file), ns=(0, 0))
+    >>> semantic_cache.get_file_semantic(path_file, grammar, parse_function)
+    ['PRUNE_BIND_MOUNTS="yes"']
+
+    >>> # changed file - miss
+    >>> _ = path_file.write_text('PRUNE_BIND_MOUNTS="no"\\n')
+    >>> semantic_cache.get_file_semantic(path_file, grammar, parse_function)
+    ['PRUNE_BIND_MOUNTS="no"']
+    >>> semantic_cache.statistics()
+    {'hits_metadata': 2, 'hits_content': 1, 'hits_persistent': 0, 'misses': 2, 'evictions': 0, 'size': 2, 'max_size': 8}
+
+    >>> # persistent level survives a new cache instance (process restart)
+    >>> semantic_cache = SemanticCache(max_size=8, persistent_directory=temp_directory / 'cache')
+    >>> semantic_cache.get_file_semantic(path_file, grammar, parse_function)
+    ['PRUNE_BIND_MOUNTS="no"']
+    >>> semantic_cache.statistics()['hits_persistent']
+    1
+    >>> # a corrupt persistent entry is a miss, and is replaced
+    >>> for path_entry in (temp_directory / 'cache').glob('*.pickle'):
+    ...     _ = path_entry.write_bytes(b'corrupt')
+    >>> semantic_cache = SemanticCache(max_size=8, persistent_directory=temp_directory / 'cache')
+    >>> semantic_cache.get_file_semantic(path_file, grammar, parse_function)
+    ['PRUNE_BIND_MOUNTS="no"']
+    >>> semantic_cache.statistics()['misses']
+    1
+    >>> SemanticCache(max_size=8, persistent_directory=temp_directory / 'cache').get_file_semantic(path_file, grammar, parse_function)
+    ['PRUNE_BIND_MOUNTS="no"']
+
+    >>> # the data is decoded like open(path_file, 'r') does it - CRLF line endings become '\\n'
+    >>> _ = path_file.write_bytes(b'PRUNE_BIND_MOUNTS="no"\\r\\n')
+    >>> semantic_cache.get_file_semantic(path_file, grammar, repr)
+    '\\'PRUNE_BIND_MOUNTS="no"\\\\n\\''
+    >>> semantic_cache.clear(persistent=True)
+    >>> semantic_cache.statistics()['size']
+    0
+    >>> shutil.rmtree(str(temp_directory))
+
+    """
+
+    def __init__(self, max_size: int = 256, persistent_directory: Union[None, str, pathlib.Path] = None) -> None:
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.max_size = max_size
+        self.persistent_directory = None    # type: Optional[pathlib.Path]
+        if persistent_directory is not None:
+            self.persistent_directory = pathlib.Path(persistent_directory)
+            self.persistent_directory.mkdir(parents=True, exist_ok=True)
+        # content_key -> pickled semantic data, in LRU order
+        self._by_content = collections.OrderedDict()     # type: collections.OrderedDict
+        # metadata_key -> content_key, in LRU order
+        self._by_metadata = collections.OrderedDict()    # type: collections.OrderedDict
+        # (grammar_key, path) -> metadata_key, to drop outdated metadata keys of a path
+        self._metadata_by_path = dict()                  # type: Dict[Tuple[str, str], Tuple[Any, ...]]
+        self._lock = threading.Lock()
+        self.hits_metadata = 0
+        self.hits_content = 0
+        self.hits_persistent = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_file_semantic(self, path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase,
+                          parse_function: Callable[[str], Any]) -> Any:
+        """ returns a copy of the cached semantic data of the file,
+        parse_function(string_data) is called to create the semantic data on a miss
+        """
+        path_file = os.path.abspath(str(path_file))
+        grammar_key = get_grammar_key(grammar)
+        file_stat = os.stat(path_file)
+        metadata_key = (grammar_key, path_file, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+
+        with self._lock:
+            content_key = self._by_metadata.get(metadata_key)
+            if content_key is not None and content_key in self._by_content:
+                self._by_metadata.move_to_end(metadata_key)
+                self._by_content.move_to_end(content_key)
+                self.hits_metadata += 1
+                return pickle.loads(self._by_content[content_key])
+
+        with open(path_file, 'rb') as data_file:
+            byte_data = data_file.read()
+        content_key = (grammar_key, hashlib.sha256(byte_data).hexdigest())
+
+        with self._lock:
+            pickled_data = self._by_content.get(content_key)
+            if pickled_data is not None:
+                self.hits_content += 1
+                self._store(metadata_key, content_key, pickled_data)
+                return pickle.loads(pickled_data)
+
+        pickled_data = self._load_persistent(content_key)
+        if pickled_data is not None:
+            try:
+                semantic_data = pickle.loads(pickled_data)
+            except Exception:
+                # truncated or corrupt - a miss, the entry is rewritten below
+                self._remove_persistent(content_key)
+            else:
+                with self._lock:
+                    self.hits_persistent += 1
+                    self._store(metadata_key, content_key, pickled_data)
+                return semantic_data
+
+        # decoded like open(path_file, 'r') does it, with universal newlines - the hash is taken from the raw bytes
+        with io.TextIOWrapper(io.BytesIO(byte_data)) as text_file:
+            string_data = text_file.read()
+        semantic_data = parse_function(string_data)
+        pickled_data = pickle.dumps(semantic_data, protocol=pickle.HIGHEST_PROTOCOL)
+        self._save_persistent(content_key, pickled_data)
+        with self._lock:
+            self.misses += 1
+            self._store(metadata_key, content_key, pickled_data)
+        return semantic_data
+
+    def clear(self, persistent: bool = False) -> None:
+        """ empties the in memory cache, and the persistent directory if persistent=True """
+        with self._lock:
+            self._by_content.clear()
+            self._by_metadata.clear()
+            self._metadata_by_path.clear()
+        if persistent and self.persistent_directory is not None:
+            for path_entry in self.persistent_directory.glob('*.pickle'):
+                path_entry.unlink()
+
+    def statistics(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits_metadata': self.hits_metadata, 'hits_content': self.hits_content, 'hits_persistent': self.hits_persistent,
+                    'misses': self.misses, 'evictions': self.evictions, 'size': len(self._by_content), 'max_size': self.max_size}
+
+    def _store(self, metadata_key: Tuple[Any, ...], content_key: Tuple[str, str], pickled_data: bytes) -> None:
+        """ must be called with the lock held """
+        path_key = metadata_key[:2]
+        outdated_metadata_key = self._metadata_by_path.get(path_key)
+        if outdated_metadata_key is not None and outdated_metadata_key != metadata_key:
+            self._by_metadata.pop(outdated_metadata_key, None)
+        self._metadata_by_path[path_key] = metadata_key
+        self._by_metadata[metadata_key] = content_key
+        self._by_metadata.move_to_end(metadata_key)
+        self._by_content[content_key] = pickled_data
+        self._by_content.move_to_end(content_key)
+
+        while len(self._by_content) > self.max_size:
+            self._by_content.popitem(last=False)
+            self.evictions += 1
+        # metadata keys of evicted contents are dropped lazily, the index is bounded anyway
+        while len(self._by_metadata) > self.max_size * 4:
+            evicted_metadata_key, _ = self._by_metadata.popitem(last=False)
+            if self._metadata_by_path.get(evicted_metadata_key[:2]) == evicted_metadata_key:
+                del self._metadata_by_path[evicted_metadata_key[:2]]
+
+    def _get_persistent_path(self, content_key: Tuple[str, str]) -> pathlib.Path:
+        grammar_key, digest = content_key
+        return self.persistent_directory / '{grammar_key}-{digest}.pickle'.format(grammar_key=grammar_key, digest=digest)
+
+    def _load_persistent(self, content_key: Tuple[str, str]) -> Optional[bytes]:
+        if self.persistent_directory is None:
+            return None
+        try:
+            with open(str(self._get_persistent_path(content_key)), 'rb') as cache_file:
+                return cache_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove_persistent(self, content_key: Tuple[str, str]) -> None:
+        try:
+            self._get_persistent_path(content_key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _save_persistent(self, content_key: Tuple[str, str], pickled_data: bytes) -> None:
+        """ atomic write - concurrent processes never see a partially written entry """
+        if self.persistent_directory is None:
+            return
+        file_descriptor, temp_file_name = tempfile.mkstemp(dir=str(self.persistent_directory), suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                temp_file.write(pickled_data)
+            os.replace(temp_file_name, str(self._get_persistent_path(content_key)))
+        except Exception:
+            os.unlink(temp_file_name)
+            raise
+
+
+def get_grammar_key(grammar: grammar_basic.GrammarBase) -> str:
+    """ identifies the grammar and the grammar source, so changed grammars do not hit old results
+
+    >>> get_grammar_key(grammar_basic.GrammarUpdateDbConf())
+    'GrammarUpdateDbConf_v1_...'
+
+    """
+    grammar_class = lib_parser_cache.get_grammar_class(grammar)
+    return '{name}_v{version}_{fingerprint}'.format(name=grammar_class.__name__,
+                                                    version=CACHE_FORMAT_VERSION,
+                                                    fingerprint=lib_parser_cache.get_grammar_fingerprint(grammar_class)[:16])
@@ -0,0 +1,380 @@
+# STDLIB
+import functools
+import mmap
+import pathlib
+import struct
+import sys
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_edit                # type: ignore # pragma: no cover
+from . import lib_parser_cache        # type: ignore # pragma: no cover
+from . import lib_semantic_cache      # type: ignore # pragma: no cover
+
+# bump if the layout changes - snapshots of other versions are rejected, not converted
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_MAGIC = b'CMSS'
+
+# the layout, little endian, every section 4 byte aligned :
+#   header          magic, version, reserved, grammar key (string index), string count, type count, node count, position count,
+#                   key count, string data size
+#   string offsets  uint32 * (string count + 1) into the string data
+#   types           uint32 * type count - the string index of the qualified class name, resolved in the module of the grammar
+#   nodes           node * node count - breadth first, node 0 is the semantic data, the children of a node are consecutive nodes
+#   positions       (node index, start, end) * position count - the source spans of the nodes which have one, by node index
+#   keys            (string index, record index) * key count - the keys of the top level records, sorted by key
+#   string data     utf-8, every distinct string (token, key, value, comment) is stored once
+header_struct = struct.Struct('<4sHHIIIIIII')
+# type index, kind, flags, payload (string index or first child node), child count
+node_struct = struct.Struct('<HBBII')
+position_struct = struct.Struct('<III')
+key_struct = struct.Struct('<II')
+
+KIND_STRING = 0
+KIND_LIST = 1
+KIND_ORDERED_SET = 2
+FLAG_POSITION = 1
+
+
+class SemanticSnapshot(object):
+    """ read only view of a snapshot - nothing is deserialized up front, the records are created when they are accessed
+
+    the buffer can be bytes or a memory map (SemanticSnapshot.open), so a snapshot of a large file is queried
+    without reading it as a whole. The semantic data is equal to the parsed one, with the same types and source positions.
+
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> from configmagick import lib_parse
+    >>> semantic_data = lib_parse.get_semantic_data_from_string('A = "x y" # c\\n# c1\\n\\nB="NFS afs"\\nA="NFS"\\n', grammar)
+    >>> snapshot = SemanticSnapshot(dump_snapshot(semantic_data, grammar), grammar)
+    >>> len(snapshot), snapshot.keys()
+    (5, ['A', 'B'])
+    >>> snapshot[0], snapshot[0].start, snapshot[0].end, type(snapshot[0].values).__name__
+    (['A', ['x', 'y'], '# c', '\\n'], 0, 14, 'MultipleValuesBlankSeparated')
+    >>> snapshot.find_records('A'), snapshot.get_values('A')
+    ([0, 4], ['NFS'])
+    >>> snapshot.get_values('C')
+    Traceback (most recent call last):
+        ...
+    KeyError: 'C'
+    >>> snapshot.get_semantic_data().arpeggio_compose()
+    'A="x y" # c\\n# c1\\n\\nB="NFS afs"\\nA="NFS"\\n'
+
+    """
+
+    def __init__(self, buffer: Any, grammar: grammar_basic.GrammarBase) -> None:
+        self.buffer = buffer
+        self.grammar_class = lib_parser_cache.get_grammar_class(grammar)
+        self._mmap = None       # type: Optional[mmap.mmap]
+        if len(buffer) < header_struct.size:
+            raise ValueError('not a snapshot : the data is too short')
+        (magic, version, _, grammar_key_index, self.string_count, self.type_count, self.node_count, self.position_count, self.key_count,
+         string_data_size) = header_struct.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('not a snapshot : wrong magic {magic!r}'.format(magic=magic))
+        if version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError('the snapshot format version {version} is not supported, expected {expected}'.format(
+                version=version, expected=SNAPSHOT_FORMAT_VERSION))
+        self._string_offsets_offset = header_struct.size
+        self._types_offset = self._string_offsets_offset + (self.string_count + 1) * 4
+        self._nodes_offset = self._types_offset + self.type_count * 4
+        self._positions_offset = self._nodes_offset + self.node_count * node_struct.size
+        self._keys_offset = self._positions_offset + self.position_count * position_struct.size
+        self._string_data_offset = self._keys_offset + self.key_count * key_struct.size
+        if len(buffer) < self._string_data_offset + string_data_size:
+            raise ValueError('the snapshot is truncated')
+        # string index -> str, filled on access
+        self._strings = dict()      # type: Dict[int, str]
+        grammar_key = lib_semantic_cache.get_grammar_key(grammar)
+        if self.get_string(grammar_key_index) != grammar_key:
+            raise ValueError('the snapshot was written for the grammar {snapshot_key}, not for {grammar_key}'.format(
+                snapshot_key=self.get_string(grammar_key_index), grammar_key=grammar_key))
+        self.types = [get_semantic_type(self.grammar_class, self.get_string(string_index))
+                      for string_index in struct.unpack_from('<{count}I'.format(count=self.type_count), buffer, self._types_offset)]
+        root_type_index, root_kind, _, self._first_record, self._record_count = node_struct.unpack_from(buffer, self._nodes_offset)
+        if root_kind == KIND_STRING:
+            raise ValueError('the snapshot holds no record list')
+
+    @classmethod
+    def open(cls, path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase) -> 'SemanticSnapshot':
+        """ memory maps the snapshot file - close() it, or use it as context manager """
+        with open(str(path_file), 'rb') as snapshot_file:
+            mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            snapshot = cls(mapped, grammar)
+        except BaseException:
+            mapped.close()
+            raise
+        snapshot._mmap = mapped
+        return snapshot
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> 'SemanticSnapshot':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        """ the number of top level records """
+        return int(self._record_count)
+
+    def __getitem__(self, index: int) -> Any:
+        """ the top level record, created from the snapshot """
+        if index < 0:
+            index += self._record_count
+        if not 0 <= index < self._record_count:
+            raise IndexError('record index out of range')
+        return self.get_node(self._first_record + index)
+
+    def __iter__(self) -> Iterator[Any]:
+        for index in range(self._record_count):
+            yield self.get_node(self._first_record + index)
+
+    def get_string(self, string_index: int) -> str:
+        string = self._strings.get(string_index)
+        if string is None:
+            start, end = struct.unpack_from('<II', self.buffer, self._string_offsets_offset + string_index * 4)
+            string = str(self.buffer[self._string_data_offset + start:self._string_data_offset + end], 'utf-8')
+            self._strings[string_index] = string
+        return string
+
+    def get_node(self, node_index: int) -> Any:
+        """ the semantic object of the node and its children """
+        type_index, kind, flags, payload, child_count = node_struct.unpack_from(self.buffer, self._nodes_offset + node_index * node_struct.size)
+        if kind == KIND_STRING:
+            value = self.types[type_index](self.get_string(payload))
+        else:
+            value = self.types[type_index](self.get_node(child_index) for child_index in range(payload, payload + child_count))
+        if flags & FLAG_POSITION:
+            grammar_basic.set_position(value, *self._get_position(node_index))
+        return value
+
+    def _get_position(self, node_index: int) -> Tuple[int, int]:
+        """ a binary search in the position section """
+        low, high = 0, self.position_count
+        while low < high:
+            middle = (low + high) // 2
+            if position_struct.unpack_from(self.buffer, self._positions_offset + middle * position_struct.size)[0] < node_index:
+                low = middle + 1
+            else:
+                high = middle
+        _, start, end = position_struct.unpack_from(self.buffer, self._positions_offset + low * position_struct.size)
+        return start, end
+
+    def get_semantic_data(self) -> Any:
+        """ all records - the nodes are created bottom up in one pass, without recursion """
+        buffer = self.buffer
+        string_offsets = struct.unpack_from('<{count}I'.format(count=self.string_count + 1), buffer, self._string_offsets_offset)
+        string_data = str(buffer[self._string_data_offset:self._string_data_offset + string_offsets[-1]], 'utf-8') if self.string_count else ''
+        # the offsets are byte offsets - they are character offsets as long as the data is ascii
+        if len(string_data) != string_offsets[-1]:
+            strings = [self.get_string(string_index) for string_index in range(self.string_count)]
+        else:
+            strings = [string_data[start:end] for start, end in zip(string_offsets, string_offsets[1:])]
+        types = self.types
+        nodes = list(node_struct.iter_unpack(buffer[self._nodes_offset:self._positions_offset]))
+        values = [None] * self.node_count       # type: List[Any]
+        for node_index in range(self.node_count - 1, -1, -1):
+            type_index, kind, _, payload, child_count = nodes[node_index]
+            if kind == KIND_STRING:
+                values[node_index] = types[type_index](strings[payload])
+            else:
+                values[node_index] = types[type_index](values[payload:payload + child_count])
+        for node_index, start, end in position_struct.iter_unpack(buffer[self._positions_offset:self._keys_offset]):
+            value = values[node_index]
+            value.start = start
+            value.end = end
+        return values[0]
+
+    def keys(self) -> List[str]:
+        """ the distinct keys of the top level records, sorted """
+        keys = list()       # type: List[str]
+        for key_index in range(self.key_count):
+            key = self.get_string(key_struct.unpack_from(self.buffer, self._keys_offset + key_index * key_struct.size)[0])
+            if not keys or keys[-1] != key:
+                keys.append(key)
+        return keys
+
+    def find_records(self, key: str) -> List[int]:
+        """ the indices of the top level records with the key, in file order - a binary search in the key section """
+        low, high = 0, self.key_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_key_entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        record_indices = list()     # type: List[int]
+        while low < self.key_count:
+            entry_key, record_index = self._get_key_entry(low)
+            if entry_key != key:
+                break
+            record_indices.append(record_index)
+            low += 1
+        return record_indices
+
+    def get_values(self, key: str) -> List[str]:
+        """ the values of the last assignment of the key, like configmagick.Config.get_values - only that record is created """
+        record_indices = self.find_records(key)
+        if not record_indices:
+            raise KeyError(key)
+        return [str(value) for value in self[record_indices[-1]].values]
+
+    def _get_key_entry(self, key_index: int) -> Tuple[str, int]:
+        string_index, record_index = key_struct.unpack_from(self.buffer, self._keys_offset + key_index * key_struct.size)
+        return self.get_string(string_index), record_index
+
+
+def dump_snapshot(semantic_data: Any, grammar: grammar_basic.GrammarBase) -> bytes:
+    """ the snapshot of the semantic data of the grammar - see the layout at the top of the module
+
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> from configmagick import lib_parse
+    >>> semantic_data = lib_parse.get_semantic_data_from_string('PRUNEFS="NFS afs"\\nA="NFS afs"\\n', grammar)
+    >>> snapshot_data = dump_snapshot(semantic_data, grammar)
+    >>> # the repeated values are stored once
+    >>> snapshot_data[:4], snapshot_data.count(b'NFS'), snapshot_data.count(b'afs')
+    (b'CMSS', 1, 1)
+    >>> dump_snapshot([['A', object()]], grammar)
+    Traceback (most recent call last):
+        ...
+    TypeError: object can not be stored in a snapshot
+    >>> load_snapshot(snapshot_data[:-1], grammar)
+    Traceback (most recent call last):
+        ...
+    ValueError: the snapshot is truncated
+
+    """
+    grammar_class = lib_parser_cache.get_grammar_class(grammar)
+    # str -> string index, in the order of the first use
+    strings = dict()        # type: Dict[str, int]
+    type_indices = dict()   # type: Dict[type, int]
+    type_names = list()     # type: List[int]
+    grammar_key_index = strings.setdefault(lib_semantic_cache.get_grammar_key(grammar), len(strings))
+
+    node_data = list()      # type: List[bytes]
+    position_data = list()  # type: List[bytes]
+    values = [semantic_data]
+    node_index = 0
+    # values grows while it is walked - the children of every container are appended as one block, breadth first
+    while node_index < len(values):
+        value = values[node_index]
+        node_index += 1
+        value_type = type(value)
+        type_index = type_indices.get(value_type)
+        if type_index is None:
+            try:
+                is_semantic_type = get_semantic_type(grammar_class, value_type.__qualname__) is value_type
+            except ValueError:
+                is_semantic_type = False
+            if not is_semantic_type:
+                raise TypeError('{type_name} can not be stored in a snapshot'.format(type_name=value_type.__qualname__))
+            type_index = type_indices[value_type] = len(type_names)
+            type_names.append(strings.setdefault(value_type.__qualname__, len(strings)))
+
+        if isinstance(value, str):
+            kind = KIND_STRING
+            payload = strings.setdefault(str(value), len(strings))
+            child_count = 0
+        else:
+            kind = KIND_LIST if isinstance(value, list) else KIND_ORDERED_SET
+            payload = len(values)
+            # an ordered set is stored with its duplicate values, see ComposeOrderedSet.tokens
+            values.extend(value if kind == KIND_LIST else value.tokens)
+            child_count = len(values) - payload
+
+        start = getattr(value, 'start', None)
+        if start is None:
+            node_data.append(node_struct.pack(type_index, kind, 0, payload, child_count))
+        else:
+            node_data.append(node_struct.pack(type_index, kind, FLAG_POSITION, payload, child_count))
+            position_data.append(position_struct.pack(node_index - 1, start, value.end))
+
+    key_entries = list()    # type: List[Tuple[str, int]]
+    if isinstance(semantic_data, list):
+        for record_index, record in enumerate(semantic_data):
+            key = getattr(record, 'key', None) if isinstance(record, list) else None
+            if isinstance(key, str):
+                key_entries.append((str(key), record_index))
+    key_entries.sort()
+    key_data = [key_struct.pack(strings.setdefault(key, len(strings)), record_index) for key, record_index in key_entries]
+
+    encoded_strings = [string.encode('utf-8') for string in strings]
+    string_offsets = [0]
+    for encoded_string in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(encoded_string))
+
+    header = header_struct.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, 0, grammar_key_index, len(strings), len(type_names),
+                                len(node_data), len(position_data), len(key_data), string_offsets[-1])
+    return b''.join([header, struct.pack('<{count}I'.format(count=len(string_offsets)), *string_offsets),
+                     struct.pack('<{count}I'.format(count=len(type_names)), *type_names)] + node_data + position_data + key_data + encoded_strings)
+
+
+def load_snapshot(snapshot_data: Any, grammar: grammar_basic.GrammarBase) -> Any:
+    """ the semantic data of a snapshot - equal to the parsed semantic data, with the same types and source positions
+
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> from configmagick import lib_parse
+    >>> string_data = (pathlib.Path(__file__).parent.parent / 'tests' / 'updatedb.conf').read_text() + "'ä b'=\\"ö\\" # ü\\n"
+    >>> semantic_data = lib_parse.get_semantic_data_from_string(string_data, grammar)
+    >>> loaded_data = load_snapshot(dump_snapshot(semantic_data, grammar), grammar)
+    >>> assert not lib_parse.get_semantic_data_difference(semantic_data, loaded_data)
+    >>> assert loaded_data.arpeggio_compose() == semantic_data.arpeggio_compose()
+    >>> def get_details(data):
+    ...     return [(type(record), getattr(record, 'start', None), getattr(record, 'end', None),
+    ...              [(type(item), getattr(item, 'start', None)) for item in record] if isinstance(record, list) else None) for record in data]
+    >>> assert get_details(loaded_data) == get_details(semantic_data)
+
+    """
+    return SemanticSnapshot(snapshot_data, grammar).get_semantic_data()
+
+
+def save_snapshot(path_file: Union[str, pathlib.Path], semantic_data: Any, grammar: grammar_basic.GrammarBase) -> None:
+    """ writes the snapshot atomically - readers which mapped the old file keep their view
+
+    >>> import shutil
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> from configmagick import lib_parse
+    >>> test_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> save_snapshot(test_directory / 'updatedb.snapshot', lib_parse.get_semantic_data_from_string('A="x"\\n', grammar), grammar)
+    >>> with SemanticSnapshot.open(test_directory / 'updatedb.snapshot', grammar) as snapshot:
+    ...     snapshot.get_values('A')
+    ['x']
+    >>> SemanticSnapshot.open(test_directory / 'updatedb.snapshot', grammar_basic.GrammarBasic())
+    Traceback (most recent call last):
+        ...
+    ValueError: the snapshot was written for the grammar GrammarUpdateDbConf_v1_..., not for GrammarBasic_v1_...
+    >>> shutil.rmtree(str(test_directory))
+
+    """
+    lib_edit.write_bytes_atomic(path_file, dump_snapshot(semantic_data, grammar))
+
+
+def get_semantic_type(grammar_class: type, qualified_name: str) -> Any:
+    """ the semantic class by its qualified name, in the module of the grammar - only str, list and the str, list and
+    ComposeOrderedSet subclasses of that module can be created from a snapshot
+
+    >>> get_semantic_type(grammar_basic.GrammarUpdateDbConf, 'GrammarBasic.Newline')
+    <class 'configmagick.grammar_basic.GrammarBasic.Newline'>
+    >>> get_semantic_type(grammar_basic.GrammarUpdateDbConf, 'arpeggio.ParserPython')
+    Traceback (most recent call last):
+        ...
+    ValueError: the snapshot refers to the unknown semantic class 'arpeggio.ParserPython'
+
+    """
+    if qualified_name in ('str', 'list'):
+        return str if qualified_name == 'str' else list
+    try:
+        semantic_type = functools.reduce(getattr, qualified_name.split('.'), sys.modules[grammar_class.__module__])
+    except AttributeError:
+        semantic_type = None
+    if not isinstance(semantic_type, type) or not issubclass(semantic_type, (str, list, grammar_basic.ComposeOrderedSet)) \
+            or semantic_type.__module__ != grammar_class.__module__:
+        raise ValueError('the snapshot refers to the unknown semantic class {qualified_name!r}'.format(qualified_name=qualified_name))
+    return semantic_type
@@ -0,0 +1,163 @@
+# STDLIB
+import array
+from typing import Any, Iterator, List, Tuple
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_scanner             # type: ignore # pragma: no cover
+from .lib_scanner import (KIND_ASSIGNMENT, KIND_COMMENT_BLOCK, KIND_NEWLINE, KIND_KEY, KIND_KEY_SINGLE_QUOTED,    # type: ignore # pragma: no cover
+                          KIND_KEY_DOUBLE_QUOTED, KIND_VALUE, KIND_COMMENT)
+
+# the semantic classes the spans are materialized to
+semantic_classes = {KIND_KEY: grammar_basic.GrammarBasic.UnicodeString,
+                    KIND_KEY_SINGLE_QUOTED: grammar_basic.GrammarBasic.SingleQuotedString,
+                    KIND_KEY_DOUBLE_QUOTED: grammar_basic.GrammarBasic.DoubleQuotedString,
+                    KIND_VALUE: grammar_basic.GrammarBasic.UnicodeString,
+                    KIND_COMMENT: grammar_basic.GrammarBasic.CommentShell,
+                    KIND_NEWLINE: grammar_basic.GrammarBasic.Newline}
+
+
+class Span(object):
+    """ a (start, end, kind) reference into the original buffer - the text is only sliced when it is accessed
+
+    >>> span = Span('key="value"', 0, 3, KIND_KEY)
+    >>> span.text
+    'key'
+    >>> span
+    Span(0, 3, 'key')
+    >>> span.materialize().arpeggio_compose()
+    'key'
+
+    """
+    __slots__ = ('buffer', 'start', 'end', 'kind')
+
+    def __init__(self, buffer: str, start: int, end: int, kind: int) -> None:
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.kind = kind
+
+    @property
+    def text(self) -> str:
+        return self.buffer[self.start:self.end]
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return 'Span({start}, {end}, {text!r})'.format(start=self.start, end=self.end, text=self.text)
+
+    def materialize(self) -> Any:
+        """ returns the semantic object (like the visitor would create it) """
+        return semantic_classes[self.kind](self.text)
+
+    def arpeggio_compose(self) -> Any:
+        return self.materialize().arpeggio_compose()
+
+
+class SpanTable(object):
+    """ compact, array backed storage of all the spans of a buffer
+
+    every top level record is stored as a record span, followed by the spans of its tokens.
+    one span needs 17 bytes (plus 8 bytes per record) in the arrays, instead of one python string object (50+ bytes) per token
+    plus the lists holding them.
+
+    >>> span_table = scan_spans('A = "x y" # c\\n# c1\\n\\n')
+    >>> len(span_table)
+    10
+    >>> span_table[0], span_table[1]
+    (Span(0, 14, 'A = "x y" # c\\n'), Span(0, 1, 'A'))
+    >>> [(record, children) for record, children in span_table.iter_records()][2]
+    (Span(19, 20, '\\n'), [])
+    >>> span_table.to_semantic_data()
+    [['A', ['x', 'y'], '# c', '\\n'], ['# c1', '\\n'], '\\n']
+
+    """
+
+    def __init__(self, buffer: str) -> None:
+        self.buffer = buffer
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self.kinds = array.array('B')
+        # the indices of the record spans
+        self.record_indices = array.array('q')
+
+    def append(self, start: int, end: int, kind: int) -> None:
+        self.starts.append(start)
+        self.ends.append(end)
+        self.kinds.append(kind)
+
+    def append_record(self, start: int, end: int, kind: int) -> None:
+        self.record_indices.append(len(self.kinds))
+        self.append(start, end, kind)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> Span:
+        return Span(self.buffer, self.starts[index], self.ends[index], self.kinds[index])
+
+    def get_text(self, index: int) -> str:
+        return self.buffer[self.starts[index]:self.ends[index]]
+
+    def iter_records(self) -> Iterator[Tuple[Span, List[Span]]]:
+        """ yields (record span, [token spans]) - a newline record has no token spans """
+        record_indices = self.record_indices
+        length = len(record_indices)
+        for position, index in enumerate(record_indices):
+            end_index = record_indices[position + 1] if position + 1 < length else len(self.kinds)
+            yield self[index], [self[child_index] for child_index in range(index + 1, end_index)]
+
+    def to_semantic_data(self) -> grammar_basic.ComposeList:
+        """ materializes all spans - the result is identical to the result of the scanner or the arpeggio visitor """
+        records = grammar_basic.ComposeList()
+        for record, children in self.iter_records():
+            if record.kind == KIND_NEWLINE:
+                records.append(grammar_basic.set_position(record.materialize(), record.start, record.end))
+                continue
+            elements = [grammar_basic.set_position(child.materialize(), child.start, child.end) if child.kind == KIND_NEWLINE
+                        else child.materialize() for child in children]
+            semantic_record = None      # type: Any
+            if record.kind == KIND_ASSIGNMENT:
+                values = grammar_basic.GrammarUpdateDbConf.MultipleValuesBlankSeparated(
+                    [element for element, child in zip(elements, children) if child.kind == KIND_VALUE])
+                semantic_record = grammar_basic.GrammarUpdateDbConf.AssignMultipleValuesQuoted(
+                    [elements[0], values] + [element for element, child in zip(elements, children) if child.kind in (KIND_COMMENT, KIND_NEWLINE)])
+            else:
+                semantic_record = grammar_basic.GrammarBasic.CommentShellBlock(elements)
+            records.append(grammar_basic.set_position(semantic_record, record.start, record.end))
+        return records
+
+
+def scan_spans(string_data: str, grammar: Any = grammar_basic.GrammarUpdateDbConf) -> SpanTable:
+    """ scans the string and returns the spans of all records and tokens, no token strings are created
+
+    >>> from configmagick import lib_parse
+    >>> test_data = 'A = "x y" # c\\n# c1\\n# c2\\n\\n"B"=""\\n  \\n'
+    >>> assert not lib_parse.get_semantic_data_difference(scan_spans(test_data).to_semantic_data(),
+    ...                                                   lib_parse.get_semantic_data_differential(test_data, grammar_basic.GrammarUpdateDbConf()))
+
+    """
+    scanner = lib_scanner.get_scanner(grammar)
+    span_table = SpanTable(string_data)
+    append = span_table.append
+    for match in scanner.iter_matches(string_data):
+        kind = match[0]
+        span_table.append_record(match[1], match[2], kind)
+        if kind == KIND_ASSIGNMENT:
+            _, _, _, key_kind, key_start, key_end, value_spans, comment_start, comment_end, newline_position = match
+            append(key_start, key_end, key_kind)
+            for index in range(0, len(value_spans), 2):
+                append(value_spans[index], value_spans[index + 1], KIND_VALUE)
+            if comment_start >= 0:
+                append(comment_start, comment_end, KIND_COMMENT)
+            append(newline_position, newline_position + 1, KIND_NEWLINE)
+        elif kind == KIND_COMMENT_BLOCK:
+            comment_spans = match[3]
+            for index in range(0, len(comment_spans), 3):
+                append(comment_spans[index], comment_spans[index + 1], KIND_COMMENT)
+                append(comment_spans[index + 2], comment_spans[index + 2] + 1, KIND_NEWLINE)
+    return span_table
@@ -0,0 +1,539 @@
+# STDLIB
+import ctypes
+import ctypes.util
+import errno
+import os
+import pathlib
+import select
+import struct
+import sys
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+# PROJ
+from . import grammar_basic           # type: ignore # pragma: no cover
+from . import lib_parse               # type: ignore # pragma: no cover
+from . import lib_semantic_cache      # type: ignore # pragma: no cover
+
+# inotify(7) - the events of a watched directory which can change a file in it
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# files are often replaced by a rename (like lib_edit.write_file_atomic does it), so the directories are watched, not the files
+watch_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# struct inotify_event : int wd, uint32_t mask, uint32_t cookie, uint32_t len, char name[len]
+inotify_event_header = struct.Struct('iIII')
+
+
+class FileWatcherBase(object):
+    """ calls callback(path_file) from a background thread when a watched file might have changed - created, written,
+    replaced, deleted. The callback can be called more than once for one change, and must not block for long """
+
+    def __init__(self, callback: Callable[[str], None]) -> None:
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._thread = None         # type: Optional[threading.Thread]
+        self._stopped = threading.Event()
+
+    def watch(self, path_file: Union[str, pathlib.Path]) -> None:
+        raise NotImplementedError
+
+    def unwatch(self, path_file: Union[str, pathlib.Path]) -> None:
+        raise NotImplementedError
+
+    def start(self) -> 'FileWatcherBase':
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self.run, name='configmagick_{name}'.format(name=type(self).__name__), daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopped.set()
+            self._wake_up()
+            self._thread.join()
+            self._thread = None
+
+    def run(self) -> None:
+        raise NotImplementedError
+
+    def _wake_up(self) -> None:
+        """ interrupts a blocking wait in run() """
+
+    def __enter__(self) -> 'FileWatcherBase':
+        return self.start()
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.stop()
+
+
+class InotifyWatcher(FileWatcherBase):
+    """ Linux inotify through ctypes - the watcher thread sleeps until the kernel reports a change,
+    there is no stat() call per file. Raises OSError if inotify is not available
+
+    when a watched directory is deleted or moved away, its watch is dropped and the directory is polled every poll_interval
+    seconds until it exists again - then it is watched again, and its watched files are reported as changed
+
+    >>> import tempfile, time
+    >>> temp_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> path_file = temp_directory / 'updatedb.conf'
+    >>> _ = path_file.write_text('A="x"\\n')
+    >>> changed = threading.Event()
+    >>> with InotifyWatcher(lambda path: changed.set()) as watcher:
+    ...     watcher.watch(path_file)
+    ...     _ = (temp_directory / 'other.conf').write_text('')     # not watched
+    ...     time.sleep(0.1)
+    ...     changed.is_set()
+    ...     _ = path_file.write_text('A="y"\\n')
+    ...     changed.wait(timeout=10)
+    False
+    True
+
+    >>> # the directory is removed and created again
+    >>> import shutil
+    >>> changed.clear()
+    >>> with InotifyWatcher(lambda path: changed.set(), poll_interval=0.01) as watcher:
+    ...     watcher.watch(path_file)
+    ...     shutil.rmtree(str(temp_directory))
+    ...     changed.wait(timeout=10)
+    ...     changed.clear()
+    ...     temp_directory.mkdir()
+    ...     changed.wait(timeout=10)
+    ...     changed.clear()
+    ...     _ = path_file.write_text('A="z"\\n')
+    ...     changed.wait(timeout=10)
+    True
+    True
+    True
+    >>> shutil.rmtree(str(temp_directory))
+
+    """
+
+    def __init__(self, callback: Callable[[str], None], poll_interval: float = 1.0) -> None:
+        super(InotifyWatcher, self).__init__(callback)
+        self.poll_interval = poll_interval
+        self._libc = get_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+        self._wake_up_read_fd, self._wake_up_write_fd = os.pipe()
+        # watched directory -> (watch descriptor, watched file names), and watch descriptor -> directory
+        self._directories = dict()                  # type: Dict[str, Tuple[int, Set[str]]]
+        self._directory_by_descriptor = dict()      # type: Dict[int, str]
+        # directory which was deleted or moved away -> watched file names, polled until it exists again
+        self._lost_directories = dict()             # type: Dict[str, Set[str]]
+
+    def watch(self, path_file: Union[str, pathlib.Path]) -> None:
+        directory, file_name = os.path.split(os.path.abspath(str(path_file)))
+        with self._lock:
+            if directory in self._directories:
+                self._directories[directory][1].add(file_name)
+                return
+            if directory in self._lost_directories:
+                self._lost_directories[directory].add(file_name)
+                return
+            self._add_watch(directory, {file_name})
+
+    def _add_watch(self, directory: str, file_names: Set[str]) -> None:
+        """ the lock must be held """
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), watch_mask)
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number), directory)
+        self._directories[directory] = (watch_descriptor, file_names)
+        self._directory_by_descriptor[watch_descriptor] = directory
+
+    def unwatch(self, path_file: Union[str, pathlib.Path]) -> None:
+        directory, file_name = os.path.split(os.path.abspath(str(path_file)))
+        with self._lock:
+            if directory in self._lost_directories:
+                self._lost_directories[directory].discard(file_name)
+                if not self._lost_directories[directory]:
+                    del self._lost_directories[directory]
+                return
+            if directory not in self._directories:
+                return
+            watch_descriptor, file_names = self._directories[directory]
+            file_names.discard(file_name)
+            if not file_names:
+                del self._directories[directory]
+                del self._directory_by_descriptor[watch_descriptor]
+                self._libc.inotify_rm_watch(self._fd, watch_descriptor)
+
+    def stop(self) -> None:
+        """ stops the watcher thread and closes the inotify instance - the watcher can not be started again """
+        super(InotifyWatcher, self).stop()
+        for fd in (self._fd, self._wake_up_read_fd, self._wake_up_write_fd):
+            if fd >= 0:
+                os.close(fd)
+        self._fd = self._wake_up_read_fd = self._wake_up_write_fd = -1
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            # without lost directories there is nothing to poll - sleep until the kernel reports an event
+            timeout = self.poll_interval if self._lost_directories else None
+            readable, _, _ = select.select([self._fd, self._wake_up_read_fd], [], [], timeout)
+            if self._wake_up_read_fd in readable:
+                break
+            if not readable:
+                for path_file in self.get_recovered_paths():
+                    self.callback(path_file)
+                continue
+            try:
+                event_data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            for path_file in self.get_changed_paths(event_data):
+                self.callback(path_file)
+
+    def _wake_up(self) -> None:
+        os.write(self._wake_up_write_fd, b'x')
+
+    def get_changed_paths(self, event_data: bytes) -> List[str]:
+        """ the watched files concerned by the events, in order, without duplicates """
+        changed_paths = dict()      # type: Dict[str, None]
+        offset = 0
+        with self._lock:
+            while offset < len(event_data):
+                watch_descriptor, mask, _, name_length = inotify_event_header.unpack_from(event_data, offset)
+                offset += inotify_event_header.size
+                file_name = os.fsdecode(event_data[offset:offset + name_length].rstrip(b'\0'))
+                offset += name_length
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost - every watched file might have changed
+                    for directory, (_, file_names) in self._directories.items():
+                        changed_paths.update(dict.fromkeys(os.path.join(directory, name) for name in file_names))
+                    continue
+                directory = self._directory_by_descriptor.get(watch_descriptor)
+                if directory is None:
+                    continue
+                file_names = self._directories[directory][1]
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    # the directory itself is gone - its watch is dropped (a moved directory would still be watched at its new path),
+                    # the directory is polled until it exists again
+                    changed_paths.update(dict.fromkeys(os.path.join(directory, name) for name in file_names))
+                    del self._directories[directory]
+                    del self._directory_by_descriptor[watch_descriptor]
+                    if mask & IN_MOVE_SELF:
+                        self._libc.inotify_rm_watch(self._fd, watch_descriptor)
+                    self._lost_directories[directory] = file_names
+                elif file_name in file_names:
+                    changed_paths[os.path.join(directory, file_name)] = None
+        return list(changed_paths)
+
+    def get_recovered_paths(self) -> List[str]:
+        """ watches the lost directories which exist again - returns their watched files, they might have changed """
+        recovered_paths = list()    # type: List[str]
+        with self._lock:
+            for directory, file_names in list(self._lost_directories.items()):
+                try:
+                    self._add_watch(directory, file_names)
+                except OSError:
+                    continue
+                del self._lost_directories[directory]
+                recovered_paths.extend(os.path.join(directory, name) for name in file_names)
+        return recovered_paths
+
+
+class PollingWatcher(FileWatcherBase):
+    """ the fallback without inotify : stat() of every watched file every poll_interval seconds
+
+    >>> import tempfile
+    >>> temp_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> path_file = temp_directory / 'updatedb.conf'
+    >>> _ = path_file.write_text('A="x"\\n')
+    >>> changed = threading.Event()
+    >>> with PollingWatcher(lambda path: changed.set(), poll_interval=0.01) as watcher:
+    ...     watcher.watch(path_file)
+    ...     _ = path_file.write_text('A="x y"\\n')
+    ...     changed.wait(timeout=10)
+    True
+    >>> path_file.unlink()
+    >>> temp_directory.rmdir()
+
+    """
+
+    def __init__(self, callback: Callable[[str], None], poll_interval: float = 1.0) -> None:
+        super(PollingWatcher, self).__init__(callback)
+        self.poll_interval = poll_interval
+        # path -> (inode, size, mtime_ns), None if the file does not exist
+        self._metadata = dict()     # type: Dict[str, Optional[Tuple[int, int, int]]]
+
+    def watch(self, path_file: Union[str, pathlib.Path]) -> None:
+        path_file = os.path.abspath(str(path_file))
+        with self._lock:
+            if path_file not in self._metadata:
+                self._metadata[path_file] = get_file_metadata(path_file)
+
+    def unwatch(self, path_file: Union[str, pathlib.Path]) -> None:
+        with self._lock:
+            self._metadata.pop(os.path.abspath(str(path_file)), None)
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.poll_interval):
+            with self._lock:
+                paths = list(self._metadata)
+            for path_file in paths:
+                metadata = get_file_metadata(path_file)
+                with self._lock:
+                    if path_file not in self._metadata or self._metadata[path_file] == metadata:
+                        continue
+                    self._metadata[path_file] = metadata
+                self.callback(path_file)
+
+
+def get_file_metadata(path_file: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        file_stat = os.stat(path_file)
+    except FileNotFoundError:
+        return None
+    return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+
+def get_libc() -> Any:
+    """ the C library with the inotify functions, raises OSError if there is none """
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, 'the C library has no inotify functions')
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def get_file_watcher(callback: Callable[[str], None], poll_interval: float = 1.0) -> FileWatcherBase:
+    """ an InotifyWatcher, or a PollingWatcher if inotify is not available (not Linux, or out of inotify instances)
+
+    >>> watcher = get_file_watcher(print)
+    >>> type(watcher).__name__ in ('InotifyWatcher', 'PollingWatcher')
+    True
+    >>> watcher.stop()
+
+    """
+    try:
+        return InotifyWatcher(callback, poll_interval=poll_interval)
+    except OSError:
+        return PollingWatcher(callback, poll_interval=poll_interval)
+
+
+class Snapshot(NamedTuple):
+    """ the semantic data of a file at one point in time - shared by all readers, do not modify it
+    generation : counts the parses of the file, starting with 1
+    error : the exception of the last reparse - the semantic data is then the one of the last good parse """
+    semantic_data: Any
+    generation: int
+    error: Optional[BaseException] = None
+
+
+class LiveSemanticCache(object):
+    """ keeps the semantic data of the watched files current, for long lived processes which read the same configs often
+
+    the first read of a file parses it and subscribes it to a file watcher (inotify, or polling as fallback).
+    A read of a known file costs a dict lookup - no stat(), no hashing, no copy. On a change :
+        - reparse='eager' : the file is parsed again in a background thread, readers get the previous snapshot
+          until the new one is swapped in - they never wait for the reparse.
+          If the reparse fails (e.g. the file is deleted or invalid) the previous data is kept, with the error
+        - reparse='lazy' : the snapshot is dropped, the next reader parses the file
+    the snapshots are shared, so they must not be modified - copy.deepcopy() them to edit.
+
+    >>> import tempfile, time
+    >>> from configmagick import lib_edit
+    >>> temp_directory = pathlib.Path(tempfile.mkdtemp())
+    >>> path_file = temp_directory / 'updatedb.conf'
+    >>> _ = path_file.write_text('A="x"\\n')
+    >>> grammar = grammar_basic.GrammarUpdateDbConf()
+    >>> def wait_for_generation(cache, generation):
+    ...     for _ in range(1000):
+    ...         snapshot = cache.get_snapshot(path_file, grammar)
+    ...         if snapshot.generation >= generation:
+    ...             return snapshot
+    ...         time.sleep(0.01)
+
+    >>> with LiveSemanticCache(poll_interval=0.01) as live_cache:
+    ...     live_cache.get_file_semantic(path_file, grammar)
+    ...     lib_edit.write_file_atomic(path_file, 'A="x y"\\n')
+    ...     wait_for_generation(live_cache, 2).semantic_data
+    ...     path_file.unlink()
+    ...     snapshot = wait_for_generation(live_cache, 3)
+    ...     snapshot.semantic_data, type(snapshot.error).__name__
+    ...     live_cache.statistics()['parses']
+    [['A', ['x'], '\\n']]
+    [['A', ['x', 'y'], '\\n']]
+    ([['A', ['x', 'y'], '\\n']], 'FileNotFoundError')
+    1
+
+    >>> # lazy - the change only drops the snapshot
+    >>> _ = path_file.write_text('A="x"\\n')
+    >>> with LiveSemanticCache(reparse='lazy', poll_interval=0.01) as live_cache:
+    ...     live_cache.get_file_semantic(path_file, grammar)
+    ...     _ = path_file.write_text('A="x y z"\\n')
+    ...     for _ in range(1000):
+    ...         if not live_cache.is_current(path_file, grammar):
+    ...             break
+    ...         time.sleep(0.01)
+    ...     live_cache.get_file_semantic(path_file, grammar)
+    [['A', ['x'], '\\n']]
+    [['A', ['x', 'y', 'z'], '\\n']]
+
+    >>> LiveSemanticCache(reparse='sometimes')
+    Traceback (most recent call last):
+        ...
+    ValueError: reparse must be 'eager' or 'lazy'
+    >>> import shutil
+    >>> shutil.rmtree(str(temp_directory))
+
+    """
+
+    def __init__(self, backend: str = 'arpeggio', reparse: str = 'eager', poll_interval: float = 1.0,
+                 watcher: Optional[FileWatcherBase] = None) -> None:
+        if reparse not in ('eager', 'lazy'):
+            raise ValueError("reparse must be 'eager' or 'lazy'")
+        self.backend = backend
+        self.reparse = reparse
+        self.watcher = watcher or get_file_watcher(self.invalidate, poll_interval=poll_interval)
+        self.watcher.callback = self.invalidate
+        # (path, grammar key) -> snapshot, replaced as a whole - readers need no lock
+        self._snapshots = dict()            # type: Dict[Tuple[str, str], Snapshot]
+        # path -> {grammar key : grammar}, the grammars a watched file was read with
+        self._grammars_by_path = dict()     # type: Dict[str, Dict[str, grammar_basic.GrammarBase]]
+        # path -> the number of changes reported by the watcher
+        self._change_counts = dict()        # type: Dict[str, int]
+        self._lock = threading.Lock()
+        # the paths to reparse, in the order of the changes - the background thread works them off
+        self._pending = dict()              # type: Dict[str, None]
+        self._pending_condition = threading.Condition(self._lock)
+        self._reparse_thread = None         # type: Optional[threading.Thread]
+        self._stopped = False
+        self.reads = 0
+        self.parses = 0
+        self.reparses = 0
+        self.invalidations = 0
+
+    def start(self) -> 'LiveSemanticCache':
+        self.watcher.start()
+        if self.reparse == 'eager' and self._reparse_thread is None:
+            self._stopped = False
+            self._reparse_thread = threading.Thread(target=self._reparse_pending, name='configmagick_reparse', daemon=True)
+            self._reparse_thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.watcher.stop()
+        if self._reparse_thread is not None:
+            with self._lock:
+                self._stopped = True
+                self._pending_condition.notify()
+            self._reparse_thread.join()
+            self._reparse_thread = None
+
+    def __enter__(self) -> 'LiveSemanticCache':
+        return self.start()
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.stop()
+
+    def get_snapshot(self, path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase) -> Snapshot:
+        """ the current snapshot of the file - parses the file on the first read (and after an invalidation with reparse='lazy') """
+        path_file = os.path.abspath(str(path_file))
+        key = (path_file, lib_semantic_cache.get_grammar_key(grammar))
+        self.reads += 1
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            return snapshot
+        # subscribe before reading, so a change during the parse is not missed
+        with self._lock:
+            self._grammars_by_path.setdefault(path_file, dict())[key[1]] = grammar
+            change_count = self._change_counts.get(path_file, 0)
+        self.watcher.watch(path_file)
+        semantic_data = self._parse(path_file, grammar)
+        with self._lock:
+            self.parses += 1
+            snapshot = self._snapshots.get(key) or Snapshot(semantic_data, generation=1)
+            # the file changed during the parse - the result is not kept, the next read parses again
+            if self._change_counts.get(path_file, 0) == change_count:
+                self._snapshots[key] = snapshot
+        return snapshot
+
+    def get_file_semantic(self, path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase) -> Any:
+        """ the semantic data of the current snapshot - shared, do not modify it """
+        return self.get_snapshot(path_file, grammar).semantic_data
+
+    def is_current(self, path_file: Union[str, pathlib.Path], grammar: grammar_basic.GrammarBase) -> bool:
+        """ True if there is a snapshot which is not invalidated by a change """
+        return (os.path.abspath(str(path_file)), lib_semantic_cache.get_grammar_key(grammar)) in self._snapshots
+
+    def invalidate(self, path_file: str) -> None:
+        """ the watcher callback - drops (lazy) or reparses (eager) the snapshots of the file """
+        with self._lock:
+            self.invalidations += 1
+            self._change_counts[path_file] = self._change_counts.get(path_file, 0) + 1
+            if self.reparse == 'eager':
+                self._pending[path_file] = None
+                self._pending_condition.notify()
+            else:
+                for grammar_key in self._grammars_by_path.get(path_file, {}):
+                    self._snapshots.pop((path_file, grammar_key), None)
+
+    def forget(self, path_file: Union[str, pathlib.Path]) -> None:
+        """ drops the snapshots of the file and stops watching it """
+        path_file = os.path.abspath(str(path_file))
+        self.watcher.unwatch(path_file)
+        with self._lock:
+            for grammar_key in self._grammars_by_path.pop(path_file, {}):
+                self._snapshots.pop((path_file, grammar_key), None)
+            self._pending.pop(path_file, None)
+            self._change_counts.pop(path_file, None)
+
+    def statistics(self) -> Dict[str, int]:
+        with self._lock:
+            return {'files': len(self._grammars_by_path), 'reads': self.reads, 'parses': self.parses,
+                    'reparses': self.reparses, 'invalidations': self.invalidations}
+
+    def _parse(self, path_file: str, grammar: grammar_basic.GrammarBase) -> Any:
+        with open(path_file, 'r') as data_file:
+            string_data = data_file.read()
+        return lib_parse.get_semantic_data_from_string(string_data, grammar=grammar, backend=self.backend)
+
+    def _reparse_pending(self) -> None:
+        """ the background thread of reparse='eager' - a file which changes again during its reparse is reparsed again """
+        while True:
+            with self._lock:
+                while not self._pending and not self._stopped:
+                    self._pending_condition.wait()
+                if self._stopped:
+                    return
+                path_file = next(iter(self._pending))
+                del self._pending[path_file]
+                grammars = dict(self._grammars_by_path.get(path_file, {}))
+            for grammar_key, grammar in grammars.items():
+                key = (path_file, grammar_key)
+                try:
+                    semantic_data = self._parse(path_file, grammar)
+                    error = None        # type: Optional[BaseException]
+                except Exception as exc:
+                    semantic_data, error = None, exc
+                with self._lock:
+                    previous_snapshot = self._snapshots.get(key)
+                    if previous_snapshot is None:
+                        # forgotten meanwhile, or never parsed successfully
+                        continue
+                    if error is not None:
+                        semantic_data = previous_snapshot.semantic_data
+                    self._snapshots[key] = Snapshot(semantic_data, generation=previous_snapshot.generation + 1, error=error)
+                    self.reparses += 1